@@ -0,0 +1,236 @@
+"""Generate synthetic data for benchmarking.
+
+The generated data is deterministic for a given seed, so that results are comparable
+between runs.
+
+- :func:`generate_database` creates a links database with a given number of links,
+  tags and sources. Tags and visits follow Zipfian distributions, most links are
+  never visited while a few are visited very often, and a handful of tags are applied
+  to a large fraction of the links.
+- :func:`generate_inventory` creates a sphinx :code:`objects.inv` file.
+
+Usage::
+
+    $ python benchmarks/generate.py links.db [--links N] [--tags N] [--sources N]
+    $ python benchmarks/generate.py objects.inv --inventory [--links N]
+"""
+import argparse
+import itertools
+import pathlib
+import random
+import sys
+import time
+import zlib
+
+WORDS = [
+    "array",
+    "axis",
+    "buffer",
+    "cache",
+    "client",
+    "config",
+    "context",
+    "data",
+    "dtype",
+    "event",
+    "field",
+    "frame",
+    "graph",
+    "group",
+    "index",
+    "item",
+    "layout",
+    "loader",
+    "matrix",
+    "model",
+    "node",
+    "parser",
+    "path",
+    "plot",
+    "query",
+    "reader",
+    "record",
+    "request",
+    "schema",
+    "series",
+    "session",
+    "socket",
+    "stream",
+    "table",
+    "thread",
+    "token",
+    "transform",
+    "value",
+    "widget",
+    "writer",
+]
+"""Words used to build names, combined with a number they give plenty of variety."""
+
+ROLES = [
+    ("py", "function"),
+    ("py", "class"),
+    ("py", "method"),
+    ("py", "attribute"),
+    ("py", "module"),
+    ("std", "doc"),
+    ("std", "label"),
+]
+
+DAY = 24 * 60 * 60
+
+
+def zipf_weights(n, s=1.1):
+    """Return the cumulative weights of a Zipfian distribution over :code:`n` ranks."""
+    return list(itertools.accumulate(1 / (k ** s) for k in range(1, n + 1)))
+
+
+def make_name(rng, idx):
+    """Return a dotted name that looks like a python object."""
+
+    depth = rng.randint(1, 4)
+    parts = [rng.choice(WORDS) for _ in range(depth)]
+    parts[0] += str(idx % 997)
+
+    return ".".join(parts)
+
+
+def generate_links(rng, n, n_tags):
+    """Generate :code:`n` links as :code:`(name, url, tags)` tuples."""
+
+    tags = [f"tag-{i}" for i in range(n_tags)]
+    weights = zipf_weights(n_tags)
+
+    for idx in range(n):
+        name = make_name(rng, idx)
+        url = name.replace(".", "/") + f".html#{idx}"
+
+        count = rng.randint(1, 4)
+        link_tags = set(rng.choices(tags, cum_weights=weights, k=count))
+
+        yield name, url, sorted(link_tags)
+
+
+def generate_database(
+    filepath, links=1_000_000, tags=20_000, sources=500, visited=0.1, seed=42, now=None
+):
+    """Create a synthetic links database at the given path.
+
+    :param filepath: Where to create the database, it must not exist already
+    :param links: The number of links to create
+    :param tags: The number of distinct tags
+    :param sources: The number of sources, links are spread between them following a
+                    Zipfian distribution
+    :param visited: The fraction of links that have been visited at least once
+    :param seed: The seed for the random number generator
+    :param now: Optional. The time visits are generated relative to
+    """
+
+    from llyfrau.data import Database, Source, bulk_import, recompute_frecency
+
+    rng = random.Random(seed)
+    now = time.time() if now is None else now
+
+    db = Database(filepath, create=True, db_profile="bulk-import")
+    Source.add(
+        db,
+        items=[
+            Source(
+                name=f"Project {i}",
+                uri=f"sphinx://https://project-{i}.readthedocs.io/",
+                prefix=f"https://project-{i}.readthedocs.io/",
+            )
+            for i in range(sources)
+        ],
+    )
+
+    # Decide how many links belong to each source.
+    counts = [0] * sources
+    source_weights = zipf_weights(sources, s=0.8)
+
+    for source_idx in rng.choices(range(sources), cum_weights=source_weights, k=links):
+        counts[source_idx] += 1
+
+    items = generate_links(rng, links, tags)
+
+    for source_idx, count in enumerate(counts):
+        bulk_import(db, itertools.islice(items, count), source_id=source_idx + 1)
+
+    # Most links are never visited, of those that are, a few are visited a lot.
+    n_visited = int(links * visited)
+    visit_weights = zipf_weights(1000, s=1.5)
+
+    counts = []
+    log = []
+
+    for link_id in rng.sample(range(1, links + 1), n_visited):
+        (visits,) = rng.choices(range(1, 1001), cum_weights=visit_weights)
+        counts.append((visits, link_id))
+
+        # Only log the most recent visits, to keep the size of the log reasonable.
+        for _ in range(min(visits, 50)):
+            log.append((link_id, now - rng.uniform(0, 180 * DAY)))
+
+    conn = db.session.connection()
+    conn.exec_driver_sql("UPDATE links SET visits = ? WHERE id = ?", counts)
+    conn.exec_driver_sql(
+        "INSERT INTO visit_log (link_id, visited_at) VALUES (?, ?)", log
+    )
+    db.commit()
+
+    recompute_frecency(db, now=now)
+    db.close()
+
+
+def generate_inventory(filepath, links=10_000, project="Synthetic", seed=42):
+    """Write a synthetic sphinx :code:`objects.inv` with the given number of entries."""
+
+    rng = random.Random(seed)
+    lines = []
+
+    for idx in range(links):
+        name = make_name(rng, idx)
+        domain, role = rng.choice(ROLES)
+        uri = name.split(".")[0] + ".html#$"
+        lines.append(f"{name} {domain}:{role} 1 {uri} -")
+
+    header = (
+        "# Sphinx inventory version 2\n"
+        f"# Project: {project}\n"
+        "# Version: 1.0\n"
+        "# The remainder of this file is compressed using zlib.\n"
+    )
+    body = zlib.compress("\n".join(lines).encode("utf-8") + b"\n")
+
+    pathlib.Path(filepath).write_bytes(header.encode("utf-8") + body)
+
+
+def main():
+    cli = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    cli.add_argument("filepath", help="where to write the generated data")
+    cli.add_argument("--inventory", action="store_true", help="write an objects.inv")
+    cli.add_argument("--links", type=int, default=None, help="the number of links")
+    cli.add_argument("--tags", type=int, default=20_000, help="the number of tags")
+    cli.add_argument("--sources", type=int, default=500, help="the number of sources")
+    cli.add_argument("--seed", type=int, default=42, help="the random seed")
+    args = cli.parse_args()
+
+    if args.inventory:
+        generate_inventory(args.filepath, links=args.links or 10_000, seed=args.seed)
+        return 0
+
+    if pathlib.Path(args.filepath).exists():
+        print(f"{args.filepath} already exists", file=sys.stderr)
+        return 1
+
+    generate_database(
+        args.filepath,
+        links=args.links or 1_000_000,
+        tags=args.tags,
+        sources=args.sources,
+        seed=args.seed,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,468 @@
+"""Time common operations against a large synthetic database.
+
+The database is created with :func:`generate.generate_database` the first time the
+benchmarks are run with a given set of parameters and reused after that, since
+generating a million links takes a while.
+
+Each benchmark is run several times and the fastest and median times are reported.
+Results can be written to a JSON file and compared against the results of an earlier
+run, so that regressions can be spotted between commits.
+
+Usage::
+
+    $ python benchmarks/run.py [--links N] [--runs N] [--output results.json]
+    $ python benchmarks/run.py --compare baseline.json [--threshold 1.2]
+
+Exits with a non-zero status if any benchmark is slower than the baseline by more than
+the given threshold.
+"""
+import argparse
+import contextlib
+import io
+import json
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark.
+
+    The decorated function is called with the benchmark's :class:`Context` before each
+    run to do any setup required and should return the function to be timed.
+    """
+
+    def wrapper(f):
+        BENCHMARKS[name] = f
+        return f
+
+    return wrapper
+
+
+class Context:
+    """Everything the benchmarks need access to."""
+
+    def __init__(self, filepath, workdir):
+        from llyfrau.data import Database
+
+        self.filepath = filepath
+        self.workdir = pathlib.Path(workdir)
+
+        # Bring databases generated by older versions up to date, read only databases
+        # can't be migrated.
+        Database(filepath).close()
+        self.db = Database(filepath, db_profile="read-only", cache_size=0)
+
+    def search(self, records=False, **kwargs):
+        """Return a function that runs the given link search."""
+
+        from llyfrau.data import Link
+
+        def run():
+
+            if records:
+                Link.search_records(self.db, **kwargs)
+            else:
+                Link.search(self.db, eager=True, **kwargs)
+
+            self.db.session.rollback()
+
+        return run
+
+    def close(self):
+        self.db.close()
+
+        if getattr(self, "catalog", None) is not None:
+            self.catalog.close()
+
+
+@benchmark("link.search")
+def _(ctx):
+    return ctx.search()
+
+
+@benchmark("link.search.name")
+def _(ctx):
+    return ctx.search(name="parser")
+
+
+@benchmark("link.search.name.short")
+def _(ctx):
+    return ctx.search(name="ax")
+
+
+@benchmark("link.search.tags.and")
+def _(ctx):
+    return ctx.search(tags=["tag-0", "tag-1"])
+
+
+@benchmark("link.search.tags.or")
+def _(ctx):
+    return ctx.search(tags=["tag-10", "tag-100", "tag-1000"], tag_mode="or")
+
+
+@benchmark("link.search.name.tags")
+def _(ctx):
+    return ctx.search(name="parser", tags=["tag-0"])
+
+
+@benchmark("link.search.sort.visits")
+def _(ctx):
+    return ctx.search(sort="visits")
+
+
+@benchmark("link.search.sort.frecency")
+def _(ctx):
+    return ctx.search(name="parser", sort="frecency")
+
+
+@benchmark("link.search.records")
+def _(ctx):
+    return ctx.search(records=True, sort="frecency", top=50)
+
+
+@benchmark("link.search.page.50")
+def _(ctx):
+    from llyfrau.data import Link
+
+    if not hasattr(ctx, "page_50"):
+        cursor = None
+
+        for _ in range(49):
+            cursor = Link.search(ctx.db, sort="visits", after=cursor).cursor
+
+        ctx.page_50 = cursor
+        ctx.db.session.rollback()
+
+    return ctx.search(sort="visits", after=ctx.page_50)
+
+
+@benchmark("link.search.fuzzy")
+def _(ctx):
+    return ctx.search(name="tranform", fuzzy=True)
+
+
+@benchmark("tag.search")
+def _(ctx):
+    from llyfrau.data import Tag
+
+    def run():
+        Tag.search(ctx.db, name="tag-12")
+        ctx.db.session.rollback()
+
+    return run
+
+
+@benchmark("import.sphinx")
+def _(ctx):
+    from llyfrau.importers import sphinx
+
+    inventory = ctx.workdir / "objects.inv"
+
+    if not inventory.exists():
+        generate.generate_inventory(inventory, links=20_000)
+
+    # Import into a new database each time, rather than updating the last one.
+    filepath = ctx.workdir / "import.db"
+
+    if filepath.exists():
+        filepath.unlink()
+
+    return lambda: sphinx(str(filepath), inventory.resolve().as_uri())
+
+
+def archive_database(ctx):
+    """Return the path to a database of 20,000 imported links to export, and an
+    archive of it to load."""
+
+    from llyfrau.archive import export, open_archive
+    from llyfrau.data import Database
+    from llyfrau.importers import sphinx
+
+    filepath = ctx.workdir / "archive.db"
+    archive = ctx.workdir / "archive.jsonl"
+
+    if not filepath.exists():
+        inventory = ctx.workdir / "objects.inv"
+
+        if not inventory.exists():
+            generate.generate_inventory(inventory, links=20_000)
+
+        sphinx(str(filepath), inventory.resolve().as_uri())
+
+        db = Database(str(filepath))
+
+        with open_archive(str(archive), "w") as stream:
+            export(db, stream)
+
+        db.close()
+
+    return filepath, archive
+
+
+@benchmark("archive.export")
+def _(ctx):
+    from llyfrau.archive import export, open_archive
+    from llyfrau.data import Database
+
+    filepath, _ = archive_database(ctx)
+    output = ctx.workdir / "export.jsonl"
+
+    def run():
+        db = Database(str(filepath), db_profile="read-only")
+
+        with open_archive(str(output), "w") as stream:
+            export(db, stream)
+
+        db.close()
+
+    return run
+
+
+@benchmark("archive.load")
+def _(ctx):
+    from llyfrau.archive import load, open_archive
+    from llyfrau.data import Database
+
+    _, archive = archive_database(ctx)
+
+    # Load into a new database each time, archives can only be loaded into an empty
+    # one.
+    filepath = ctx.workdir / "load.db"
+
+    if filepath.exists():
+        filepath.unlink()
+
+    def run():
+        db = Database(str(filepath), create=True, db_profile="bulk-import")
+
+        with open_archive(str(archive)) as stream:
+            load(db, stream)
+
+        db.close()
+
+    return run
+
+
+@benchmark("cli.sources")
+def _(ctx):
+    from llyfrau.cli import find_sources
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            find_sources(ctx.filepath)
+
+    return run
+
+
+@benchmark("catalog.search")
+def _(ctx):
+    from llyfrau.catalog import Catalog
+
+    if not hasattr(ctx, "catalog"):
+        ctx.catalog = Catalog.load(ctx.filepath)
+
+    return lambda: ctx.catalog.search(name="parser", tags=["tag-0"])
+
+
+@benchmark("tui.search")
+def _(ctx):
+    from prompt_toolkit.application import create_app_session
+    from prompt_toolkit.input import create_pipe_input
+    from prompt_toolkit.output import DummyOutput
+
+    from llyfrau.cli.tui import LinkTable
+
+    if not hasattr(ctx, "table"):
+        ctx.stack = contextlib.ExitStack()
+        pipe = ctx.stack.enter_context(create_pipe_input())
+        ctx.stack.enter_context(create_app_session(input=pipe, output=DummyOutput()))
+
+        ctx.table = LinkTable(ctx.filepath, db_profile="read-only")
+
+        # Prefetching the next page happens in the background, don't let it compete
+        # with the search being timed.
+        ctx.table.searcher.close()
+
+        # Time searching the catalog, rather than building it.
+        ctx.table._get_catalog(ctx.table.db)
+
+        if ctx.table._catalog_thread is not None:
+            ctx.table._catalog_thread.join()
+
+    table = ctx.table
+
+    def run():
+        args = dict(query="parser #tag-0")
+        table._show_results((args, table._search(table.db, **args)))
+
+    return run
+
+
+def timeit(f, ctx, runs):
+    """Run the given benchmark, returning the time taken by each run."""
+
+    times = []
+
+    for _ in range(runs):
+        run = f(ctx)
+
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def git_commit():
+    """Return the commit the benchmarks are being run against, if known."""
+
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            cwd=pathlib.Path(__file__).parent,
+            text=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return result.stdout.strip()
+
+
+def compare(results, baseline, threshold):
+    """Compare the results against a baseline, returning the names of regressions."""
+
+    regressions = []
+
+    for name, result in results.items():
+        previous = baseline.get(name)
+
+        if previous is None:
+            continue
+
+        ratio = result["min"] / previous["min"]
+        status = ""
+
+        if ratio > threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+
+        print(
+            f"{name:<28} {previous['min'] * 1000:10.2f}ms -> "
+            f"{result['min'] * 1000:10.2f}ms {ratio:6.2f}x {status}"
+        )
+
+    return regressions
+
+
+def main():
+    cli = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    cli.add_argument("--links", type=int, default=1_000_000, help="number of links")
+    cli.add_argument("--tags", type=int, default=20_000, help="number of tags")
+    cli.add_argument("--sources", type=int, default=500, help="number of sources")
+    cli.add_argument("--seed", type=int, default=42, help="the random seed")
+    cli.add_argument("--runs", type=int, default=10, help="times to run each benchmark")
+    cli.add_argument("--filter", default="", help="only run matching benchmarks")
+    cli.add_argument(
+        "--data-dir",
+        default=".benchmarks",
+        help="where to keep generated databases (default: .benchmarks)",
+    )
+    cli.add_argument("--output", help="write the results to the given JSON file")
+    cli.add_argument("--compare", help="compare against results in the given file")
+    cli.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="slowdown relative to --compare that counts as a regression",
+    )
+    args = cli.parse_args()
+
+    params = {
+        "links": args.links,
+        "tags": args.tags,
+        "sources": args.sources,
+        "seed": args.seed,
+    }
+
+    data_dir = pathlib.Path(args.data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    name = "links-{links}-{tags}-{sources}-{seed}.db".format(**params)
+    filepath = data_dir / name
+
+    if not filepath.exists():
+        print(f"Generating {filepath}...", file=sys.stderr)
+
+        # Don't leave a half finished database around if interrupted.
+        partial = filepath.with_suffix(".partial")
+
+        if partial.exists():
+            partial.unlink()
+
+        generate.generate_database(str(partial), now=0, **params)
+        partial.rename(filepath)
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        ctx = Context(str(filepath), workdir)
+
+        try:
+            for name, f in BENCHMARKS.items():
+
+                if args.filter not in name:
+                    continue
+
+                times = timeit(f, ctx, args.runs)
+                results[name] = {
+                    "min": min(times),
+                    "median": statistics.median(times),
+                    "runs": len(times),
+                }
+
+                print(
+                    f"{name:<28} min {min(times) * 1000:10.2f}ms "
+                    f"median {statistics.median(times) * 1000:10.2f}ms"
+                )
+        finally:
+            if hasattr(ctx, "stack"):
+                ctx.stack.close()
+
+            ctx.close()
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "params": params,
+            "results": results,
+        }
+        pathlib.Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+    if not args.compare:
+        return 0
+
+    baseline = json.loads(pathlib.Path(args.compare).read_text())
+
+    if baseline.get("params") != params:
+        print("Warning: the baseline was run with different parameters")
+
+    print()
+    regressions = compare(results, baseline["results"], args.threshold)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""Measure how long it takes for :code:`llyfr` to start up.
+
+Each command is run several times in a fresh interpreter and the fastest time is
+compared against a budget. Budgets are measured relative to starting an interpreter
+that does nothing, so that they mean the same thing on fast and slow machines.
+
+Usage::
+
+    $ python benchmarks/startup.py [--runs N]
+
+Exits with a non-zero status if any command goes over its budget.
+"""
+import argparse
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+BUDGETS = {
+    "--version": 0.1,
+    "sources": 0.8,
+}
+"""The time (in seconds) each command may take, on top of starting the interpreter."""
+
+
+def timeit(args, runs):
+    """Return the fastest time taken to run the given command."""
+
+    times = []
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def create_database(filepath):
+    from llyfrau.data import Database, Source
+
+    db = Database(filepath, create=True)
+    Source.add(
+        db,
+        items=[
+            Source(name=f"Source {i}", uri=f"sphinx://{i}", prefix=f"https://{i}/")
+            for i in range(20)
+        ],
+    )
+    db.close()
+
+
+def main():
+    cli = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    cli.add_argument("--runs", type=int, default=10, help="times to run each command")
+    args = cli.parse_args()
+
+    failed = False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filepath = str(pathlib.Path(tmp, "links.db"))
+        create_database(filepath)
+
+        baseline = timeit([sys.executable, "-c", "pass"], args.runs)
+        print(f"{'interpreter':<12} {baseline * 1000:8.1f}ms")
+
+        for command, budget in BUDGETS.items():
+            cmd = [sys.executable, "-m", "llyfrau", "-f", filepath, command]
+            elapsed = timeit(cmd, args.runs) - baseline
+
+            status = "ok" if elapsed <= budget else "OVER BUDGET"
+            failed = failed or elapsed > budget
+
+            print(
+                f"{command:<12} {elapsed * 1000:8.1f}ms "
+                f"(budget {budget * 1000:.0f}ms) {status}"
+            )
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
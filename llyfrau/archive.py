@@ -0,0 +1,356 @@
+"""Export databases to, and load them from, JSON Lines archives.
+
+An archive starts with a header, followed by a line for each source, tag, link and
+visit in the database, in that order::
+
+    {"type": "llyfr", "version": 1}
+    {"type": "source", "id": 1, "name": "Python", "prefix": "https://...", ...}
+    {"type": "tag", "id": 1, "name": "code"}
+    {"type": "link", "id": 1, "name": "print", "url": "...", ..., "tags": [1]}
+    {"type": "visit", "id": 1, "link_id": 1, "visited_at": 1600000000.0}
+
+Rows keep their ids, so an archive can only be loaded into an empty database. The
+full text index, bitmap index and statistics aren't exported, they're rebuilt from
+the links once they've been loaded.
+
+Both :func:`export` and :func:`load` stream rows :data:`~llyfrau.data.BATCH_SIZE`
+at a time, so they use the same amount of memory whatever the size of the database.
+Archives can be compressed with :code:`gzip`, or :code:`zstd` if the
+:code:`zstandard` package is installed, see :func:`open_archive`.
+"""
+import collections
+import contextlib
+import gzip
+import io
+import itertools
+import json
+import operator
+import pathlib
+import sys
+
+from sqlalchemy import Float, func, literal, select, text
+
+from . import bitmaps, stats
+from .data import BATCH_SIZE, Link, Source, Tag, Visit, batched, bulk_insert
+from .data import tag_association_table
+
+HEADER = "llyfr"
+"""The type of the first line in every archive."""
+
+FORMAT_VERSION = 1
+"""The version of the archive format written by :func:`export`."""
+
+TABLES = {
+    "source": Source.__table__,
+    "tag": Tag.__table__,
+    "link": Link.__table__,
+    "visit": Visit.__table__,
+}
+"""The table each type of line in an archive is stored in, in the order they're
+written."""
+
+COMPRESSION = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+"""The compression used by default for archives with each file extension."""
+
+MAGIC = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+"""The bytes compressed archives start with."""
+
+link_tag_ids = (
+    select(func.json_group_array(tag_association_table.c.tag_id))
+    .where(tag_association_table.c.link_id == Link.id)
+    .scalar_subquery()
+)
+"""The ids of a link's tags, as a JSON array.
+
+The :code:`tag_associations` table's primary key stores them in order, so they
+can be read for each link in turn without sorting the whole table."""
+
+GZIP_LEVEL = 1
+"""The gzip compression level, archives are mostly urls which compress well even at
+the fastest level."""
+
+
+@contextlib.contextmanager
+def open_archive(path, mode="r", compression=None):
+    """Open the archive at the given path as a text stream.
+
+    :param path: The path to the archive, :code:`"-"` means stdin or stdout.
+    :param mode: :code:`"r"` to read the archive or :code:`"w"` to write it.
+    :param compression: :code:`"gzip"`, :code:`"zstd"` or :code:`None`. When
+                        writing, this defaults to the compression matching the path's
+                        extension. When reading, it's detected from the archive.
+    """
+
+    if mode not in {"r", "w"}:
+        raise ValueError(f"Unknown mode: {mode!r}")
+
+    if path == "-":
+        raw = sys.stdin.buffer if mode == "r" else sys.stdout.buffer
+    else:
+        raw = open(path, mode + "b")
+
+    try:
+
+        if compression is None and mode == "w":
+            compression = COMPRESSION.get(pathlib.Path(path).suffix)
+
+        if compression is None and mode == "r":
+            start = raw.peek(4)[:4]
+            compression = next(
+                (name for magic, name in MAGIC.items() if start.startswith(magic)),
+                None,
+            )
+
+        stream = _wrap(raw, mode, compression)
+
+        try:
+            yield stream
+        finally:
+
+            # Don't close stdin or stdout along with the archive.
+            if compression is None:
+                stream.detach()
+            else:
+                stream.close()
+
+    finally:
+
+        if path != "-":
+            raw.close()
+
+
+def _wrap(raw, mode, compression):
+    """Return a text stream reading or writing the given binary file, decompressing
+    or compressing it as needed.
+
+    Closing the stream doesn't close the file.
+    """
+
+    if compression is None:
+        return io.TextIOWrapper(raw, encoding="utf-8")
+
+    if compression == "gzip":
+        compressed = gzip.GzipFile(
+            fileobj=raw, mode=mode + "b", compresslevel=GZIP_LEVEL
+        )
+        return io.TextIOWrapper(compressed, encoding="utf-8")
+
+    if compression != "zstd":
+        raise ValueError(f"Unknown compression: {compression!r}")
+
+    try:
+        import zstandard
+    except ImportError as err:
+        raise ValueError(
+            "zstd compression requires the zstandard package, "
+            "install it with: pip install llyfrau[zstd]"
+        ) from err
+
+    if mode == "w":
+        compressed = zstandard.ZstdCompressor().stream_writer(raw, closefd=False)
+        return io.TextIOWrapper(compressed, encoding="utf-8")
+
+    compressed = zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+    return io.TextIOWrapper(io.BufferedReader(compressed), encoding="utf-8")
+
+
+def export(db, stream, batch_size=BATCH_SIZE):
+    """Write the contents of the given database to an archive.
+
+    Everything is read in the same transaction, so the archive is a consistent
+    snapshot even if the database is changed while it's being exported.
+
+    :param db: The database to export
+    :param stream: The text stream to write the archive to, see :func:`open_archive`
+    :param batch_size: The number of rows to read from the database at a time.
+    :returns: The number of lines written of each type.
+    """
+
+    conn = db.session.connection().execution_options(yield_per=batch_size)
+    written = collections.Counter()
+
+    # The driver doesn't start a transaction for a SELECT, without one each table
+    # would be read from a different snapshot.
+    snapshot = not conn.connection.dbapi_connection.in_transaction
+
+    if snapshot:
+        conn.execute(text("BEGIN"))
+
+    header = {"type": HEADER, "version": FORMAT_VERSION}
+    stream.write(json.dumps(header, separators=(",", ":")) + "\n")
+
+    try:
+
+        for kind, table in TABLES.items():
+            query, reals = _lines(kind, table)
+
+            for rows in conn.execute(query).partitions():
+                stream.write("".join(_line(row, reals) for row in rows))
+                written[kind] += len(rows)
+
+    finally:
+
+        if snapshot:
+            db.session.rollback()
+
+    return written
+
+
+def _lines(kind, table):
+    """Return the query selecting each row of the given table as a line of the
+    archive, along with the names of its :code:`REAL` columns.
+
+    Each line is built by SQLite, apart from the :code:`REAL` columns since SQLite
+    only writes floats to 15 significant digits. Those are selected as they are, to
+    be added to the line by :func:`_line`.
+    """
+
+    reals = [c for c in table.columns if isinstance(c.type, Float)]
+    fields = [literal("type"), literal(kind)]
+
+    for column in table.columns:
+
+        if column not in reals:
+            fields.extend([literal(column.name), column])
+
+    if kind == "link":
+        fields.extend([literal("tags"), func.json(link_tag_ids)])
+
+    query = select(func.json_object(*fields), *reals).order_by(table.c.id)
+    return query, [c.name for c in reals]
+
+
+def _line(row, reals):
+    """Finish a line selected by the query from :func:`_lines`."""
+
+    line, *values = row
+
+    if len(values) == 0:
+        return line + "\n"
+
+    # Python's repr of a float round trips exactly.
+    extra = "".join(
+        f',"{name}":' + ("null" if value is None else repr(value))
+        for name, value in zip(reals, values)
+    )
+    return line[:-1] + extra + "}\n"
+
+
+def load(db, stream, batch_size=BATCH_SIZE):
+    """Load an archive written by :func:`export` into the given database.
+
+    Rows are inserted with :func:`~llyfrau.data.bulk_insert`, in batches of
+    :code:`batch_size`. The database must be empty.
+
+    :param db: The database to load the archive into
+    :param stream: The text stream to read the archive from, see :func:`open_archive`
+    :param batch_size: The number of rows to write with each call to the database.
+    :returns: The number of lines loaded of each type.
+    """
+
+    lines = (line for line in stream if line.strip())
+    header = json.loads(next(lines, "null"))
+
+    if not isinstance(header, dict) or header.get("type") != HEADER:
+        raise ValueError("Not a llyfr archive")
+
+    if header.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(f"Unsupported archive version: {header['version']}")
+
+    conn = db.session.connection()
+
+    # The driver only starts a transaction before changing any rows, the indexes and
+    # triggers dropped below have to be part of it too. Take the write lock before
+    # checking that the database is empty, in case something else is writing to it.
+    if not conn.connection.dbapi_connection.in_transaction:
+        conn.execute(text("BEGIN IMMEDIATE"))
+
+    used = " UNION ALL ".join(f"SELECT 1 FROM {t.name}" for t in TABLES.values())
+
+    if conn.execute(text(f"SELECT EXISTS ({used})")).scalar():
+        db.session.rollback()
+        raise ValueError("Archives can only be loaded into an empty database")
+
+    loaded = collections.Counter()
+    records = (json.loads(line) for line in lines)
+
+    # Rather than updating the indexes and running the triggers for every row, drop
+    # them while loading and recreate them at the end. If anything goes wrong
+    # they're restored by the rollback.
+    schema = _schema(conn)
+
+    try:
+
+        for type_, name, _ in schema:
+            conn.execute(text(f'DROP {type_.upper()} "{name}"'))
+
+        for kind, group in itertools.groupby(records, key=operator.itemgetter("type")):
+
+            if kind not in TABLES:
+                raise ValueError(f"Unknown line type: {kind!r}")
+
+            for batch in batched(group, batch_size):
+                _insert(db, kind, batch, batch_size)
+                loaded[kind] += len(batch)
+
+        for _, _, sql in schema:
+            conn.execute(text(sql))
+
+        _rebuild(db)
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+    db.tag_resolver.clear()
+    db.commit()
+
+    return loaded
+
+
+def _schema(conn):
+    """Return the :code:`(type, name, sql)` of the indexes and triggers on the tables
+    loaded from an archive, indexes first."""
+
+    tables = [*(t.name for t in TABLES.values()), tag_association_table.name]
+    query = text(
+        "SELECT type, name, sql FROM sqlite_master "
+        "WHERE type IN ('index', 'trigger') AND sql IS NOT NULL "
+        "AND tbl_name IN (SELECT value FROM json_each(:tables)) "
+        "ORDER BY type = 'trigger', name"
+    )
+
+    return conn.execute(query, {"tables": json.dumps(tables)}).all()
+
+
+def _rebuild(db):
+    """Rebuild everything derived from the loaded links, since none of it was kept
+    up to date while they were inserted."""
+
+    conn = db.session.connection()
+
+    if db.fts:
+        conn.execute(text("INSERT INTO links_fts (links_fts) VALUES ('rebuild')"))
+
+    db.bump_generation(tags=True)
+
+    if db.tag_bitmaps:
+        bitmaps.rebuild(conn)
+
+    if db.link_counts:
+        stats.update(conn, "tag")
+        stats.update(conn, "source")
+
+
+def _insert(db, kind, records, batch_size):
+    """Insert a batch of records of the given type."""
+
+    table = TABLES[kind]
+    columns = [c.name for c in table.columns if c.name in records[0]]
+    rows = [tuple(r.get(c) for c in columns) for r in records]
+
+    bulk_insert(db, table, rows, columns=columns, batch_size=batch_size)
+
+    if kind == "link":
+        associations = [(r["id"], tag_id) for r in records for tag_id in r["tags"]]
+        bulk_insert(db, tag_association_table, associations, batch_size=batch_size)
@@ -0,0 +1,428 @@
+"""A bitmap index over the links that have each of the most common tags.
+
+Importers tag large fractions of all links with the same few tags (:code:`py`,
+:code:`function`, the name of the importer...), so selecting links by one of those
+tags means reading most of the :code:`tag_associations` table. Instead, for each
+tag that's common enough, the index stores a bitmap in the :code:`tag_bitmaps`
+table where bit :code:`i` is set if the link with id :code:`i` has the tag. Tags can
+then be combined with :code:`AND`, :code:`OR` and :code:`NOT` using Python's integer
+operators, without going through the database.
+
+Much like the containers in a roaring bitmap, a set of links is either
+
+- a sorted :class:`list` of ids, for tags with only a few links. These are read
+  straight from the :code:`tag_associations` table when needed, its index already
+  stores them in order.
+- an :class:`int` bitmap, for tags with at least :data:`BITMAP_MIN_LINKS` links,
+  covering at least one in :data:`BITMAP_RATIO` link ids. At that point the bitmap
+  takes up less space than the list of ids would.
+
+Keeping the index up to date
+----------------------------
+
+Every transaction that changes the tags of links bumps the :code:`tag_generation`
+counter in the :code:`meta` table (see :func:`~llyfrau.migrations.bump_generation`),
+the index records the generation it's up to date with. Code that changes the tags
+of links in bulk wraps the changes in a :class:`BitmapIndex`, which applies them to
+the bitmaps incrementally, bumping the generation before saving the index. Changes
+made any other way leave the index stale, in which case it's ignored until the next
+time it's rebuilt.
+"""
+import array
+import collections
+import json
+import sys
+
+from sqlalchemy import text
+
+Selection = collections.namedtuple("Selection", "links,negated,sparse")
+"""The links selected by some combination of tags, see :func:`evaluate`.
+
+If :code:`negated` is :code:`True`, the selection is every link *not* in
+:code:`links`. :code:`sparse` is :code:`True` if there are few enough :code:`links`
+that they're best used as a list of ids, see :data:`SCAN_RATIO`.
+"""
+
+BITMAP_MIN_LINKS = 1000
+"""The minimum number of links a tag needs to have a bitmap."""
+
+BITMAP_RATIO = 32
+"""A tag has a bitmap if at least one in :code:`BITMAP_RATIO` link ids have the tag.
+
+This is the number of bits it takes to store an id, so it's the point at which a
+bitmap is smaller than the list of ids it replaces."""
+
+SCAN_RATIO = 50
+"""A set of links is used as a list of ids, rather than checking each link against
+it in turn, if less than one in :code:`SCAN_RATIO` link ids are in the set."""
+
+
+def is_fresh(conn):
+    """Determine if the index is up to date with the :code:`tag_associations`
+    table."""
+
+    query = text(
+        "SELECT key, value FROM meta WHERE key IN ('tag_generation', 'tag_bitmaps')"
+    )
+    values = dict(conn.execute(query).all())
+
+    return len(values) == 2 and values["tag_bitmaps"] == values["tag_generation"]
+
+
+def load(conn, tag_ids):
+    """Return the bitmaps of the given tags.
+
+    Tags without a bitmap are left out, if the index is stale this returns
+    :code:`None`.
+    """
+
+    if not is_fresh(conn):
+        return None
+
+    query = text("SELECT bitmap FROM tag_bitmaps WHERE tag_id = :tag_id")
+    bitmaps = {}
+
+    for tag_id in set(tag_ids):
+        blob = conn.execute(query, {"tag_id": tag_id}).scalar()
+
+        if blob is not None:
+            bitmaps[tag_id] = int.from_bytes(blob, "little")
+
+    return bitmaps
+
+
+def evaluate(conn, tag_ids, mode="and", exclude_ids=()):
+    """Select links by tag using the index.
+
+    :param conn: The connection to read the index through
+    :param tag_ids: Select the links with these tags
+    :param mode: :code:`"and"` to select the links with all of :code:`tag_ids`,
+                 :code:`"or"` for any of them.
+    :param exclude_ids: Don't select links with any of these tags
+    :returns: A :class:`Selection`, or :code:`None` if none of the tags have a
+              bitmap or the index is stale. Either way, the index won't help.
+    """
+
+    bitmaps = load(conn, [*tag_ids, *exclude_ids])
+
+    if not bitmaps:
+        return None
+
+    def links(tag_id):
+        return bitmaps[tag_id] if tag_id in bitmaps else tagged(conn, tag_id)
+
+    excluded = [links(tag_id) for tag_id in exclude_ids]
+
+    if len(tag_ids) == 0:
+        selected, negated = union(excluded), True
+    else:
+        included = [links(tag_id) for tag_id in tag_ids]
+        selected = intersection(included) if mode == "and" else union(included)
+        selected, negated = difference(selected, excluded), False
+
+    sparse = cardinality(selected) * SCAN_RATIO < bitmap_size(conn)
+    return Selection(selected, negated, sparse)
+
+
+def tagged(conn, tag_id):
+    """Return the sorted ids of the links with the given tag."""
+
+    query = text("SELECT link_id FROM tag_associations WHERE tag_id = :tag_id")
+    return [link_id for (link_id,) in conn.execute(query, {"tag_id": tag_id})]
+
+
+def rebuild(conn):
+    """Rebuild the index from scratch."""
+
+    size = bitmap_size(conn)
+    counts = conn.execute(
+        text("SELECT tag_id, count(*) FROM tag_associations GROUP BY tag_id")
+    ).all()
+
+    conn.execute(text("DELETE FROM tag_bitmaps"))
+
+    for tag_id, count in counts:
+
+        if is_dense(count, size):
+            _store(conn, tag_id, to_bitmap(tagged(conn, tag_id)))
+
+    _stamp(conn)
+
+
+def is_dense(count, size):
+    """Determine if a tag with :code:`count` links should have a bitmap.
+
+    :param count: The number of links with the tag
+    :param size: One more than the largest link id
+    """
+    return count >= BITMAP_MIN_LINKS and count * BITMAP_RATIO >= size
+
+
+class BitmapIndex:
+    """Applies changes to the tags of links to the index.
+
+    Create one before changing any tags, so that it can tell if the index was up to
+    date beforehand. Report each change with :meth:`add` and :meth:`remove` then call
+    :meth:`save` once all the changes have been made, in the same transaction.
+
+    :param conn: The connection the changes are made through
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.fresh = is_fresh(conn)
+        self._added = collections.defaultdict(list)
+        self._removed = []
+
+    def add(self, associations):
+        """Record new :code:`(link_id, tag_id)` pairs."""
+
+        for link_id, tag_id in associations:
+            self._added[tag_id].append(link_id)
+
+    def remove(self, link_ids):
+        """Record that all the tags of the given links were removed."""
+        self._removed.extend(link_ids)
+
+    def save(self):
+        """Bring the index up to date.
+
+        Only the bitmaps of the tags that changed are rewritten. If the index was
+        stale to begin with it's rebuilt from scratch instead.
+        """
+
+        if not self.fresh:
+            rebuild(self.conn)
+            return
+
+        if len(self._added) == 0 and len(self._removed) == 0:
+            _stamp(self.conn)
+            return
+
+        size = bitmap_size(self.conn)
+
+        # Removing links could affect any of the bitmaps.
+        if len(self._removed) > 0:
+            query = text("SELECT tag_id, bitmap FROM tag_bitmaps")
+        else:
+            query = text(
+                "SELECT tag_id, bitmap FROM tag_bitmaps "
+                "WHERE tag_id IN (SELECT value FROM json_each(:tag_ids))"
+            )
+
+        rows = self.conn.execute(query, {"tag_ids": json.dumps(list(self._added))})
+        bitmaps = {tag_id: int.from_bytes(blob, "little") for tag_id, blob in rows}
+        changed = set()
+
+        removed = to_bitmap(self._removed)
+
+        for tag_id, bitmap in bitmaps.items():
+
+            if bitmap & removed:
+                bitmaps[tag_id] = bitmap & ~removed
+                changed.add(tag_id)
+
+        for tag_id, link_ids in self._added.items():
+
+            if tag_id in bitmaps:
+                bitmaps[tag_id] |= to_bitmap(link_ids)
+                changed.add(tag_id)
+
+        # Tags may have gained enough links to need a bitmap.
+        sparse = [tag_id for tag_id in self._added if tag_id not in bitmaps]
+        query = text(
+            "SELECT tag_id, count(*) FROM tag_associations "
+            "WHERE tag_id IN (SELECT value FROM json_each(:tag_ids)) GROUP BY tag_id"
+        )
+
+        for tag_id, count in self.conn.execute(query, {"tag_ids": json.dumps(sparse)}):
+
+            if is_dense(count, size):
+                bitmaps[tag_id] = to_bitmap(tagged(self.conn, tag_id))
+                changed.add(tag_id)
+
+        for tag_id in changed:
+            bitmap = bitmaps[tag_id]
+
+            # Only give up on a bitmap once it's well below the threshold, so that
+            # tags close to it don't keep switching back and forth.
+            if is_dense(2 * _popcount(bitmap), size):
+                _store(self.conn, tag_id, bitmap)
+            else:
+                self.conn.execute(
+                    text("DELETE FROM tag_bitmaps WHERE tag_id = :tag_id"),
+                    {"tag_id": tag_id},
+                )
+
+        self._added.clear()
+        self._removed.clear()
+        _stamp(self.conn)
+
+
+def bitmap_size(conn):
+    """Return the number of bits needed to store a bitmap of every link, one more
+    than the largest link id."""
+    return (conn.execute(text("SELECT max(id) FROM links")).scalar() or 0) + 1
+
+
+def _popcount(bitmap):
+    """Return the number of bits set in the given bitmap.
+
+    :code:`int.bit_count()` would be faster, but it needs Python 3.10.
+    """
+    return bin(bitmap).count("1")
+
+
+def _store(conn, tag_id, bitmap):
+    """Write the bitmap of the given tag."""
+
+    conn.execute(
+        text(
+            "INSERT OR REPLACE INTO tag_bitmaps (tag_id, links, bitmap) "
+            "VALUES (:tag_id, :links, :bitmap)"
+        ),
+        {"tag_id": tag_id, "links": _popcount(bitmap), "bitmap": to_bytes(bitmap)},
+    )
+
+
+def _stamp(conn):
+    """Record that the index is up to date with the current generation."""
+
+    conn.execute(
+        text(
+            "UPDATE meta SET value = "
+            "(SELECT value FROM meta WHERE key = 'tag_generation') "
+            "WHERE key = 'tag_bitmaps'"
+        )
+    )
+
+
+def to_bitmap(ids):
+    """Return the bitmap with the bits for the given ids set."""
+
+    if isinstance(ids, int):
+        return ids
+
+    if len(ids) == 0:
+        return 0
+
+    data = bytearray(max(ids) // 8 + 1)
+
+    for id_ in ids:
+        data[id_ >> 3] |= 1 << (id_ & 7)
+
+    return int.from_bytes(data, "little")
+
+
+def to_bytes(bitmap):
+    """Return the given bitmap as bytes, least significant byte first."""
+    return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+
+
+def to_ids(links):
+    """Return the sorted ids in the given set of links."""
+
+    if isinstance(links, list):
+        return links
+
+    data = to_bytes(links)
+    words = array.array("Q", data + bytes(-len(data) % 8))
+
+    if sys.byteorder == "big":
+        words.byteswap()
+
+    ids = []
+
+    for index, word in enumerate(words):
+        base = index * 64
+
+        while word:
+            lowest = word & -word
+            ids.append(base + lowest.bit_length() - 1)
+            word ^= lowest
+
+    return ids
+
+
+def register(conn, name, links):
+    """Register an SQL function on the connection that checks if a link id is in the
+    given set of links.
+
+    :param conn: The connection the function is used through
+    :param name: The name of the function, :code:`name(id)` returns :code:`1` if the
+                 link is in the set and :code:`0` otherwise.
+    :param links: The set of links
+    """
+
+    check = contains(links)
+    conn.connection.dbapi_connection.create_function(
+        name, 1, lambda id_: int(check(id_))
+    )
+
+
+def cardinality(links):
+    """Return the number of links in the given set."""
+    return len(links) if isinstance(links, list) else _popcount(links)
+
+
+def contains(links):
+    """Return a function that checks if a link id is in the given set of links."""
+
+    if isinstance(links, list):
+        return set(links).__contains__
+
+    data = to_bytes(links)
+    size = len(data)
+
+    def check(id_):
+        return (id_ >> 3) < size and (data[id_ >> 3] >> (id_ & 7)) & 1 == 1
+
+    return check
+
+
+def intersection(sets):
+    """Return the links in all of the given sets."""
+
+    sparse = sorted((s for s in sets if isinstance(s, list)), key=len)
+
+    if len(sparse) == 0:
+        result = -1
+
+        for bitmap in sets:
+            result &= bitmap
+
+        return result
+
+    ids, *others = sparse
+    checks = [contains(s) for s in others + [s for s in sets if isinstance(s, int)]]
+
+    return [id_ for id_ in ids if all(check(id_) for check in checks)]
+
+
+def union(sets):
+    """Return the links in any of the given sets."""
+
+    if all(isinstance(s, list) for s in sets):
+        return sorted(set().union(*sets))
+
+    result = 0
+
+    for links in sets:
+        result |= to_bitmap(links)
+
+    return result
+
+
+def difference(links, sets):
+    """Return the links that aren't in any of the given sets."""
+
+    if len(sets) == 0:
+        return links
+
+    excluded = union(sets)
+
+    if isinstance(links, list):
+        check = contains(excluded)
+        return [id_ for id_ in links if not check(id_)]
+
+    return links & ~to_bitmap(excluded)
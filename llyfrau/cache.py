@@ -0,0 +1,128 @@
+"""Caching search results.
+
+The same searches tend to be run over and over again, e.g. the empty search shown when
+:code:`llyfr open` starts, against data that rarely changes. A :class:`ResultCache`
+keeps the results of the most recent searches, tagged with the generation of the
+database they were computed from (see :func:`~llyfrau.migrations.get_generation`).
+As soon as the generation changes, whether the change was made by this process or
+another, everything in the cache is thrown away.
+
+Only read only records (see :mod:`llyfrau.records`) should be cached, never ORM
+instances since they are tied to the session that loaded them.
+"""
+import collections
+import threading
+
+from .records import Page
+
+CACHE_SIZE = 128
+"""The default number of results to keep."""
+
+CacheInfo = collections.namedtuple("CacheInfo", "hits,misses,maxsize,currsize")
+"""Statistics on how well the cache is doing."""
+
+
+def make_key(kind, **params):
+    """Return the key to cache the results of a search with the given parameters.
+
+    Parameters that are :code:`None` are left out, lists of tags are sorted so that the
+    order they're given in doesn't matter.
+    """
+
+    items = []
+
+    for name, value in params.items():
+
+        if value is None:
+            continue
+
+        if name in {"tags", "exclude_tags"}:
+            value = tuple(sorted(set(value)))
+
+        elif isinstance(value, list):
+            value = tuple(value)
+
+        items.append((name, value))
+
+    return (kind, tuple(sorted(items)))
+
+
+class ResultCache:
+    """A least recently used cache of search results.
+
+    :param maxsize: Optional. The number of results to keep, :code:`0` disables the
+                    cache.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self.generation = None
+        """The generation of the database the cached results were computed from."""
+
+        self._results = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, generation, key, compute):
+        """Return the results for the given key, computing them if necessary.
+
+        :param generation: The current generation of the database, if :code:`None`
+                           the results are never cached.
+        :param key: The key identifying the search, see :func:`make_key`
+        :param compute: Called with no arguments to compute the results
+        """
+
+        with self._lock:
+
+            if generation != self.generation:
+                self._results.clear()
+                self.generation = generation
+
+            results = self._results.get(key)
+
+            if results is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+
+                return self._copy(results)
+
+            self.misses += 1
+
+        results = compute()
+
+        if generation is None or self.maxsize <= 0:
+            return results
+
+        with self._lock:
+
+            # Don't store results computed from data that's since changed.
+            if generation == self.generation:
+                self._results[key] = results
+
+                while len(self._results) > self.maxsize:
+                    self._results.popitem(last=False)
+
+        return self._copy(results)
+
+    @staticmethod
+    def _copy(results):
+        """Return a copy of the given results, so the cached copy isn't modified."""
+
+        if isinstance(results, Page):
+            return Page(results, cursor=results.cursor)
+
+        return list(results)
+
+    def clear(self):
+        """Discard all cached results."""
+
+        with self._lock:
+            self._results.clear()
+
+    def info(self):
+        """Return statistics on the cache."""
+
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._results))
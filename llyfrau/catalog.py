@@ -0,0 +1,657 @@
+"""A compact, read only snapshot of the links in a database, for fast searches.
+
+Searching through the database means going through sqlalchemy and building ORM
+objects, when all that's needed to show a page of results is a handful of columns. A
+catalog stores just those columns in a file next to the database, which is mapped
+into memory with :mod:`mmap` so that opening it costs next to nothing, no matter how
+many links there are.
+
+Links are stored in the order they should be shown in, most frecent first (see
+:func:`~llyfrau.data.current_frecency`), so a search only has to find the first
+:code:`top` links that match and can stop there.
+
+Layout
+------
+
+The file starts with :data:`MAGIC`, followed by the length of a JSON header and the
+header itself. The header records the generation of the database the catalog was
+built from (see :func:`~llyfrau.migrations.get_generation`), the sources and tags,
+and where to find each of the following sections, which are arrays of native
+integers or blobs of bytes.
+
+- :code:`ids`, :code:`visits`, :code:`sources`: One entry per link.
+- :code:`name_offsets`, :code:`names`: The names of the links, each followed by a
+  :code:`NUL` byte. :code:`names_folded` is the same with ASCII letters lowercased,
+  used for case insensitive searches.
+- :code:`url_offsets`, :code:`urls`: The urls of the links, without the prefix of
+  their source.
+- :code:`tag_offsets`, :code:`link_tags`: The tags of each link, as indices into the
+  tags in the header.
+- :code:`posting_offsets`, :code:`postings`: For each tag, the positions of the links
+  that have that tag, in ascending order.
+
+Like the daemon's client, this module only depends on the standard library, so that
+searching a catalog doesn't require importing sqlalchemy.
+"""
+import array
+import bisect
+import gc
+import heapq
+import itertools
+import json
+import logging
+import mmap
+import os
+import pathlib
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from .records import LinkRecord, Page
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"LLYFRCAT"
+VERSION = 1
+"""Bumped whenever the layout of the file changes."""
+
+CURSOR_TAG = "catalog"
+"""The first item of each cursor returned by :meth:`Catalog.search`, to tell them
+apart from the cursors returned by :meth:`~llyfrau.data.Link.search`."""
+
+SCAN_RATIO = 50
+"""Searches for a name are driven by the links with a tag, rather than scanning every
+name, if fewer than one in this many links have that tag."""
+
+_LENGTH = struct.Struct("<I")
+_ALIGN = 8
+
+SECTIONS = {
+    "ids": "q",
+    "visits": "q",
+    "sources": "q",
+    "name_offsets": "q",
+    "names": "B",
+    "names_folded": "B",
+    "url_offsets": "q",
+    "urls": "B",
+    "tag_offsets": "q",
+    "link_tags": "i",
+    "posting_offsets": "q",
+    "postings": "i",
+}
+"""The sections of the file and the array typecode of each."""
+
+
+def catalog_path(filepath) -> pathlib.Path:
+    """Return the path of the catalog for the given database."""
+
+    path = pathlib.Path(filepath).resolve()
+    return path.with_name(f"{path.name}.catalog")
+
+
+def _connect(filepath):
+    """Open the database for reading."""
+
+    path = pathlib.Path(filepath).resolve().as_uri()
+    return sqlite3.connect(f"{path}?mode=ro", uri=True)
+
+
+def read_generation(conn):
+    """Return the generation of the database, or :code:`None` if it doesn't have one."""
+
+    try:
+        (generation,) = conn.execute(
+            "SELECT sum(value) FROM meta WHERE key IN ('generation', 'tag_generation')"
+        ).fetchone()
+    except (sqlite3.Error, TypeError):
+        return None
+
+    return generation
+
+
+def _read_generation(filepath):
+    """Return the generation of the given database, or :code:`None` if it doesn't
+    have one or can't be opened."""
+
+    try:
+        conn = _connect(filepath)
+    except sqlite3.Error as err:
+        logger.debug("Unable to open database: %s", err)
+        return None
+
+    try:
+        return read_generation(conn)
+    finally:
+        conn.close()
+
+
+def _strings(values, sep=b""):
+    """Concatenate the given strings, returning the offsets of each and the blob."""
+
+    encoded = [value.encode("utf-8") + sep for value in values]
+    offsets = itertools.accumulate(map(len, encoded))
+
+    return array.array("q", [0, *offsets]), b"".join(encoded)
+
+
+def _offsets(groups, size):
+    """Given the group each item belongs to, return where each group would start if
+    the items were sorted by group."""
+
+    counts = [0] * size
+
+    for group in groups:
+        counts[group] += 1
+
+    return array.array("q", [0, *itertools.accumulate(counts)])
+
+
+def build(filepath, path=None) -> pathlib.Path:
+    """Build the catalog for the given database, returning its path.
+
+    The catalog is written to a temporary file which then replaces the existing
+    catalog, so anyone with the old catalog open can keep on using it.
+
+    :param filepath: The path to the database
+    :param path: Optional. Where to write the catalog, defaults to
+                 :func:`catalog_path`
+    :raises ValueError: If the database doesn't track its generation
+    """
+
+    path = catalog_path(filepath) if path is None else pathlib.Path(path)
+
+    # Building the catalog creates millions of objects, none of which are part of a
+    # reference cycle, so the garbage collector would only be wasting its time.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        return _build(filepath, path)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _build(filepath, path):
+    conn = _connect(filepath)
+
+    try:
+        # Read everything in one transaction, so that it matches the generation.
+        conn.execute("BEGIN")
+        generation = read_generation(conn)
+
+        if generation is None:
+            raise ValueError(f"Unable to build a catalog for: {filepath}")
+
+        sources = conn.execute("SELECT id, name, prefix FROM sources").fetchall()
+        tags = conn.execute("SELECT id, name FROM tags ORDER BY id").fetchall()
+        links = conn.execute(
+            "SELECT id, name, url, coalesce(visits, 0), coalesce(source_id, 0) "
+            "FROM links ORDER BY frecency DESC, visits DESC, id"
+        ).fetchall()
+        associations = conn.execute(
+            "SELECT link_id, tag_id FROM tag_associations"
+        ).fetchall()
+        conn.execute("COMMIT")
+
+    finally:
+        conn.close()
+
+    size = len(links)
+    ids, names, urls, visits, source_ids = zip(*links) if size > 0 else [()] * 5
+    del links
+
+    positions = dict(zip(ids, itertools.count()))
+    tag_index = {id_: idx for idx, (id_, _) in enumerate(tags)}
+    ntags = max(len(tags), 1)
+
+    # Sorting by (position, tag) groups the tags of each link together.
+    keys = [positions[link] * ntags + tag_index[tag] for link, tag in associations]
+    keys.sort()
+    del associations, positions
+
+    link_positions = [key // ntags for key in keys]
+    link_tags = [key % ntags for key in keys]
+    del keys
+
+    # A stable sort by tag lists the links with each tag in order of position.
+    order = sorted(range(len(link_tags)), key=link_tags.__getitem__)
+
+    sections = {
+        "ids": array.array("q", ids),
+        "visits": array.array("q", visits),
+        "sources": array.array("q", source_ids),
+        "tag_offsets": _offsets(link_positions, size),
+        "link_tags": array.array("i", link_tags),
+        "posting_offsets": _offsets(link_tags, len(tags)),
+        "postings": array.array("i", [link_positions[i] for i in order]),
+    }
+
+    sections["name_offsets"], names = _strings(names, sep=b"\0")
+    sections["names"] = names
+    sections["names_folded"] = names.lower()
+    sections["url_offsets"], sections["urls"] = _strings(urls)
+
+    header = {
+        "version": VERSION,
+        "byteorder": sys.byteorder,
+        "generation": generation,
+        "size": size,
+        "sources": {id_: [name, prefix] for id_, name, prefix in sources},
+        "tags": [name for _, name in tags],
+        "sections": {},
+    }
+
+    # Section offsets are relative to the end of the header, so that the header's
+    # own length doesn't affect them.
+    offset = 0
+    for name, data in sections.items():
+        nbytes = memoryview(data).nbytes
+        header["sections"][name] = [offset, nbytes]
+        offset += nbytes + (-nbytes % _ALIGN)
+
+    encoded = json.dumps(header).encode("utf-8")
+    start = len(MAGIC) + _LENGTH.size + len(encoded)
+    start += -start % _ALIGN
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC + _LENGTH.pack(len(encoded)) + encoded)
+            f.write(bytes(start - f.tell()))
+
+            for name, data in sections.items():
+                offset, nbytes = header["sections"][name]
+                f.write(bytes(start + offset - f.tell()))
+                f.write(data)
+
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    logger.debug("Built catalog of %d links: %s", header["size"], path)
+    return path
+
+
+class Catalog:
+    """A catalog, opened for searching.
+
+    :param path: The path to the catalog
+    :raises ValueError: If the file is not a catalog this version of llyfrau can read
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self._open()
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self):
+        buffer = memoryview(self._mmap)
+        self._buffer = buffer
+
+        if buffer[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a catalog: {self.path}")
+
+        (length,) = _LENGTH.unpack_from(buffer, len(MAGIC))
+        start = len(MAGIC) + _LENGTH.size
+        header = json.loads(bytes(buffer[start : start + length]))
+
+        if header["version"] != VERSION or header["byteorder"] != sys.byteorder:
+            raise ValueError(f"Unsupported catalog: {self.path}")
+
+        start += length
+        start += -start % _ALIGN
+
+        self.generation = header["generation"]
+        """The generation of the database the catalog was built from."""
+
+        self.size = header["size"]
+        self.tags = header["tags"]
+        self.sources = {int(id_): value for id_, value in header["sources"].items()}
+        self._tag_index = {name: idx for idx, name in enumerate(self.tags)}
+        self._data = {}
+
+        for name, (offset, nbytes) in header["sections"].items():
+            view = buffer[start + offset : start + offset + nbytes].cast(SECTIONS[name])
+            self._data[name] = view
+
+        # Names are searched for directly in the mapped file.
+        offset, nbytes = header["sections"]["names_folded"]
+        self._folded = (start + offset, start + offset + nbytes)
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        """Close the catalog, any records returned from it remain valid."""
+
+        for view in getattr(self, "_data", {}).values():
+            view.release()
+
+        if getattr(self, "_buffer", None) is not None:
+            self._buffer.release()
+
+        self._data = {}
+        self._buffer = None
+        self._mmap.close()
+
+    @classmethod
+    def current(cls, filepath, path=None):
+        """Open the catalog for the given database, if it's up to date.
+
+        Returns :code:`None` if there isn't one, it's out of date, or the database
+        doesn't track its generation. Unlike :meth:`load`, the catalog is never
+        rebuilt, see :func:`rebuild_in_background`.
+
+        :param filepath: The path to the database
+        :param path: Optional. The path to the catalog, defaults to
+                     :func:`catalog_path`
+        """
+
+        path = catalog_path(filepath) if path is None else pathlib.Path(path)
+        generation = _read_generation(filepath)
+
+        if generation is None:
+            return None
+
+        return cls._open_generation(path, generation)
+
+    @classmethod
+    def load(cls, filepath, path=None):
+        """Open the catalog for the given database, (re)building it if it's missing
+        or out of date.
+
+        Returns :code:`None` if the database doesn't track its generation, or a
+        catalog can't be built for it.
+
+        :param filepath: The path to the database
+        :param path: Optional. The path to the catalog, defaults to
+                     :func:`catalog_path`
+        """
+
+        path = catalog_path(filepath) if path is None else pathlib.Path(path)
+        generation = _read_generation(filepath)
+
+        if generation is None:
+            return None
+
+        catalog = cls._open_generation(path, generation)
+
+        if catalog is not None:
+            return catalog
+
+        try:
+            return cls(build(filepath, path))
+        except Exception as err:
+            logger.debug("Unable to build catalog: %s", err)
+            return None
+
+    @classmethod
+    def _open_generation(cls, path, generation):
+        """Open the catalog at the given path, if it was built from the given
+        generation."""
+
+        try:
+            catalog = cls(path)
+
+            if catalog.generation == generation:
+                return catalog
+
+            catalog.close()
+        except (OSError, ValueError) as err:
+            logger.debug("Unable to use existing catalog: %s", err)
+
+        return None
+
+    def record(self, position) -> LinkRecord:
+        """Return the link at the given position."""
+
+        data = self._data
+
+        start, end = data["name_offsets"][position : position + 2]
+        name = bytes(data["names"][start : end - 1]).decode("utf-8")
+
+        start, end = data["url_offsets"][position : position + 2]
+        url = bytes(data["urls"][start:end]).decode("utf-8")
+
+        source = None
+        source_id = data["sources"][position]
+
+        if source_id in self.sources:
+            source, prefix = self.sources[source_id]
+            url = f"{prefix or ''}{url}"
+
+        start, end = data["tag_offsets"][position : position + 2]
+        tags = [self.tags[idx] for idx in data["link_tags"][start:end]]
+
+        return LinkRecord(
+            data["ids"][position], name, url, data["visits"][position], source, tags
+        )
+
+    def _postings(self, tag):
+        """Return the positions of the links with the given tag, if it exists."""
+
+        idx = self._tag_index.get(tag)
+
+        if idx is None:
+            return None
+
+        start, end = self._data["posting_offsets"][idx : idx + 2]
+        return self._data["postings"][start:end]
+
+    def _find(self, name, start):
+        """Generate the positions of the links whose names contain the given string."""
+
+        needle = name.encode("utf-8").lower()
+        offsets = self._data["name_offsets"]
+        base, end = self._folded
+
+        offset = base + offsets[start]
+
+        while True:
+            found = self._mmap.find(needle, offset, end)
+
+            if found < 0:
+                return
+
+            position = bisect.bisect_right(offsets, found - base) - 1
+            yield position
+
+            # Only report each link once.
+            offset = base + offsets[position + 1]
+
+    def _matches(self, name, position):
+        """Determine if the name of the link at the given position contains the given
+        string."""
+
+        base, _ = self._folded
+        start, end = self._data["name_offsets"][position : position + 2]
+
+        return name.encode("utf-8").lower() in self._mmap[base + start : base + end]
+
+    def search(
+        self,
+        name=None,
+        tags=None,
+        top=10,
+        tag_mode="and",
+        exclude_tags=None,
+        after=None,
+    ) -> Page:
+        """Search the catalog for links, most frecent first.
+
+        Takes the same arguments as :meth:`~llyfrau.data.Link.search`, names are
+        matched as case insensitive substrings.
+        """
+
+        if tag_mode not in {"and", "or"}:
+            raise ValueError(f"Unknown tag mode: {tag_mode!r}")
+
+        start = 0
+
+        if after is not None:
+
+            if len(after) != 3 or after[0] != CURSOR_TAG:
+                raise ValueError("Invalid cursor")
+
+            if after[1] != self.generation:
+                raise ValueError("Cursor from an older catalog")
+
+            start = after[2] + 1
+
+        required, any_of = [], []
+
+        for posting in (self._postings(t) for t in set(tags or [])):
+
+            if posting is None and tag_mode == "and":
+                return Page()
+
+            if posting is not None:
+                required.append(posting)
+
+        if tags and tag_mode == "or":
+            required, any_of = [], required
+
+            if len(any_of) == 0:
+                return Page()
+
+        excluded = [self._postings(t) for t in set(exclude_tags or [])]
+        excluded = [p for p in excluded if p is not None]
+
+        # Drive the search from the most selective filter available.
+        required.sort(key=len)
+        rare = required and len(required[0]) * SCAN_RATIO < self.size
+
+        if name and rare:
+            candidates = (
+                p for p in _iter_from(required.pop(0), start) if self._matches(name, p)
+            )
+        elif name:
+            candidates = self._find(name, start)
+        elif required:
+            candidates = _iter_from(required.pop(0), start)
+        elif any_of:
+            candidates = _unique(heapq.merge(*(_iter_from(p, start) for p in any_of)))
+            any_of = []
+        else:
+            candidates = range(start, self.size)
+
+        positions = []
+
+        for position in candidates:
+
+            if not all(_contains(p, position) for p in required):
+                continue
+
+            if any_of and not any(_contains(p, position) for p in any_of):
+                continue
+
+            if any(_contains(p, position) for p in excluded):
+                continue
+
+            positions.append(position)
+
+            # Find an extra result to see if there's another page.
+            if top is not None and len(positions) > top:
+                break
+
+        cursor = None
+
+        if top is not None and len(positions) > top:
+            positions = positions[:top]
+            cursor = (CURSOR_TAG, self.generation, positions[-1])
+
+        return Page([self.record(p) for p in positions], cursor=cursor)
+
+
+def rebuild_in_background(filepath):
+    """Bring the catalog for the given database up to date from a separate process,
+    without waiting for it.
+
+    For commands that exit as soon as they've shown their results, a thread would
+    be stopped before the catalog was written.
+    """
+
+    args = [sys.executable, "-m", __name__, str(filepath)]
+    subprocess.Popen(
+        args,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def _main(argv):
+    """Rebuild the catalog for the database given on the command line, unless
+    another process is already rebuilding it."""
+
+    filepath = argv[0]
+    lock_path = f"{catalog_path(filepath)}.lock"
+
+    with open(lock_path, "w") as lock:
+
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return 0
+
+        catalog = Catalog.load(filepath)
+
+    if catalog is None:
+        return 1
+
+    catalog.close()
+    return 0
+
+
+def is_cursor(cursor):
+    """Determine if the given cursor came from :meth:`Catalog.search`."""
+    return cursor is not None and len(cursor) == 3 and cursor[0] == CURSOR_TAG
+
+
+def _contains(posting, position):
+    idx = bisect.bisect_left(posting, position)
+    return idx < len(posting) and posting[idx] == position
+
+
+def _iter_from(posting, start):
+    """Iterate over the positions in the posting list, starting from :code:`start`."""
+
+    for idx in range(bisect.bisect_left(posting, start), len(posting)):
+        yield posting[idx]
+
+
+def _unique(positions):
+
+    last = None
+
+    for position in positions:
+
+        if position != last:
+            yield position
+
+        last = position
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -7,12 +7,16 @@ import shutil
 import sys
 
 import appdirs
-import pkg_resources
 
 from llyfrau._version import __version__
-from llyfrau.data import Database, Link, Source, Tag
+from llyfrau.daemon import Client
+from llyfrau.plugins import entry_points
+from llyfrau.profiles import PROFILES
 
-from .tui import LinkTable
+logger = logging.getLogger(__name__)
+
+# Modules that take a while to import, such as sqlalchemy and prompt_toolkit, are
+# imported by the commands that need them so that they don't slow down the others.
 
 _LogConfig = collections.namedtuple("LogConfig", "level,fmt")
 _LOG_LEVELS = [
@@ -50,36 +54,59 @@ def _setup_logging(verbose: int, quiet: bool) -> None:
         sql_logger.addHandler(console)
 
 
-def add_link(filepath, url, name, tags):
-    db = Database(filepath, create=True)
+def _open_read_only(filepath, db_profile=None, profile=False):
+    """Open the database for commands that only read from it.
 
-    if tags is None:
-        Link.add(db, name=name, url=url)
-        return 0
+    Read only databases can't be migrated, so a database created by an older version
+    is first opened for writing to bring it up to date.
+    """
+
+    from llyfrau.data import Database
+    from llyfrau.migrations import MIGRATIONS
+
+    db = Database(filepath, db_profile=db_profile or "read-only", profile=profile)
+
+    if not db.read_only or db.version >= len(MIGRATIONS):
+        return db
+
+    db.close()
+    logger.debug("Migrating database: %s", filepath)
 
-    link = Link(name=name, url=url)
-    new_tags = []
+    Database(filepath, profile=profile).close()
+    return Database(filepath, db_profile=db_profile or "read-only", profile=profile)
 
-    for t in tags:
-        existing = Tag.get(db, name=t)
 
-        if existing is not None:
-            link.tags.append(existing)
-            continue
+def _connect(filepath, db_profile=None, profile=False):
+    """Return a client for the daemon, unless options it can't honour are given."""
 
-        tag = Tag(name=t)
-        link.tags.append(tag)
-        new_tags.append(tag)
+    # The daemon's database was opened with its own profile.
+    if db_profile or profile:
+        return None
+
+    return Client.connect(filepath)
+
+
+def add_link(filepath, url, name, tags, db_profile=None, profile=False):
+    client = _connect(filepath, db_profile=db_profile, profile=profile)
+
+    if client is not None:
+        client.add(url, name=name, tags=tags)
+        return 0
 
-    Link.add(db, items=[link], commit=False)
+    from llyfrau.data import Database, Link
 
-    if len(new_tags) > 0:
-        Tag.add(db, items=new_tags, commit=False)
+    db = Database(
+        filepath,
+        create=True,
+        db_profile=db_profile or "interactive",
+        profile=profile,
+    )
+    Link.create(db, url, name=name, tags=tags)
 
-    db.commit()
+    return 0
 
 
-def find_sources(filepath):
+def find_sources(filepath, db_profile=None, profile=False):
 
     path = pathlib.Path(filepath)
 
@@ -92,9 +119,17 @@ def find_sources(filepath):
     uris = ["URI"]
     prefixes = ["Prefix"]
 
-    db = Database(filepath)
+    client = _connect(filepath, db_profile=db_profile, profile=profile)
 
-    for source in Source.search(db):
+    if client is not None:
+        sources = client.sources()
+    else:
+        from llyfrau.data import Source
+
+        db = _open_read_only(filepath, db_profile=db_profile, profile=profile)
+        sources = Source.search_records(db)
+
+    for source in sources:
         ids.append(source.id)
         names.append(source.name)
         uris.append(source.uri)
@@ -103,23 +138,165 @@ def find_sources(filepath):
     print(format_table([ids, names, uris, prefixes]))
 
 
-def open_link_ui(filepath):
+def search_links(
+    filepath, name=None, tags=None, query=None, top=10, db_profile=None, profile=False
+):
+
+    path = pathlib.Path(filepath)
+
+    if not path.exists():
+        print(f"Unable to find links database: {filepath}", file=sys.stderr)
+        return -1
+
+    from llyfrau.catalog import Catalog, rebuild_in_background
+
+    catalog = None
 
-    table_ui = LinkTable(filepath)
+    # The catalog doesn't understand the query language.
+    if query is None:
+
+        try:
+            catalog = Catalog.current(filepath)
+        except Exception as err:
+            logger.debug("Unable to use catalog: %s", err)
+
+    if catalog is not None:
+        links = catalog.search(name=name, tags=tags, top=top)
+        catalog.close()
+    else:
+        from llyfrau.data import Link
+
+        db = _open_read_only(filepath, db_profile=db_profile, profile=profile)
+        links = Link.search_records(
+            db, name=name, tags=tags, query=query, top=top, sort="frecency"
+        )
+
+    ids = ["ID"]
+    names = ["Name"]
+    urls = ["URL"]
+
+    for link in links:
+        ids.append(link.id)
+        names.append(link.name)
+        urls.append(link.url)
+
+    print(format_table([ids, names, urls]))
+
+    # Rebuilding the catalog can take a while, so if it's missing or out of date
+    # leave it to another process rather than keeping the results waiting.
+    if query is None and catalog is None:
+        rebuild_in_background(filepath)
+
+
+def export_archive(filepath, output, compression=None, db_profile=None, profile=False):
+
+    path = pathlib.Path(filepath)
+
+    if not path.exists():
+        print(f"Unable to find links database: {filepath}", file=sys.stderr)
+        return -1
+
+    from llyfrau.archive import export, open_archive
+
+    db = _open_read_only(filepath, db_profile=db_profile, profile=profile)
+
+    try:
+        with open_archive(output, "w", compression=compression) as stream:
+            written = export(db, stream)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        return -1
+    finally:
+        db.close()
+
+    logger.info(
+        "Exported %d links, %d sources, %d tags and %d visits",
+        *(written[kind] for kind in ["link", "source", "tag", "visit"]),
+    )
+    return 0
+
+
+def load_archive(filepath, archive, db_profile=None, profile=False):
+    from llyfrau.archive import load, open_archive
+    from llyfrau.data import Database
+
+    db = Database(
+        filepath,
+        create=True,
+        db_profile=db_profile or "bulk-import",
+        profile=profile,
+    )
+
+    try:
+        with open_archive(archive, "r") as stream:
+            loaded = load(db, stream)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        return -1
+    finally:
+        db.close()
+
+    logger.info(
+        "Loaded %d links, %d sources, %d tags and %d visits",
+        *(loaded[kind] for kind in ["link", "source", "tag", "visit"]),
+    )
+    return 0
+
+
+def open_link_ui(filepath, db_profile=None, profile=False):
+    from .tui import LinkTable
+
+    client = _connect(filepath, db_profile=db_profile, profile=profile)
+    table_ui = LinkTable(
+        filepath,
+        db_profile=db_profile or "interactive",
+        client=client,
+        profile=profile,
+    )
     table_ui.run()
 
 
+def run_daemon(filepath, db_profile=None, profile=False):
+    from llyfrau.daemon import Daemon
+
+    server = Daemon(filepath, db_profile=db_profile or "interactive", profile=profile)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
 def call_command(cmd, args):
 
     if args.filepath is None:
         base = appdirs.user_data_dir(appname="llyfr", appauthor=False)
         args.filepath = str(pathlib.Path(base, "links.db"))
 
+    if hasattr(cmd, "load"):
+        cmd = cmd.load()
+
     params = inspect.signature(cmd).parameters
     cmd_args = {name: getattr(args, name) for name in params}
     return cmd(**cmd_args)
 
 
+def _report_profile(output=None):
+    """Print the query profile, or write it to the given file."""
+
+    from llyfrau.profiling import default_profiler
+
+    profiler = default_profiler()
+
+    if output is not None:
+        profiler.dump(output)
+        return
+
+    print(profiler.report(), file=sys.stderr)
+
+
 def format_cell(text, width, placeholder=None):
 
     if placeholder is None:
@@ -158,14 +335,33 @@ def format_table(columns):
 
 
 def _load_importers(parent):
-    """Load importers and attach them to the cli interface."""
-
-    for imp in pkg_resources.iter_entry_points("llyfrau.importers"):
-        cmd = parent.add_parser(imp.name, help=f"{imp.name} importer")
-        cmd.add_argument("uri", help="where to import links from")
-
-        impl = imp.load()
-        cmd.set_defaults(run=impl)
+    """Attach the available importers to the cli interface.
+
+    Importers aren't loaded until they are run.
+    """
+
+    for name, imp in sorted(entry_points("llyfrau.importers").items()):
+        cmd = parent.add_parser(name, help=f"{name} importer")
+        cmd.add_argument("uri", nargs="*", help="where to import links from")
+        cmd.add_argument(
+            "-i",
+            "--input-file",
+            help="import from each uri listed in the given file, one per line",
+        )
+        cmd.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=None,
+            help="the number of uris to import concurrently",
+        )
+        cmd.add_argument(
+            "--no-cache",
+            dest="cache",
+            action="store_false",
+            help="always download sources in full, ignoring the http cache",
+        )
+        cmd.set_defaults(run=imp, parser=cmd)
 
 
 cli = argparse.ArgumentParser()
@@ -182,6 +378,23 @@ cli.add_argument(
     default=0,
     help="increase output verbosity, repeatable e.g. -v, -vv, -vvv, ...",
 )
+cli.add_argument(
+    "--db-profile",
+    choices=sorted(PROFILES),
+    default=None,
+    help="the performance profile to use when connecting to the database",
+)
+cli.add_argument(
+    "--profile",
+    action="store_true",
+    help="profile the queries sent to the database, printing a report on exit",
+)
+cli.add_argument(
+    "--profile-output",
+    type=str,
+    default=None,
+    help="write the query profile to the given file as JSON, implies --profile",
+)
 cli.add_argument("--version", action="store_true", help="show version and exit")
 
 commands = cli.add_subparsers(title="commands")
@@ -198,9 +411,49 @@ _load_importers(importers)
 sources = commands.add_parser("sources", help="list all link sources")
 sources.set_defaults(run=find_sources)
 
+search = commands.add_parser("search", help="search for links")
+search.add_argument("name", nargs="?", default=None, help="text to look for in names")
+search.add_argument("-t", "--tags", nargs="*", help="only show links with these tags")
+search.add_argument(
+    "-q", "--query", help="only show links matching this query, e.g. 'array #py'"
+)
+search.add_argument("--top", type=int, default=10, help="the number of links to show")
+search.set_defaults(run=search_links)
+
+export_ = commands.add_parser(
+    "export", help="export the database as a JSON Lines archive"
+)
+export_.add_argument(
+    "output",
+    nargs="?",
+    default="-",
+    help="the file to write the archive to, defaults to stdout",
+)
+export_.add_argument(
+    "--compression",
+    choices=["gzip", "zstd"],
+    default=None,
+    help="compress the archive, by default this is guessed from the file extension",
+)
+export_.set_defaults(run=export_archive)
+
+load_ = commands.add_parser("load", help="load an archive into an empty database")
+load_.add_argument(
+    "archive",
+    nargs="?",
+    default="-",
+    help="the archive to load, defaults to stdin. Compression is detected",
+)
+load_.set_defaults(run=load_archive)
+
 open_ = commands.add_parser("open", help="open a link")
 open_.set_defaults(run=open_link_ui)
 
+daemon = commands.add_parser(
+    "daemon", help="keep the database open in the background to speed up commands"
+)
+daemon.set_defaults(run=run_daemon)
+
 
 def main():
 
@@ -210,9 +463,18 @@ def main():
         print(f"llyfr v{__version__}")
         return 0
 
+    if hasattr(args, "uri") and not args.uri and args.input_file is None:
+        args.parser.error("at least one uri or --input-file is required")
+
     _setup_logging(args.verbose, args.quiet)
+    args.profile = args.profile or args.profile_output is not None
 
     if hasattr(args, "run"):
-        return call_command(args.run, args)
+
+        try:
+            return call_command(args.run, args)
+        finally:
+            if args.profile:
+                _report_profile(args.profile_output)
 
     cli.print_help()
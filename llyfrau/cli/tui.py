@@ -1,3 +1,8 @@
+import logging
+import threading
+import time
+import webbrowser
+
 from prompt_toolkit import Application
 from prompt_toolkit.buffer import Buffer
 from prompt_toolkit.filters import has_focus
@@ -8,11 +13,146 @@ from prompt_toolkit.layout.controls import FormattedTextControl
 from prompt_toolkit.layout.layout import Layout
 from prompt_toolkit.widgets import Label, TextArea
 
+from llyfrau.catalog import Catalog, catalog_path, is_cursor
 from llyfrau.data import Database, Link
+from llyfrau.query import parse, simple_search
+from llyfrau.records import Page
+
+logger = logging.getLogger(__name__)
 
 CURSOR = ">> "
 SEPARATOR = " | "
 
+DEBOUNCE_DELAY = 0.15
+"""How long to wait (in seconds) after a keystroke before searching."""
+
+PAGE_SIZE = 10
+"""The number of links shown at a time."""
+
+
+class BackgroundSearch:
+    """Runs searches in a background thread.
+
+    Only the most recently submitted search matters, any search that is superseded
+    before it starts is skipped and the results of any that are superseded while
+    running are discarded.
+
+    :param search: Called from the background thread with the arguments given to
+                   :meth:`submit`, returning the results.
+    :param on_results: Called from the background thread with the results of the
+                       latest search.
+    :param on_cancel: Optional. Called from the thread submitting a new search while
+                      a previous search is still running, to abort it early. It's
+                      called with the lock held, so that the previous search can't
+                      be replaced by the new one before it's aborted, and so must
+                      not wait for the search to finish.
+    :param delay: Optional. How long to wait for another search to be submitted
+                  before running one.
+    """
+
+    def __init__(self, search, on_results, on_cancel=None, delay=DEBOUNCE_DELAY):
+        self.search = search
+        self.on_results = on_results
+        self.on_cancel = on_cancel
+        self.delay = delay
+
+        self.generation = 0
+        """Incremented each time a search is submitted."""
+
+        self._pending = None
+        self._running = None
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, delay=None, replace=True, **args):
+        """Schedule a search with the given arguments, replacing any pending search.
+
+        If :code:`replace` is :code:`False`, the search is only scheduled if there
+        isn't another search pending or running. Returns :code:`True` if the search
+        was scheduled.
+        """
+
+        delay = self.delay if delay is None else delay
+
+        with self._cond:
+            busy = self._pending is not None or self._running is not None
+
+            if busy and not replace:
+                return False
+
+            self.generation += 1
+            self._pending = (self.generation, time.monotonic() + delay, args)
+            self._cond.notify()
+
+            # Anything running now has been superseded, and can't be replaced by the
+            # new search until the lock is released.
+            if self._running is not None and self.on_cancel is not None:
+                self.on_cancel()
+
+        return True
+
+    def close(self):
+        """Stop the background thread, waiting for any running search to finish."""
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+        self._thread.join()
+
+    def _next(self):
+        """Wait for the next search that should be run."""
+
+        with self._cond:
+
+            while True:
+
+                if self._closed:
+                    return None
+
+                if self._pending is None:
+                    self._cond.wait()
+                    continue
+
+                generation, deadline, args = self._pending
+                remaining = deadline - time.monotonic()
+
+                # Something else could be submitted while we wait.
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+
+                self._pending = None
+                self._running = generation
+
+                return generation, args
+
+    def _run(self):
+
+        while True:
+            task = self._next()
+
+            if task is None:
+                return
+
+            generation, args = task
+
+            try:
+                results = self.search(**args)
+            except Exception as err:
+                logger.debug("Search %d failed: %s", generation, err)
+                results = None
+
+            with self._cond:
+                self._running = None
+                latest = generation == self.generation
+
+            if latest and results is not None:
+                self.on_results(results)
+
 
 class Column:
     def __init__(self, title: str):
@@ -46,8 +186,41 @@ class Column:
 
 
 class LinkTable:
-    def __init__(self, filepath):
-        self.db = Database(filepath)
+    def __init__(self, filepath, db_profile=None, client=None, profile=False):
+        self.client = client
+        self.filepath = filepath
+        self.db_profile = db_profile
+        self.profile = profile
+
+        self.db = None
+        self._search_db = None
+
+        self.query = {}
+        """The arguments of the search currently being shown."""
+
+        self.pages = []
+        """The pages of results fetched for the current search so far."""
+
+        self.page_idx = 0
+        """The index of the page currently being shown."""
+
+        self._want_next = False
+
+        self.catalog = None
+        """The catalog searches are run against, if it's up to date."""
+
+        self._new_catalog = None
+        self._catalog_thread = None
+        self._catalog_failed = False
+        self._catalog_lock = threading.Lock()
+
+        if client is None:
+            self.db = Database(filepath, db_profile=db_profile, profile=profile)
+
+        self.searcher = BackgroundSearch(
+            self._background_search, self._on_results, on_cancel=self._cancel_search
+        )
+
         cursor = FormattedTextControl(
             focusable=True, text=[("", CURSOR)], show_cursor=False
         )
@@ -94,9 +267,10 @@ class LinkTable:
         self.prompt = TextArea(
             multiline=False,
             focusable=True,
-            accept_handler=self._do_search,
+            accept_handler=self._accept_search,
             get_line_prefix=self._get_prompt,
         )
+        self.prompt.buffer.on_text_changed += self._submit_search
 
         table = HSplit([table_header, table_body])
         layout = HSplit([table, self.prompt])
@@ -121,7 +295,12 @@ class LinkTable:
             selected = self.ids.col.text[idx - 1]
             link_id = int(selected[1])
 
-            Link.open(self.db, link_id)
+            if self.client is None:
+                Link.open(self.db, link_id)
+                return
+
+            url = self.client.visit(link_id)
+            webbrowser.open(url)
 
         @kb.add(Keys.Down, filter=has_focus(self.selection))
         def next_item(event):
@@ -130,6 +309,7 @@ class LinkTable:
             max_idx = len(self.ids.col.text)
 
             if idx + 1 > max_idx:
+                self._next_page()
                 return
 
             cursor.insert(0, ("", "\n"))
@@ -140,6 +320,7 @@ class LinkTable:
             idx = len(cursor)
 
             if idx == 1:
+                self._prev_page()
                 return
 
             cursor.pop(0)
@@ -147,27 +328,230 @@ class LinkTable:
         self.app = Application(layout=Layout(layout), key_bindings=kb)
 
     def run(self):
-        self._do_search()
-        self.app.run()
+        self._show_results(({}, self._search(self.db)))
+
+        try:
+            self.app.run()
+        finally:
+            self.searcher.close()
+
+            for catalog in [self.catalog, self._new_catalog]:
+                if catalog is not None:
+                    catalog.close()
+
+    def _submit_search(self, buffer: Buffer, delay=None):
+        self.searcher.submit(delay=delay, query=buffer.text or None)
+
+    def _accept_search(self, buffer: Buffer):
+        self._submit_search(buffer, delay=0)
+        self.app.layout.focus(self.selection)
+
+        # Keep the search text
+        return True
+
+    def _search(self, db, query=None, after=None):
+        """Search for links, using the daemon if there is one.
+
+        Otherwise, the catalog is searched if it's up to date, falling back to the
+        database while it's being rebuilt. Queries the catalog can't answer, see
+        :func:`~llyfrau.query.simple_search`, always go to the database.
+        """
+
+        args = simple_search(parse(query))
+        catalog = self._get_catalog(db) if args is not None else None
+
+        # The next page has to come from the same place as the previous one.
+        if is_cursor(after) and (catalog is None or catalog.generation != after[1]):
+            return Page()
+
+        if args is None:
+            return self._search_links(
+                db, query=query, top=PAGE_SIZE, sort="frecency", after=after
+            )
+
+        name = args["name"]
+
+        if catalog is not None and (after is None or is_cursor(after)):
+            page = catalog.search(top=PAGE_SIZE, after=after, **args)
+
+            if len(page) > 0 or not name or after is not None:
+                return page
+
+            return self._search_links(db, fuzzy=True, **args)
+
+        args = dict(top=PAGE_SIZE, sort="frecency", after=after, **args)
+        page = self._search_links(db, **args)
+
+        # Allow for typos if nothing matches exactly.
+        if len(page) == 0 and name and after is None:
+            page = self._search_links(db, fuzzy=True, **args)
+
+        return page
+
+    def _search_links(self, db, **args):
+
+        if self.client is not None:
+            return self.client.search(**args)
+
+        try:
+            return Link.search_records(db, **args)
+        finally:
+            # Don't hold on to a read transaction, so that the next search sees
+            # any changes made in the meantime.
+            db.session.rollback()
+
+    def _get_catalog(self, db):
+        """Return the catalog, if it's up to date with the database.
+
+        If not, it's rebuilt in another thread and :code:`None` is returned until it's
+        ready.
+        """
+
+        if self.client is not None or not db.has_generation or self._catalog_failed:
+            return None
+
+        with self._catalog_lock:
+            new, self._new_catalog = self._new_catalog, None
+
+        if new is not None:
+
+            if self.catalog is not None:
+                self.catalog.close()
+
+            self.catalog = new
+
+        if self.catalog is None:
+
+            try:
+                self.catalog = Catalog(catalog_path(self.filepath))
+            except (OSError, ValueError):
+                pass
+
+        try:
+            generation = db.generation
+        finally:
+            db.session.rollback()
+
+        if self.catalog is not None and self.catalog.generation == generation:
+            return self.catalog
+
+        if self._catalog_thread is None or not self._catalog_thread.is_alive():
+            self._catalog_thread = threading.Thread(
+                target=self._rebuild_catalog, daemon=True
+            )
+            self._catalog_thread.start()
+
+        return None
+
+    def _rebuild_catalog(self):
+        """Bring the catalog up to date, from a thread of its own."""
+
+        try:
+            catalog = Catalog.load(self.filepath)
+        except Exception as err:
+            logger.debug("Unable to rebuild catalog: %s", err)
+            catalog = None
+
+        # Don't keep trying if it's not going to work.
+        if catalog is None:
+            self._catalog_failed = True
+            return
+
+        with self._catalog_lock:
+            previous, self._new_catalog = self._new_catalog, catalog
+
+        if previous is not None:
+            previous.close()
+
+    def _background_search(self, **args):
+        """Run a search from the background thread, using its own connection."""
+
+        if self.client is None and self._search_db is None:
+            self._search_db = Database(
+                self.filepath, db_profile=self.db_profile, profile=self.profile
+            )
+
+        return args, self._search(self._search_db, **args)
+
+    def _cancel_search(self):
+        """Abort the query running in the background thread, if possible."""
+
+        db = self._search_db
+
+        if db is not None:
+            db.interrupt()
+
+    def _on_results(self, results):
+        """Called from the background thread with the results of the latest search."""
+
+        loop = self.app.loop
+
+        if loop is None or loop.is_closed():
+            self._show_results(results)
+            return
+
+        loop.call_soon_threadsafe(self._show_results, results)
+
+    def _show_results(self, results):
+        args, page = results
+        after = args.pop("after", None)
+
+        # The first page of a new search
+        if after is None:
+            self.query = args
+            self.pages = [page]
+            self._want_next = False
+            self._show_page(0)
+            return
+
+        # Only keep the next page of the current search.
+        if args != self.query or self.pages[-1].cursor != after:
+            return
+
+        self.pages.append(page)
+
+        if self._want_next:
+            self._want_next = False
+            self._show_page(len(self.pages) - 1)
+
+    def _next_page(self):
+        """Move on to the next page of results, if there is one."""
+
+        if self.page_idx + 1 < len(self.pages):
+            self._show_page(self.page_idx + 1)
+            return
+
+        # Show the next page once it's been fetched.
+        if self.pages and self.pages[-1].cursor is not None:
+            self._want_next = True
+            self._prefetch()
+
+    def _prev_page(self):
+        """Move back to the previous page of results, if there is one."""
+
+        if self.page_idx == 0:
+            return
+
+        self._show_page(self.page_idx - 1, bottom=True)
+
+    def _show_page(self, idx, bottom=False):
+        """Show the given page of results.
+
+        If :code:`bottom` is :code:`True`, the last link on the page is selected,
+        otherwise the first.
+        """
+
+        self.page_idx = idx
+        links = self.pages[idx]
 
-    def _do_search(self, inpt: Buffer = None):
-        self.selection.content.text = [("", CURSOR)]
         self.ids.clear()
         self.names.clear()
         self.tags.clear()
         self.sources.clear()
         self.urls.clear()
 
-        name = None
-        tags = None
-
-        if inpt is not None and len(inpt.text) > 0:
-            terms = inpt.text.split(" ")
-
-            tags = [t.replace("#", "") for t in terms if t.startswith("#")]
-            name = " ".join(n for n in terms if not n.startswith("#"))
-
-        links = Link.search(self.db, name=name, top=10, tags=tags, sort="visits")
+        selected = len(links) - 1 if bottom and links else 0
+        self.selection.content.text = [("", "\n")] * selected + [("", CURSOR)]
 
         for idx, link in enumerate(links):
 
@@ -175,15 +559,28 @@ class LinkTable:
 
             self.ids.col.text.append(("", f"{link.id}{newline}"))
             self.names.col.text.append(("", f"{link.name}{newline}"))
-            self.urls.col.text.append(("", f"{link.url_expanded}{newline}"))
+            self.urls.col.text.append(("", f"{link.url}{newline}"))
 
-            tags = ", ".join(f"#{t.name}" for t in link.tags)
+            tags = ", ".join(f"#{t}" for t in link.tags)
             self.tags.col.text.append(("", f"{tags}{newline}"))
 
-            source = "" if not link.source else link.source.name
+            source = link.source or ""
             self.sources.col.text.append(("", f"{source}{newline}"))
 
-        self.app.layout.focus(self.selection)
+        self._prefetch()
+        self.app.invalidate()
+
+    def _prefetch(self):
+        """Fetch the page after the last one in the background, if there is one."""
+
+        if self.page_idx < len(self.pages) - 1:
+            return
+
+        cursor = self.pages[-1].cursor
+
+        # Don't get in the way of a search that's been submitted in the meantime.
+        if cursor is not None:
+            self.searcher.submit(delay=0, replace=False, after=cursor, **self.query)
 
     def _get_prompt(self, line_no, other):
 
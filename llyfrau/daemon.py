@@ -0,0 +1,288 @@
+"""A background process that keeps a database open and ready to use.
+
+Starting :code:`llyfr` means importing its dependencies, opening the database and
+starting with a cold cache on every invocation. The daemon pays those costs once and
+then answers requests from the cli over a unix domain socket, next to the database.
+If that path is too long for a socket, it's placed in a directory only the current
+user can access instead.
+
+Requests and responses are single lines of JSON. A client opens a new connection for
+each request::
+
+    {"command": "search", "args": {"name": "numpy"}}
+    {"ok": true, "result": [...]}
+
+The client side of this module only depends on the standard library, so that thin
+clients don't pay for importing what the daemon has already loaded.
+"""
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import socket
+import socketserver
+import tempfile
+
+from .records import LinkRecord, Page, SourceRecord
+
+logger = logging.getLogger(__name__)
+
+MAX_SOCKET_PATH = 100
+"""Unix domain socket paths longer than this are not portable."""
+
+TIMEOUT = 5
+"""How long to wait for the other end of a connection, in seconds."""
+
+
+class DaemonError(RuntimeError):
+    """Raised when the daemon is unable to complete a request."""
+
+
+def socket_path(filepath) -> pathlib.Path:
+    """Return the path of the socket the daemon for the given database listens on."""
+
+    path = pathlib.Path(filepath).resolve()
+    sock = path.with_name(f"{path.name}.sock")
+
+    if len(str(sock)) <= MAX_SOCKET_PATH:
+        return sock
+
+    key = hashlib.sha1(str(path).encode("utf-8")).hexdigest()[:16]
+    return runtime_dir() / f"llyfr-{key}.sock"
+
+
+def runtime_dir() -> pathlib.Path:
+    """Return a directory only the current user can access, creating it if needed.
+
+    This is :code:`$XDG_RUNTIME_DIR` if it's set, otherwise a directory in the
+    system's temporary directory.
+    """
+
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        path = pathlib.Path(os.environ["XDG_RUNTIME_DIR"])
+    else:
+        path = pathlib.Path(tempfile.gettempdir(), f"llyfr-{os.getuid()}")
+        path.mkdir(mode=0o700, exist_ok=True)
+
+    info = path.stat()
+
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise DaemonError(f"{path} is accessible to other users")
+
+    return path
+
+
+class Client:
+    """Sends requests to a running daemon."""
+
+    def __init__(self, path):
+        self.path = str(path)
+
+    @classmethod
+    def connect(cls, filepath):
+        """Return a client for the daemon serving the given database.
+
+        Returns :code:`None` if there is no daemon running, or if the socket belongs
+        to another user.
+        """
+
+        if not hasattr(socket, "AF_UNIX"):
+            return None
+
+        try:
+            path = socket_path(filepath)
+
+            if path.stat().st_uid != os.getuid():
+                logger.warning("Ignoring %s, it belongs to another user", path)
+                return None
+
+            client = cls(path)
+            client.request("ping")
+        except (OSError, DaemonError):
+            return None
+
+        return client
+
+    def request(self, command, **args):
+        """Send a request to the daemon, returning the result."""
+
+        message = json.dumps({"command": command, "args": args}) + "\n"
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(TIMEOUT)
+            sock.connect(self.path)
+            sock.sendall(message.encode("utf-8"))
+
+            with sock.makefile("rb") as f:
+                line = f.readline()
+
+        if not line:
+            raise DaemonError(f"No response to {command!r}")
+
+        response = json.loads(line)
+
+        if not response["ok"]:
+            raise DaemonError(response["error"])
+
+        return response["result"]
+
+    def search(self, **args):
+        """Search for links, see :meth:`llyfrau.data.Link.search`."""
+
+        result = self.request("search", **args)
+        cursor = result["cursor"]
+
+        return Page(
+            [LinkRecord(*item) for item in result["links"]],
+            cursor=None if cursor is None else tuple(cursor),
+        )
+
+    def sources(self):
+        """Return all the sources in the database."""
+        return [SourceRecord(*item) for item in self.request("sources")]
+
+    def add(self, url, name=None, tags=None):
+        """Add a link to the database."""
+        return self.request("add", url=url, name=name, tags=tags)
+
+    def visit(self, link_id):
+        """Record a visit to a link, returning its url."""
+        return self.request("visit", link_id=link_id)
+
+    def stats(self):
+        """Return the hit and miss statistics of the daemon's search cache."""
+        return self.request("stats")
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Reads a request from a client and writes the response."""
+
+    timeout = TIMEOUT
+
+    def handle(self):
+        line = self.rfile.readline()
+
+        if not line:
+            return
+
+        response = self.server.daemon.handle(json.loads(line))
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class Daemon:
+    """Serves requests for the given database.
+
+    :param filepath: The database to serve
+    :param db_profile: Optional. The performance profile to open the database with
+    :param profile: Optional. If :code:`True` profile the queries sent to the database
+    """
+
+    def __init__(self, filepath, db_profile="interactive", profile=False):
+        # Imported here so that clients don't have to.
+        from .data import Database
+
+        self.db = Database(
+            filepath, create=True, db_profile=db_profile, profile=profile
+        )
+        self.path = socket_path(filepath)
+        self.server = None
+
+    def handle(self, request):
+        """Handle a single request, returning the response."""
+
+        command = request.get("command")
+        method = getattr(self, f"do_{command}", None)
+
+        if method is None:
+            return {"ok": False, "error": f"Unknown command: {command!r}"}
+
+        try:
+            result = method(**request.get("args", {}))
+
+            # Don't hold a transaction open between requests.
+            self.db.commit()
+
+        except Exception as err:
+            logger.exception("Error handling %r", command)
+            self.db.session.rollback()
+
+            return {"ok": False, "error": str(err)}
+
+        return {"ok": True, "result": result}
+
+    def do_ping(self):
+        from ._version import __version__
+
+        return __version__
+
+    def do_search(self, **args):
+        from .data import Link
+
+        page = Link.search_records(self.db, **args)
+        return {"links": page, "cursor": page.cursor}
+
+    def do_sources(self):
+        from .data import Source
+
+        return Source.search_records(self.db)
+
+    def do_add(self, url, name=None, tags=None):
+        from .data import Link
+
+        return Link.create(self.db, url, name=name, tags=tags)
+
+    def do_visit(self, link_id):
+        from .data import Link
+
+        return Link.visit(self.db, link_id)
+
+    def do_stats(self):
+        return self.db.cache.info()._asdict()
+
+    def _remove_stale_socket(self):
+
+        if not self.path.exists():
+            return
+
+        try:
+            Client(self.path).request("ping")
+        except (OSError, DaemonError):
+            self.path.unlink()
+            return
+
+        raise DaemonError(f"A daemon is already listening on {self.path}")
+
+    def serve_forever(self):
+        """Serve requests until interrupted."""
+
+        from .data import recompute_frecency
+
+        self._remove_stale_socket()
+
+        # A convenient time to tidy up, since nothing else is waiting on us.
+        recompute_frecency(self.db)
+
+        # Only the current user should be able to connect.
+        umask = os.umask(0o077)
+
+        try:
+            self.server = socketserver.UnixStreamServer(str(self.path), RequestHandler)
+        finally:
+            os.umask(umask)
+
+        self.server.daemon = self
+        logger.info("Listening on %s", self.path)
+
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.path.unlink()
+            self.db.close()
+
+    def shutdown(self):
+        """Stop serving requests, must be called from another thread."""
+
+        if self.server is not None:
+            self.server.shutdown()
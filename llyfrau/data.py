@@ -1,21 +1,130 @@
+import collections
+import hashlib
+import heapq
+import json
 import logging
+import math
 import pathlib
+import time
+import urllib.parse
 import webbrowser
 
-from typing import List
-
-from sqlalchemy import Column, ForeignKey, Integer, Table, Text, create_engine, desc
+from itertools import islice
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import (
+    Column,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    Table,
+    Text,
+    and_,
+    column,
+    create_engine,
+    desc,
+    distinct,
+    event,
+    false,
+    func,
+    inspect,
+    literal_column,
+    select,
+    table,
+    true,
+)
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import joinedload, relationship, selectinload, sessionmaker
+
+from .bitmaps import BitmapIndex, evaluate, register, to_ids
+from .cache import CACHE_SIZE, ResultCache, make_key
+from .migrations import (
+    bump_generation,
+    get_generation,
+    get_version,
+    has_table,
+    migrate,
+)
+from .profiles import PROFILES, Profile
+from .profiling import default_profiler
+from .records import LinkRecord, Page, SourceRecord, TagRecord
+from .stats import recount
 
 logger = logging.getLogger(__name__)
 Base = declarative_base()
 
+BATCH_SIZE = 10000
+"""The number of rows written with each :code:`executemany` call when bulk loading."""
+
+FTS_MIN_LENGTH = 3
+"""The shortest search term the full text index is able to match against."""
+
+links_fts = table(
+    "links_fts",
+    column("rowid", Integer),
+    column("name", Text),
+    column("url", Text),
+    column("rank"),
+)
+"""The full text index over link names and urls.
+
+This is an external content FTS5 table using the trigram tokenizer, so it is able to
+answer the same case insensitive substring queries as :code:`ilike` but without
+having to scan every row in the :code:`links` table.
+"""
+
+FUZZY_THRESHOLD = 0.5
+"""The fraction of a search term's trigrams a link's name must contain for it to be
+considered a fuzzy match."""
+
+FUZZY_CANDIDATES = 1000
+"""The maximum number of candidates scored at each step of a fuzzy search.
+
+Candidates are taken in the order they are found in the index, sorting them by visits
+first would mean fetching every candidate."""
+
+FUZZY_VISITS_WEIGHT = 0.05
+"""How much the number of visits contributes to the score of a fuzzy match."""
+
+FRECENCY_HALF_LIFE = 30 * 24 * 60 * 60
+"""The time (in seconds) it takes for the contribution of a visit to a link's frecency
+to halve."""
+
+FRECENCY_DECAY = math.log(2) / FRECENCY_HALF_LIFE
+
+FRECENCY_MAX_AGE = 10 * FRECENCY_HALF_LIFE
+"""Visits older than this are dropped from the log by :func:`recompute_frecency`, by
+which point they contribute less than 0.1% of their original weight."""
+
+FRECENCY_RECOMPUTE_INTERVAL = 24 * 60 * 60
+"""How long (in seconds) :meth:`Link.visit` waits after the last call to
+:func:`recompute_frecency` before calling it again."""
+
+TAG_SEPARATOR = "\x1f"
+"""Separates the names of a link's tags when they are selected as a single column."""
+
+links_rank = func.bm25(literal_column("links_fts"))
+"""The relevance of a full text search result, lower is better.
+
+This is the same as the :code:`rank` column, but unlike :code:`rank` it can be
+compared against in a :code:`WHERE` clause.
+"""
+
 
 class Database:
     """Manages connections to the database."""
 
-    def __init__(self, filepath, create=False, verbose=False):
+    def __init__(
+        self,
+        filepath,
+        create=False,
+        verbose=False,
+        db_profile=None,
+        profile=False,
+        cache_size=CACHE_SIZE,
+    ):
         """Parameters
 
         :param filepath: The path to the database
@@ -23,22 +132,174 @@ class Database:
                        doesn't already exist.
         :param verbose: Optional. If :code:`True` enable sqlaclhemy's logging of SQL
                         commands
+        :param db_profile: Optional. The name of the performance profile (see
+                           :data:`PROFILES`) to apply to each connection.
+        :param profile: Optional. If :code:`True` record statistics on each statement
+                        executed using the :func:`~llyfrau.profiling.default_profiler`,
+                        or pass a :class:`~llyfrau.profiling.QueryProfiler` to use.
+        :param cache_size: Optional. The number of search results to keep in the
+                           :attr:`cache`, :code:`0` disables it.
         """
         logger.debug("Creating db instance for: %s", filepath)
         self.filepath = pathlib.Path(filepath)
 
+        if db_profile is not None and db_profile not in PROFILES:
+            raise ValueError(f"Unknown database profile: {db_profile!r}")
+
+        settings = PROFILES.get(db_profile, Profile(pragmas={}, params={}))
+        self.read_only = len(settings.params) > 0
+
+        if create and self.read_only:
+            raise ValueError(f"Unable to create a database using {db_profile!r}")
+
         if create and not self.filepath.parent.exists():
             self.filepath.parent.mkdir(parents=True)
 
-        self.engine = create_engine("sqlite:///" + filepath, echo=verbose)
+        self.engine = create_engine(self._url(filepath, settings), echo=verbose)
         self.new_session = sessionmaker(bind=self.engine)
+        event.listen(self.new_session, "after_flush", self._on_flush)
         self._session = None
+        self._tag_resolver = None
+
+        self.cache = ResultCache(cache_size)
+        """Results of the searches run against this database, see :meth:`cached`."""
+
+        # Connections currently in use, so that their queries can be interrupted.
+        self._in_use = {}
+        event.listen(self.engine, "checkout", self._on_checkout)
+        event.listen(self.engine, "checkin", self._on_checkin)
+
+        if len(settings.pragmas) > 0:
+            event.listen(self.engine, "connect", self._apply_pragmas(settings))
+
+        self.profiler = None
+
+        if profile is True:
+            self.profiler = default_profiler()
+        elif profile:
+            self.profiler = profile
+
+        if self.profiler is not None:
+            self.profiler.attach(self.engine)
 
         if create:
             Source.__table__.create(bind=self.engine, checkfirst=True)
             Link.__table__.create(bind=self.engine, checkfirst=True)
             Tag.__table__.create(bind=self.engine, checkfirst=True)
             tag_association_table.create(bind=self.engine, checkfirst=True)
+            Visit.__table__.create(bind=self.engine, checkfirst=True)
+
+        # Read only databases can't be migrated, so have to be used as they are.
+        if not self.read_only:
+            migrate(self.engine)
+
+        with self.engine.connect() as conn:
+            self.version = get_version(conn)
+            self.fts = has_table(conn, "links_fts")
+            self.has_generation = has_table(conn, "meta")
+            self.tag_bitmaps = has_table(conn, "tag_bitmaps")
+            self.link_counts = has_table(conn, "link_counts")
+
+    @staticmethod
+    def _url(filepath, profile):
+        """Return the url used to connect to the database at the given path."""
+
+        if len(profile.params) == 0 or filepath == ":memory:":
+            return "sqlite:///" + filepath
+
+        path = urllib.parse.quote(str(pathlib.Path(filepath).resolve()))
+        params = urllib.parse.urlencode({**profile.params, "uri": "true"})
+
+        return f"sqlite:///file:{path}?{params}"
+
+    def _on_flush(self, session, flush_context):
+        """Bump the generation if links, tags or sources were changed through the
+        ORM, see :meth:`bump_generation`."""
+
+        if not self.has_generation:
+            return
+
+        changed = [*session.new, *session.deleted]
+        changed.extend(obj for obj in session.dirty if session.is_modified(obj))
+        changed = [obj for obj in changed if isinstance(obj, (Link, Tag, Source))]
+
+        if len(changed) == 0:
+            return
+
+        tags = any(_tags_changed(obj, session) for obj in changed)
+        bump_generation(session.connection(), tags=tags and self.tag_bitmaps)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self._in_use[id(connection_record)] = dbapi_connection
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self._in_use.pop(id(connection_record), None)
+
+    def interrupt(self):
+        """Abort any queries currently running against the database.
+
+        This is safe to call from a different thread to the one running the query,
+        which will fail with an :class:`~sqlalchemy.exc.OperationalError`.
+        """
+
+        for dbapi_connection in list(self._in_use.values()):
+            dbapi_connection.interrupt()
+
+    @staticmethod
+    def _apply_pragmas(profile):
+        """Return a connect event handler that applies the profile's pragmas."""
+
+        def apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+
+            for name, value in profile.pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+
+            cursor.close()
+
+        return apply_pragmas
+
+    @property
+    def generation(self):
+        """The current generation of the database, see
+        :func:`~llyfrau.migrations.get_generation`.
+
+        Reads aren't made in a transaction, so queries made afterwards may see
+        changes made since. Reading the generation before the results it's used to
+        cache means those results are never older than it, at worst they're
+        discarded one change too early.
+        """
+
+        if not self.has_generation:
+            return None
+
+        return get_generation(self.session.connection())
+
+    def bump_generation(self, tags=False):
+        """Record that the current transaction changes links, tags or sources, see
+        :func:`~llyfrau.migrations.bump_generation`.
+
+        Changes made through the ORM are counted each time the session is flushed,
+        code writing to the tables directly calls this once it's made its changes.
+        If they include the tags of links, it has to be called before saving the
+        :class:`~llyfrau.bitmaps.BitmapIndex`.
+        """
+
+        if self.has_generation:
+            bump_generation(self.session.connection(), tags=tags and self.tag_bitmaps)
+
+    def cached(self, key, compute):
+        """Return the cached results for the given key, computing them if necessary.
+
+        Cached results are discarded as soon as the database's :attr:`generation`
+        changes.
+
+        :param key: The key identifying the results, see
+                    :func:`~llyfrau.cache.make_key`
+        :param compute: Called with no arguments to compute the results, which must
+                        not depend on the session, e.g. a list of records.
+        """
+        return self.cache.get(self.generation, key, compute)
 
     def commit(self):
 
@@ -65,6 +326,31 @@ class Database:
 
         return self._session
 
+    def bitmap_index(self):
+        """Return a :class:`~llyfrau.bitmaps.BitmapIndex` to record changes to the tags
+        of links in, or :code:`None` if the database doesn't have the index."""
+
+        if not self.tag_bitmaps:
+            return None
+
+        return BitmapIndex(self.session.connection())
+
+    def recount(self, tag_ids=(), source_ids=()):
+        """Update the number of links with the given tags and from the given sources,
+        see :mod:`llyfrau.stats`."""
+
+        if self.link_counts:
+            recount(self.session.connection(), tag_ids=tag_ids, source_ids=source_ids)
+
+    @property
+    def tag_resolver(self):
+        """Return the :class:`TagResolver` for this database."""
+
+        if self._tag_resolver is None:
+            self._tag_resolver = TagResolver(self)
+
+        return self._tag_resolver
+
 
 class Source(Base):
     """Represents a source that a link was imported from."""
@@ -83,6 +369,11 @@ class Source(Base):
     uri = Column(Text, nullable=False)
     """The uri that was used when importing the source."""
 
+    validator = Column(Text, nullable=True)
+    """The :code:`ETag` or :code:`Last-Modified` header of the resource the source
+    was last imported from, if it was fetched through the
+    :class:`~llyfrau.fetch.HttpCache`."""
+
     links = relationship("Link", backref="source")
     """Any links that were imported with this source."""
 
@@ -103,6 +394,11 @@ class Source(Base):
     def __repr__(self):
         return f"Source<{self.name}, {self.uri}>"
 
+    @property
+    def record(self):
+        """This source as a :class:`~llyfrau.records.SourceRecord`."""
+        return SourceRecord(self.id, self.name, self.uri, self.prefix)
+
     @classmethod
     def add(cls, db, items=None, commit=True, **kwargs):
         """Add a link or collection of links to the given database."""
@@ -149,12 +445,33 @@ class Source(Base):
         db.commit()
         return items[:top]
 
+    @classmethod
+    def search_records(cls, db, name=None, top=10) -> List[SourceRecord]:
+        """Search the given database for sources, returning cached records.
+
+        Takes the same arguments as :meth:`search`, but selects the records directly
+        rather than loading them through the ORM.
+        """
+
+        def search():
+            query = select(cls.id, cls.name, cls.uri, cls.prefix)
+
+            if name is not None:
+                query = query.where(cls.name.ilike(f"%{name}%"))
+
+            rows = db.session.execute(query.limit(top))
+            return [SourceRecord._make(row) for row in rows]
+
+        return db.cached(make_key("sources", name=name, top=top), search)
+
 
 tag_association_table = Table(
     "tag_associations",
     Base.metadata,
-    Column("link_id", Integer, ForeignKey("links.id")),
-    Column("tag_id", Integer, ForeignKey("tags.id")),
+    Column("link_id", Integer, ForeignKey("links.id"), primary_key=True),
+    Column("tag_id", Integer, ForeignKey("tags.id"), primary_key=True),
+    Index("ix_tag_associations_tag_id", "tag_id"),
+    sqlite_with_rowid=False,
 )
 
 
@@ -185,6 +502,11 @@ class Tag(Base):
     def __repr__(self):
         return f"Tag<{self.name}, {len(self.links)} links>"
 
+    @property
+    def record(self):
+        """This tag as a :class:`~llyfrau.records.TagRecord`."""
+        return TagRecord(self.id, self.name)
+
     @classmethod
     def add(cls, db, items=None, commit=True, **kwargs):
         """Add a link or collection of links to the given database."""
@@ -227,6 +549,25 @@ class Tag(Base):
 
         return query[:top]
 
+    @classmethod
+    def search_records(cls, db: Database, name: str = None, top: int = 10):
+        """Search the given database for tags, returning cached records.
+
+        Takes the same arguments as :meth:`search`, but selects the records directly
+        rather than loading them through the ORM.
+        """
+
+        def search():
+            query = select(cls.id, cls.name)
+
+            if name is not None:
+                query = query.where(cls.name.ilike(f"%{name}%"))
+
+            rows = db.session.execute(query.limit(top))
+            return [TagRecord._make(row) for row in rows]
+
+        return db.cached(make_key("tags", name=name, top=top), search)
+
     @classmethod
     def get(cls, db, id=None, name=None):
         """Get a tag by name or id."""
@@ -245,6 +586,82 @@ class Tag(Base):
             return item
 
 
+class TagResolver:
+    """Maps tag names to ids, creating any tags that don't exist yet.
+
+    Resolved ids are cached, so that looking up the same names again doesn't require
+    a round trip to the database. The cache is cleared whenever the session is rolled
+    back since any tags it created may no longer exist.
+    """
+
+    CHUNK_SIZE = 500
+    """The number of names to look up in a single query."""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.ids = {}
+        self.preloaded = False
+
+        event.listen(db.session, "after_rollback", self._on_rollback)
+
+    def _on_rollback(self, session):
+        self.clear()
+
+    def clear(self):
+        """Clear the cache."""
+        self.ids.clear()
+        self.preloaded = False
+
+    def preload(self):
+        """Load the entire :code:`tags` table into the cache.
+
+        When a large number of names need resolving this is cheaper than looking each
+        batch of names up separately.
+        """
+
+        if self.preloaded:
+            return
+
+        query = select(Tag.name, Tag.id)
+        self.ids.update(self.db.session.execute(query).all())
+        self.preloaded = True
+
+    def _lookup(self, names):
+
+        names = sorted(names)
+
+        for idx in range(0, len(names), self.CHUNK_SIZE):
+            chunk = names[idx : idx + self.CHUNK_SIZE]
+            query = select(Tag.name, Tag.id).where(Tag.name.in_(chunk))
+
+            self.ids.update(self.db.session.execute(query).all())
+
+    def resolve(self, names: Iterable[str], create: bool = True) -> Dict[str, int]:
+        """Return a dictionary mapping each of the given names to its tag id.
+
+        :param names: The tag names to resolve
+        :param create: Optional. If :code:`False` names without an existing tag are
+                       left out of the result rather than created.
+        """
+
+        names = set(names)
+        unseen = names - self.ids.keys()
+
+        if len(unseen) > 0 and not self.preloaded:
+            self._lookup(unseen)
+
+        missing = names - self.ids.keys()
+
+        if create and len(missing) > 0:
+            statement = insert(Tag.__table__).on_conflict_do_nothing()
+            params = [{"name": name} for name in sorted(missing)]
+
+            self.db.session.execute(statement, params)
+            self._lookup(missing)
+
+        return {name: self.ids[name] for name in names if name in self.ids}
+
+
 class Link(Base):
     """Represents an individual link."""
 
@@ -265,9 +682,23 @@ class Link(Base):
     source_id = Column(Integer, ForeignKey("sources.id"), nullable=True)
     """The id of the source the link was added with, if applicable"""
 
+    digest = Column(Text, nullable=True)
+    """A hash of the link's name and tags, used to detect changes when re-importing a
+    source. See :func:`link_digest`."""
+
+    frecency = Column(Float, nullable=False, default=0, server_default="0")
+    """How frequently and recently the link has been visited, :code:`0` if it has never
+    been visited. See :func:`current_frecency`."""
+
     tags = relationship("Tag", secondary=tag_association_table, back_populates="links")
     """The tags applied to this link."""
 
+    __table_args__ = (
+        Index("ix_links_visits", visits.desc()),
+        Index("ix_links_frecency", frecency.desc()),
+        Index("ix_links_source_id", source_id),
+    )
+
     def __eq__(self, other):
 
         if not isinstance(other, Link):
@@ -293,18 +724,52 @@ class Link(Base):
 
         return self.url
 
+    @property
+    def record(self):
+        """This link as a :class:`~llyfrau.records.LinkRecord`."""
+
+        source = None if self.source is None else self.source.name
+        tags = [t.name for t in self.tags]
+
+        return LinkRecord(
+            self.id, self.name, self.url_expanded, self.visits, source, tags
+        )
+
     @classmethod
-    def open(cls, db, link_id):
-        """Open the link with the given id"""
+    def visit(cls, db, link_id, when=None):
+        """Record a visit to the link with the given id, returning its url.
+
+        :param db: The database containing the link
+        :param link_id: The id of the link that was visited
+        :param when: Optional. The time of the visit as a unix timestamp, defaults to
+                     now.
+        """
+
+        when = time.time() if when is None else when
 
         link = cls.get(db, link_id)
         url = link.url_expanded
-        webbrowser.open(url)
 
         # Update the stats
         link.visits += 1
+        link.frecency = logaddexp(link.frecency, FRECENCY_DECAY * when)
+        db.session.add(Visit(link_id=link.id, visited_at=when))
+
+        # Flushing the visit bumps the generation, which covers the rebuilt scores.
+        if _frecency_recompute_due(db, when):
+            recompute_frecency(db, now=when, commit=False)
+
         db.commit()
 
+        return url
+
+    @classmethod
+    def open(cls, db, link_id):
+        """Open the link with the given id"""
+
+        url = cls.visit(db, link_id)
+        webbrowser.open(url)
+
     @classmethod
     def add(cls, db, items=None, commit=True, **kwargs):
         """Add a link or collection of links to the given database."""
@@ -325,6 +790,34 @@ class Link(Base):
         if commit:
             db.commit()
 
+    @classmethod
+    def create(cls, db, url, name=None, tags=None):
+        """Add a new link with the given tags to the database, returning its id.
+
+        Any tags that don't already exist are created.
+        """
+
+        link = cls(name=name, url=url)
+        cls.add(db, items=[link], commit=False)
+
+        if tags:
+            tag_ids = db.tag_resolver.resolve(tags)
+            db.session.flush()
+
+            associations = [(link.id, id_) for id_ in sorted(set(tag_ids.values()))]
+            index = db.bitmap_index()
+            bulk_insert(db, tag_association_table, associations)
+            db.bump_generation(tags=True)
+
+            if index is not None:
+                index.add(associations)
+                index.save()
+
+            db.recount(tag_ids=list(tag_ids.values()))
+
+        db.commit()
+        return link.id
+
     @classmethod
     def get(cls, db, id):
         """Get a link with the given id from the database."""
@@ -342,7 +835,13 @@ class Link(Base):
         tags: List[str] = None,
         top: int = 10,
         sort: str = None,
-    ):
+        tag_mode: str = "and",
+        exclude_tags: List[str] = None,
+        eager: bool = False,
+        after: Tuple = None,
+        fuzzy: bool = False,
+        query: str = None,
+    ) -> Page:
         """Search the given database for links.
 
         The :code:`sort` parameter can be used to control the order in which the
@@ -351,37 +850,999 @@ class Link(Base):
         - :code:`None` (default), results are returned in the default sort order from
           the database
         - :code:`"visits"`, results are returned with the most visited links first.
+        - :code:`"frecency"`, results are returned with the links that have been
+          visited most often recently first, see :func:`current_frecency`.
 
         Invalid options will be ignored
 
+        Results are returned a :class:`~llyfrau.records.Page` at a time. To fetch the
+        next page, repeat the search passing the page's :code:`cursor` as
+        :code:`after`. Rather than skipping over the results on earlier pages with an
+        :code:`OFFSET`, the cursor is used to seek straight to where the previous page
+        left off, so later pages are as cheap to fetch as the first.
+
+        When filtering by :code:`name` the full text index is used where possible, in
+        which case results are additionally ranked by relevance (bm25). Names shorter
+        than :data:`FTS_MIN_LENGTH` or databases without the index fall back to a
+        substring match over the :code:`links` table.
+
+        With :code:`fuzzy=True`, links are matched by the fraction of the trigrams in
+        :code:`name` that also appear in their name, which tolerates typos such as
+        :code:`ndarry`. See :meth:`_fuzzy_search` for details. Fuzzy results come
+        in a single page, ordered by similarity and then by visits.
+
+        The :code:`query` parameter takes a search written in the query language
+        described in :mod:`llyfrau.query`, e.g. :code:`"array #numpy -#deprecated"`.
+        It's compiled into filters on the same statement as the other parameters, but
+        unlike :code:`name` its matches aren't ranked by relevance.
+
+        The :code:`tag_mode` parameter controls how multiple :code:`tags` are combined
+
+        - :code:`"and"` (default), only return links that have all of the given tags
+        - :code:`"or"`, return links that have at least one of the given tags
+
         :param db: The database object to search
         :param name: Only return links whose name contains the given string.
         :param source: Only return links from the given source.
         :param tags: Only return links with the given tags
         :param top: Only return the top :code:`N` results. (Default :code:`10`)
         :param sort: The criteria to sort the results by. (Default :code:`None`)
+        :param tag_mode: How to combine the given tags. (Default :code:`"and"`)
+        :param exclude_tags: Don't return links with any of the given tags
+        :param eager: If :code:`True`, load each link's tags and source along with the
+                      results so they can be rendered without any further queries.
+        :param after: Only return the results after the given cursor, taken from the
+                      previous page of the same search.
+        :param fuzzy: If :code:`True`, match :code:`name` approximately.
+        :param query: Only return links matching the given query.
         """
 
         session = db.session
+        filters = cls._filters(
+            db,
+            source=source,
+            tags=tags,
+            tag_mode=tag_mode,
+            exclude_tags=exclude_tags,
+            query=query,
+        )
+
+        if fuzzy and name is not None and db.fts and len(trigrams(name)) > 0:
+            return cls._fuzzy_search(db, name, filters, top=top, eager=eager)
+
+        ranked = cls._name_filter(db, name, filters)
+        keys = cls._sort_keys(sort, ranked)
+
+        if ranked:
+            query = session.query(cls, links_rank)
+            query = query.join(links_fts, links_fts.c.rowid == cls.id)
+        else:
+            query = session.query(cls)
+
+        if eager:
+            query = query.options(selectinload(cls.tags), joinedload(cls.source))
+
+        if len(filters) > 0:
+            query = query.filter(*filters)
+
+        query = query.order_by(*[desc(c) if d else c for c, d in keys])
+
+        def fetch(seek, limit):
+
+            if limit is None:
+                return list(query.filter(seek))
+
+            return query.filter(seek)[:limit]
+
+        rows, more = cls._paginate(fetch, keys, after, top)
+
+        if ranked:
+            links = [link for link, _ in rows]
+            ranks = [rank for _, rank in rows]
+        else:
+            links = rows
+            ranks = [None] * len(rows)
+
+        cursor = cls._cursor(links[-1], ranks[-1], sort) if more else None
+        return Page(links, cursor=cursor)
+
+    @classmethod
+    def search_records(cls, db: Database, **args) -> Page:
+        """Search the given database for links, returning a page of cached records.
+
+        Takes the same arguments as :meth:`search`, apart from :code:`eager`. Rather
+        than going through the ORM, each page of records, along with their sources
+        and tags, is selected with a single statement. See :meth:`_search_records`.
+        """
+
+        key = dict(args)
+
+        if key.get("source") is not None:
+            key["source"] = key["source"].id
+
+        return db.cached(
+            make_key("links", **key), lambda: cls._search_records(db, **args)
+        )
+
+    @classmethod
+    def _search_records(
+        cls,
+        db,
+        name=None,
+        source=None,
+        tags=None,
+        top=10,
+        sort=None,
+        tag_mode="and",
+        exclude_tags=None,
+        after=None,
+        fuzzy=False,
+        query=None,
+    ):
+        """Search for links, returning them as records without loading any ORM
+        instances."""
+
+        filters = cls._filters(
+            db,
+            source=source,
+            tags=tags,
+            tag_mode=tag_mode,
+            exclude_tags=exclude_tags,
+            query=query,
+        )
+
+        if fuzzy and name is not None and db.fts and len(trigrams(name)) > 0:
+            best = cls._fuzzy_match(db, name, filters, top=top)
+
+            if len(best) == 0:
+                return Page()
+
+            query = link_records.where(cls.id.in_(best))
+            rows = {row.id: row for row in db.session.execute(query)}
+
+            return Page([cls._make_record(rows[id_]) for id_ in best])
+
+        ranked = cls._name_filter(db, name, filters)
+        keys = cls._sort_keys(sort, ranked)
+
+        matches = select(cls.id)
+
+        if ranked:
+            matches = matches.add_columns(links_rank.label("rank"))
+            matches = matches.join(links_fts, links_fts.c.rowid == cls.id)
+
+        matches = matches.where(*filters)
+        matches = matches.order_by(*[desc(c) if d else c for c, d in keys])
+
+        def fetch(seek, limit):
+
+            # Only look up the source and tags of the links in the page, rather than
+            # every match before they are sorted.
+            page = matches.where(seek).limit(limit).subquery()
+            query = link_records.join(page, page.c.id == cls.id)
+            order = []
+
+            for col, descending in keys:
+                col = page.c.rank if col is links_rank else col
+                order.append(desc(col) if descending else col)
+
+            if ranked:
+                query = query.add_columns(page.c.rank)
+
+            return db.session.execute(query.order_by(*order)).all()
+
+        rows, more = cls._paginate(fetch, keys, after, top)
+
+        cursor = None
+
+        if more:
+            last = rows[-1]
+            cursor = cls._cursor(last, last.rank if ranked else None, sort)
+
+        return Page([cls._make_record(row) for row in rows], cursor=cursor)
+
+    @staticmethod
+    def _make_record(row):
+        """Return the :class:`~llyfrau.records.LinkRecord` for a row selected from
+        :data:`link_records`."""
+
+        tags = [] if row.tags is None else row.tags.split(TAG_SEPARATOR)
+        return LinkRecord(row.id, row.name, row.url, row.visits, row.source, tags)
+
+    @classmethod
+    def _filters(
+        cls,
+        db,
+        source=None,
+        tags=None,
+        tag_mode="and",
+        exclude_tags=None,
+        query=None,
+    ):
+        """Return the filters selecting links from the given source, with the given
+        tags, that match the given query."""
+
         filters = []
 
-        if name is not None:
-            filters.append(cls.name.ilike(f"%{name}%"))
+        if query is not None:
+            # Imported here, since the query module depends on this one.
+            from .query import compile_query, parse
+
+            filters.extend(compile_query(db, parse(query)))
 
         if source is not None:
             filters.append(cls.source_id == source.id)
 
-        if tags is not None:
+        selected = cls._bitmap_filter(db, tags, tag_mode, exclude_tags)
 
-            for tag in tags:
-                filters.append(Link.tags.any(name=tag))
+        if selected is not None:
+            filters.append(selected)
+            return filters
 
-        query = session.query(cls)
+        if tags:
+            filters.append(cls._tag_filter(db, tags, mode=tag_mode))
 
-        if len(filters) > 0:
-            query = query.filter(*filters)
+        if exclude_tags:
+            filters.append(~cls._tag_filter(db, exclude_tags, mode="or"))
+
+        return filters
+
+    @classmethod
+    def _bitmap_filter(cls, db, tags, mode, exclude_tags):
+        """Return a filter selecting the links with the given tags using the bitmap
+        index, see :mod:`llyfrau.bitmaps`.
+
+        Returns :code:`None` if the index can't help, in which case
+        :meth:`_tag_filter` should be used instead.
+        """
+
+        if mode not in {"and", "or"}:
+            raise ValueError(f"Unknown tag mode: {mode!r}")
+
+        tags, exclude_tags = set(tags or []), set(exclude_tags or [])
+
+        if not db.tag_bitmaps or len(tags | exclude_tags) == 0:
+            return None
+
+        names = tags | exclude_tags
+        ids = dict(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(names)))
+
+        tag_ids = [ids[name] for name in tags if name in ids]
+        exclude_ids = [ids[name] for name in exclude_tags if name in ids]
+
+        if len(tags) > 0 and (
+            len(tag_ids) == 0 or (mode == "and" and len(tag_ids) < len(tags))
+        ):
+            return false()
+
+        conn = db.session.connection()
+        selection = evaluate(conn, tag_ids, mode=mode, exclude_ids=exclude_ids)
+
+        if selection is None:
+            return None
+
+        if selection.sparse:
+            values = func.json_each(json.dumps(to_ids(selection.links)))
+            selected = cls.id.in_(select(values.table_valued("value").c.value))
+
+        else:
+            # Check each link against the bitmap as it's visited, so that the search
+            # can stop as soon as it has enough results.
+            register(conn, "in_tag_bitmap", selection.links)
+            selected = func.in_tag_bitmap(cls.id) == 1
+
+        return ~selected if selection.negated else selected
+
+    @classmethod
+    def _name_filter(cls, db, name, filters):
+        """Add the filter matching links by name to :code:`filters`.
+
+        Returns :code:`True` if the full text index is used, in which case the results
+        should be joined against it and ranked by relevance.
+        """
+
+        if name is not None and db.fts and len(name) >= FTS_MIN_LENGTH:
+            phrase = '"' + name.replace('"', '""') + '"'
+            filters.append(links_fts.c.name.op("MATCH")(phrase))
+            return True
+
+        if name is not None:
+            filters.append(cls.name.ilike(f"%{name}%"))
+
+        return False
+
+    @classmethod
+    def _sort_keys(cls, sort, ranked):
+        """Return the keys, :code:`(column, descending)`, to sort the results by.
+
+        The keys end with the id, so that every result has a distinct position for
+        the cursor to refer to.
+        """
+
+        keys = []
 
         if sort == "visits":
-            query = query.order_by(desc(cls.visits))
+            keys.append((cls.visits, True))
 
-        return query[:top]
+        if sort == "frecency":
+            keys.append((cls.frecency, True))
+
+        if ranked:
+            keys.append((links_rank, False))
+
+        keys.append((cls.id, False))
+        return keys
+
+    @classmethod
+    def _paginate(cls, fetch, keys, after, top):
+        """Fetch the page of results after the given cursor.
+
+        :param fetch: Called with a filter and a limit, returns the rows matching the
+                      filter in order.
+
+        Returns the rows in the page and whether there's another page after it.
+        """
+
+        rows = []
+
+        # Each range is queried separately, since an index can only be used to seek
+        # to the start of a range if it's not part of an OR.
+        for seek in cls._seek(keys, after):
+
+            if top is None:
+                rows.extend(fetch(seek, None))
+                continue
+
+            # Fetch an extra result to see if there's another page.
+            rows.extend(fetch(seek, top + 1 - len(rows)))
+
+            if len(rows) > top:
+                break
+
+        more = top is not None and len(rows) > top
+        return rows[:top], more
+
+    @classmethod
+    def _fuzzy_search(cls, db, name, filters, top=10, eager=False):
+        """Find the links whose names best match the given name, allowing for typos.
+
+        See :meth:`_fuzzy_match` for details.
+        """
+
+        best = cls._fuzzy_match(db, name, filters, top=top)
+
+        if len(best) == 0:
+            return Page()
+
+        query = db.session.query(cls).filter(cls.id.in_(best))
+
+        if eager:
+            query = query.options(selectinload(cls.tags), joinedload(cls.source))
+
+        links = {link.id: link for link in query}
+        return Page([links[id_] for id_ in best])
+
+    @classmethod
+    def _fuzzy_match(cls, db, name, filters, top=10):
+        """Return the ids of the links whose names best match the given name, best
+        match first.
+
+        A link's similarity is the fraction of the trigrams in :code:`name` that are
+        also found in the link's name, links below :data:`FUZZY_THRESHOLD` are not
+        returned.
+
+        Rather than scoring every link, candidates are found with the trigram full
+        text index, first looking for links that contain all :code:`n` trigrams, then
+        at least :code:`n - 1`, :code:`n - 2` and so on, stopping as soon as there
+        are enough results.
+
+        A link that contains all but :code:`m` of the trigrams must contain every
+        trigram in at least one of any :code:`m + 1` disjoint groups of them, so each
+        step is a single query for links that match any one of :code:`m + 1` groups.
+        """
+
+        grams = trigrams(name)
+        n = len(grams)
+        min_matches = max(1, math.ceil(FUZZY_THRESHOLD * n))
+
+        # Keep the trigrams in the order they appear, so that each group covers a
+        # part of the name. A typo then only affects the groups it falls in.
+        ordered = list(dict.fromkeys(trigrams(name, ordered=True)))
+        terms = ['"' + g.replace('"', '""') + '"' for g in ordered]
+
+        scores = {}
+        similar = 0
+
+        for k in range(n, min_matches - 1, -1):
+            size = n - k + 1
+            groups = [terms[n * i // size : n * (i + 1) // size] for i in range(size)]
+
+            expr = " OR ".join("(" + " AND ".join(group) + ")" for group in groups)
+            query = (
+                select(cls.id, cls.name, cls.visits)
+                .select_from(links_fts)
+                .join(cls.__table__, cls.id == links_fts.c.rowid)
+                .where(links_fts.c.name.op("MATCH")(expr), *filters)
+                .limit(FUZZY_CANDIDATES)
+            )
+
+            for id_, link_name, visits in db.session.execute(query):
+
+                if id_ in scores:
+                    continue
+
+                matches = len(grams & trigrams(link_name))
+
+                if matches < min_matches:
+                    continue
+
+                similarity = matches / n
+                score = similarity + FUZZY_VISITS_WEIGHT * math.log1p(visits or 0)
+
+                # Prefer shorter names when the scores are tied.
+                scores[id_] = (score, -len(link_name), -id_)
+                similar += matches >= k
+
+            # Every link containing k or more of the trigrams has now been found.
+            if top is not None and similar >= top:
+                break
+
+        if top is None:
+            return sorted(scores, key=scores.get, reverse=True)
+
+        return heapq.nlargest(top, scores, key=scores.get)
+
+    @staticmethod
+    def _cursor(link, rank, sort):
+        """Return the cursor pointing at the given result."""
+
+        cursor = []
+
+        if sort == "visits":
+            cursor.append(link.visits)
+
+        if sort == "frecency":
+            cursor.append(link.frecency)
+
+        if rank is not None:
+            cursor.append(rank)
+
+        cursor.append(link.id)
+        return tuple(cursor)
+
+    @staticmethod
+    def _seek(keys, after):
+        """Return the filters selecting the results that sort after the given cursor.
+
+        :code:`(a, b, c) > (x, y, z)` is split into the ranges
+
+        - :code:`a = x AND b = y AND c > z`
+        - :code:`a = x AND b > y`
+        - :code:`a > x`
+
+        which are returned in the order they appear in the results.
+        """
+
+        if after is None:
+            return [true()]
+
+        if len(after) != len(keys):
+            raise ValueError(f"Invalid cursor: {after!r}")
+
+        ranges = []
+
+        for idx in reversed(range(len(keys))):
+            col, descending = keys[idx]
+            value = after[idx]
+
+            equal = [c == v for (c, _), v in zip(keys[:idx], after)]
+            ranges.append(and_(*equal, col < value if descending else col > value))
+
+        return ranges
+
+    @classmethod
+    def _tag_filter(cls, db, tags, mode="and"):
+        """Return a filter selecting the links tagged with the given tags.
+
+        Tag names are resolved to ids up front, so that links can be selected directly
+        from the :code:`tag_associations` table without joining against :code:`tags`
+        once per tag.
+        """
+
+        if mode not in {"and", "or"}:
+            raise ValueError(f"Unknown tag mode: {mode!r}")
+
+        names = set(tags)
+        ids = [id_ for (id_,) in db.session.query(Tag.id).filter(Tag.name.in_(names))]
+
+        if len(ids) == 0 or (mode == "and" and len(ids) < len(names)):
+            return false()
+
+        link_id = tag_association_table.c.link_id
+        tag_id = tag_association_table.c.tag_id
+        tagged = select(link_id).where(tag_id.in_(ids))
+
+        if mode == "and" and len(ids) > 1:
+            tagged = tagged.group_by(link_id).having(
+                func.count(distinct(tag_id)) == len(ids)
+            )
+
+        return cls.id.in_(tagged)
+
+
+link_tag_names = (
+    select(func.group_concat(Tag.name, TAG_SEPARATOR))
+    .select_from(tag_association_table)
+    .join(Tag, Tag.id == tag_association_table.c.tag_id)
+    .where(tag_association_table.c.link_id == Link.id)
+    .scalar_subquery()
+)
+"""The names of a link's tags, separated by :data:`TAG_SEPARATOR`."""
+
+link_records = (
+    select(
+        Link.id,
+        Link.name,
+        (func.coalesce(Source.prefix, "") + Link.url).label("url"),
+        Link.visits,
+        Source.name.label("source"),
+        link_tag_names.label("tags"),
+        Link.frecency,
+    )
+    .select_from(Link)
+    .outerjoin(Source, Source.id == Link.source_id)
+)
+"""Selects links with everything needed to make a
+:class:`~llyfrau.records.LinkRecord`, along with the columns the results can be sorted
+by."""
+
+
+class Visit(Base):
+    """A record of a visit to a link."""
+
+    __tablename__ = "visit_log"
+
+    id = Column(Integer, primary_key=True)
+
+    link_id = Column(Integer, ForeignKey("links.id"), nullable=False)
+    """The id of the link that was visited."""
+
+    visited_at = Column(Float, nullable=False)
+    """When the link was visited, as a unix timestamp."""
+
+    __table_args__ = (Index("ix_visit_log_link_id", link_id, visited_at),)
+
+
+def logaddexp(a: float, b: float) -> float:
+    """Return :code:`log(exp(a) + exp(b))` without overflowing."""
+
+    hi, lo = (a, b) if a >= b else (b, a)
+    return hi + math.log1p(math.exp(lo - hi))
+
+
+def current_frecency(db, link_id, when=None) -> float:
+    """Return the frecency of the link with the given id at the given time.
+
+    Each visit to a link contributes :code:`exp(-FRECENCY_DECAY * age)` to its
+    frecency, so that a visit's weight halves every :data:`FRECENCY_HALF_LIFE`.
+
+    Since every link decays at the same rate, the order links are in by frecency
+    never changes with time alone. The :code:`frecency` column stores the sum with
+    the decay factored out, in log space::
+
+        log(sum(exp(FRECENCY_DECAY * visited_at)))
+
+    which only needs to be updated when a link is visited, and can be indexed.
+
+    :param db: The database containing the link
+    :param link_id: The id of the link
+    :param when: Optional. The time to calculate the frecency at, defaults to now.
+    """
+
+    when = time.time() if when is None else when
+    link = Link.get(db, link_id)
+
+    if link.frecency == 0:
+        return 0.0
+
+    return math.exp(link.frecency - FRECENCY_DECAY * when)
+
+
+def recompute_frecency(db, now=None, batch_size=BATCH_SIZE, commit=True) -> int:
+    """Rebuild every link's frecency from the visit log, returning the number of links
+    updated.
+
+    Visits older than :data:`FRECENCY_MAX_AGE` are removed from the log first. This
+    keeps the log from growing forever and resets any rounding errors that have built
+    up from updating the scores one visit at a time. :meth:`Link.visit` calls this
+    once every :data:`FRECENCY_RECOMPUTE_INTERVAL`.
+
+    :param commit: Optional. If :code:`False` leave the changes to be committed by
+                   the caller, who is also responsible for bumping the generation.
+    """
+
+    now = time.time() if now is None else now
+    session = db.session
+
+    session.execute(
+        Visit.__table__.delete().where(Visit.visited_at < now - FRECENCY_MAX_AGE)
+    )
+
+    query = select(Visit.link_id, Visit.visited_at).order_by(
+        Visit.link_id, Visit.visited_at
+    )
+    scores = {}
+
+    for link_id, visited_at in session.execute(query):
+        score = scores.get(link_id)
+        value = FRECENCY_DECAY * visited_at
+
+        scores[link_id] = value if score is None else logaddexp(score, value)
+
+    conn = session.connection()
+    conn.exec_driver_sql("UPDATE links SET frecency = 0 WHERE frecency != 0")
+
+    for batch in batched(scores.items(), batch_size):
+        conn.exec_driver_sql(
+            "UPDATE links SET frecency = ? WHERE id = ?",
+            [(score, link_id) for link_id, score in batch],
+        )
+
+    if db.has_generation:
+        conn.exec_driver_sql(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            ("frecency_recomputed_at", now),
+        )
+
+    if commit:
+        db.bump_generation()
+        db.commit()
+
+    return len(scores)
+
+
+def _frecency_recompute_due(db, now) -> bool:
+    """Return :code:`True` if :func:`recompute_frecency` was last called more than
+    :data:`FRECENCY_RECOMPUTE_INTERVAL` before the given time."""
+
+    if not db.has_generation:
+        return False
+
+    conn = db.session.connection()
+    last = conn.exec_driver_sql(
+        "SELECT value FROM meta WHERE key = 'frecency_recomputed_at'"
+    ).scalar()
+
+    return last is None or last < now - FRECENCY_RECOMPUTE_INTERVAL
+
+
+SyncResult = collections.namedtuple("SyncResult", "added,removed,updated,unchanged")
+"""A summary of the changes made by :func:`sync_links`."""
+
+
+def trigrams(text: str, ordered=False):
+    """Return the set of case insensitive trigrams in the given text.
+
+    These are the same trigrams as the ones stored in the full text index.
+
+    :param text: The text to split into trigrams
+    :param ordered: Optional. If :code:`True` return a list of the trigrams in the
+                    order they appear.
+    """
+
+    text = text.lower()
+    grams = [text[i : i + 3] for i in range(len(text) - 2)]
+
+    return grams if ordered else set(grams)
+
+
+def _tags_changed(obj, session) -> bool:
+    """Determine if flushing the given link, tag or source changes the tags of any
+    links."""
+
+    if isinstance(obj, Source):
+        return False
+
+    if obj in session.deleted:
+        return True
+
+    name = "tags" if isinstance(obj, Link) else "links"
+    return inspect(obj).attrs[name].history.has_changes()
+
+
+def link_digest(name: str, tags: Iterable[str]) -> str:
+    """Return a hash of the given link name and tags."""
+
+    content = "\0".join([name, *sorted(set(tags))])
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def batched(items, size):
+    """Split the given iterable into lists of at most :code:`size` items."""
+
+    items = iter(items)
+
+    while True:
+        batch = list(islice(items, size))
+
+        if len(batch) == 0:
+            return
+
+        yield batch
+
+
+def bulk_insert(
+    db: Database,
+    table: Table,
+    rows: Iterable[tuple],
+    columns: List[str] = None,
+    batch_size: int = BATCH_SIZE,
+) -> List[int]:
+    """Insert the given rows into a table, bypassing the ORM.
+
+    Rows are plain tuples with their values in the same order as :code:`columns`,
+    which defaults to every column in the table except :code:`id`. If the table has an
+    :code:`id` column new ids are allocated up front so that they can be returned
+    without having to fetch each one after it has been inserted.
+
+    Rows are written through the current session's connection in batches using
+    :code:`executemany`, it's up to the caller to commit the transaction.
+
+    :param db: The database to insert the rows into
+    :param table: The table to insert the rows into
+    :param rows: The rows to insert
+    :param columns: The names of the columns the values in each row correspond to.
+    :param batch_size: The number of rows to insert with each call to the database.
+    :returns: The ids of the new rows, in the order they were given.
+    """
+
+    if columns is None:
+        columns = [c.name for c in table.columns if c.name != "id"]
+
+    conn = db.session.connection()
+    has_id = "id" in table.columns and "id" not in columns
+
+    if has_id:
+        columns = ["id", *columns]
+
+        # Take the write lock before reserving the ids, so that another writer can't
+        # use them first.
+        if not conn.connection.dbapi_connection.in_transaction:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+        next_id = conn.execute(select(func.max(table.c.id))).scalar() or 0
+
+    names = ", ".join(columns)
+    params = ", ".join("?" for _ in columns)
+    statement = f"INSERT INTO {table.name} ({names}) VALUES ({params})"
+
+    ids = []
+
+    for batch in batched(rows, batch_size):
+
+        if has_id:
+            new_ids = range(next_id + 1, next_id + len(batch) + 1)
+            batch = [(id_, *row) for id_, row in zip(new_ids, batch)]
+
+            ids.extend(new_ids)
+            next_id += len(batch)
+
+        conn.exec_driver_sql(statement, batch)
+
+    return ids
+
+
+def bulk_import(
+    db: Database,
+    links: Iterable[Tuple[str, str, List[str]]],
+    source: dict = None,
+    batch_size: int = BATCH_SIZE,
+    commit: bool = True,
+    source_id: int = None,
+    recount: bool = True,
+) -> List[int]:
+    """Import links into the database, bypassing the ORM.
+
+    This is much faster than creating a :class:`Link` instance for each link and is
+    intended for importers that need to add a large number of links in one go.
+
+    :param db: The database to import the links into
+    :param links: The links to import, as :code:`(name, url, tags)` tuples
+    :param source: Optional. If given, a dictionary describing the source the links
+                   were imported from.
+    :param batch_size: The number of links to write with each call to the database.
+    :param commit: Optional. If :code:`False` leave the transaction open.
+    :param source_id: Optional. The id of an existing source to add the links to.
+    :param recount: Optional. If :code:`False` the number of links with each tag and
+                    from the source (see :mod:`llyfrau.stats`) are left for the
+                    caller to update, e.g. once every chunk of a source has been
+                    imported.
+    :returns: The ids of the new links, in the order they were given.
+    """
+
+    link_ids = []
+    tagged = set()
+    index = db.bitmap_index()
+
+    resolver = db.tag_resolver
+    resolver.preload()
+
+    if source is not None:
+        row = (source["name"], source.get("prefix"), source["uri"])
+        (source_id,) = bulk_insert(
+            db, Source.__table__, [row], columns=["name", "prefix", "uri"]
+        )
+
+    for batch in batched(links, batch_size):
+
+        tag_ids = resolver.resolve({tag for (_, _, tags) in batch for tag in tags})
+
+        ids = bulk_insert(
+            db,
+            Link.__table__,
+            [
+                (name, url, 0, source_id, link_digest(name, tags))
+                for (name, url, tags) in batch
+            ],
+            columns=["name", "url", "visits", "source_id", "digest"],
+            batch_size=batch_size,
+        )
+
+        associations = {
+            (link_id, tag_ids[tag])
+            for link_id, (_, _, tags) in zip(ids, batch)
+            for tag in tags
+        }
+
+        bulk_insert(
+            db, tag_association_table, sorted(associations), batch_size=batch_size
+        )
+        link_ids.extend(ids)
+        tagged.update(tag_ids.values())
+
+        if index is not None:
+            index.add(associations)
+
+    if source is not None or len(link_ids) > 0:
+        db.bump_generation(tags=len(link_ids) > 0)
+
+    if index is not None:
+        index.save()
+
+    if recount:
+        db.recount(tag_ids=tagged, source_ids=[] if source_id is None else [source_id])
+
+    if commit:
+        db.commit()
+
+    return link_ids
+
+
+def sync_links(
+    db: Database,
+    source_id: int,
+    links: Iterable[Tuple[str, str, List[str]]],
+    batch_size: int = BATCH_SIZE,
+    commit: bool = True,
+) -> SyncResult:
+    """Update the links belonging to a source to match the given links.
+
+    Incoming links are matched to stored links by url, links that share a url are
+    paired up in the order they were added. Only the differences are written to the
+    database, so links that are unchanged keep their id and visit count.
+
+    - Incoming links without a match are added
+    - Stored links without a match are removed
+    - Matched links whose :func:`link_digest` differs have their name and tags
+      updated.
+
+    :param db: The database to update
+    :param source_id: The id of the source to update
+    :param links: The source's links, as :code:`(name, url, tags)` tuples
+    :param batch_size: The number of links to write with each call to the database.
+    :param commit: Optional. If :code:`False` leave the transaction open.
+    """
+
+    session = db.session
+    stored = collections.defaultdict(collections.deque)
+
+    query = (
+        select(Link.id, Link.url, Link.digest)
+        .where(Link.source_id == source_id)
+        .order_by(Link.id)
+    )
+
+    for id_, url, digest in session.execute(query):
+        stored[url].append((id_, digest))
+
+    added, updated = [], []
+    unchanged = 0
+
+    for name, url, tags in links:
+        digest = link_digest(name, tags)
+
+        if len(stored[url]) == 0:
+            added.append((name, url, tags))
+            continue
+
+        id_, stored_digest = stored[url].popleft()
+
+        if digest == stored_digest:
+            unchanged += 1
+            continue
+
+        updated.append((id_, name, tags, digest))
+
+    removed = [id_ for matches in stored.values() for (id_, _) in matches]
+    link_id = tag_association_table.c.link_id
+
+    retagged = removed + [id_ for (id_, *_) in updated]
+    index = db.bitmap_index()
+
+    if index is not None:
+        index.remove(retagged)
+
+    # The tags the links had before, so that they can be recounted.
+    tagged = set()
+
+    for batch in batched(retagged, batch_size):
+        tag_id = tag_association_table.c.tag_id
+        query = select(tag_id).where(link_id.in_(batch)).distinct()
+
+        tagged.update(session.execute(query).scalars())
+        session.execute(tag_association_table.delete().where(link_id.in_(batch)))
+
+    # Ids are reused, so the visits to removed links have to go too.
+    for batch in batched(removed, batch_size):
+        session.execute(Visit.__table__.delete().where(Visit.link_id.in_(batch)))
+        session.execute(Link.__table__.delete().where(Link.id.in_(batch)))
+
+    if len(updated) > 0:
+        tag_ids = db.tag_resolver.resolve(
+            {tag for (_, _, tags, _) in updated for tag in tags}
+        )
+
+        conn = session.connection()
+        conn.exec_driver_sql(
+            "UPDATE links SET name = ?, digest = ? WHERE id = ?",
+            [(name, digest, id_) for (id_, name, _, digest) in updated],
+        )
+
+        associations = {
+            (id_, tag_ids[tag]) for (id_, _, tags, _) in updated for tag in tags
+        }
+        bulk_insert(db, tag_association_table, sorted(associations))
+
+        if index is not None:
+            index.add(associations)
+
+        tagged.update(tag_ids.values())
+
+    if len(retagged) > 0:
+        db.bump_generation(tags=True)
+
+    if index is not None:
+        index.save()
+
+    bulk_import(
+        db,
+        added,
+        source_id=source_id,
+        batch_size=batch_size,
+        commit=False,
+        recount=False,
+    )
+
+    tags = {tag for (_, _, tags) in added for tag in tags}
+    tagged.update(db.tag_resolver.resolve(tags, create=False).values())
+    db.recount(tag_ids=tagged, source_ids=[source_id])
+
+    if commit:
+        db.commit()
+
+    return SyncResult(
+        added=len(added),
+        removed=len(removed),
+        updated=len(updated),
+        unchanged=unchanged,
+    )
@@ -0,0 +1,144 @@
+"""An on disk cache for resources fetched over HTTP.
+
+Responses are stored along with their :code:`ETag` and :code:`Last-Modified` headers
+so that the next time the resource is requested a conditional request can be made,
+allowing the server to reply with :code:`304 Not Modified` instead of sending the
+resource again.
+
+The cache is shared by every database, so a :code:`304` only means that the cached
+copy is current, not that a given database has imported it. Each response has a
+:attr:`~CachedResponse.validator` identifying the version of the resource, which
+importers record alongside the source so that they can tell whether it's the version
+they already have.
+"""
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import appdirs
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+"""The number of bytes to read from a response at a time."""
+
+
+def default_cache_dir():
+    """Return the default location of the cache."""
+
+    base = appdirs.user_data_dir(appname="llyfr", appauthor=False)
+    return pathlib.Path(base, "http-cache")
+
+
+class CachedResponse:
+    """A response stored in the cache."""
+
+    def __init__(self, url, path, modified, validator=None):
+        self.url = url
+        self.path = path
+
+        self.modified = modified
+        """:code:`False` if the resource hasn't changed since it was last fetched."""
+
+        self.validator = validator
+        """The :code:`ETag` of the cached copy, or its :code:`Last-Modified` date if
+        it doesn't have one. :code:`None` if the server sent neither."""
+
+    def open(self):
+        """Open the response body for reading."""
+        return open(self.path, "rb")
+
+
+class HttpCache:
+    """Fetches resources, storing them on disk.
+
+    :param directory: Optional. The directory to store responses in, defaults to
+                      :func:`default_cache_dir`
+    """
+
+    def __init__(self, directory=None):
+
+        if directory is None:
+            directory = default_cache_dir()
+
+        self.directory = pathlib.Path(directory)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return (
+            pathlib.Path(self.directory, f"{key}.body"),
+            pathlib.Path(self.directory, f"{key}.json"),
+        )
+
+    def get(self, url) -> CachedResponse:
+        """Fetch the given url, making a conditional request if it's been cached.
+
+        :param url: The url to fetch
+        :raises urllib.error.URLError: If the resource could not be fetched
+        """
+
+        body, meta = self._paths(url)
+        headers = {}
+        cached = body.exists() and meta.exists()
+
+        if cached:
+            info = json.loads(meta.read_text())
+
+            if info.get("etag"):
+                headers["If-None-Match"] = info["etag"]
+
+            if info.get("last_modified"):
+                headers["If-Modified-Since"] = info["last_modified"]
+
+        try:
+            response = urlopen(Request(url, headers=headers))
+
+        except HTTPError as err:
+
+            if err.code == 304 and cached:
+                logger.debug("Not modified: %s", url)
+                return CachedResponse(
+                    url, body, modified=False, validator=_validator(info)
+                )
+
+            raise
+
+        with response:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+            # Write to a temporary file first so that a failed download doesn't
+            # replace a good copy of the resource.
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    shutil.copyfileobj(response, f, READ_SIZE)
+
+                os.replace(tmp, body)
+
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+            info = {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+
+        meta.write_text(json.dumps(info))
+        logger.debug("Fetched: %s", url)
+
+        return CachedResponse(url, body, modified=True, validator=_validator(info))
+
+
+def _validator(info):
+    """Return the validator of the cached response with the given metadata."""
+    return info.get("etag") or info.get("last_modified")
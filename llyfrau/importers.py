@@ -1,14 +1,149 @@
-import sphobjinv as soi
+import logging
+import queue
+import re
+import threading
+import time
+import zlib
 
-from .data import Database, Link, Source, Tag
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+from sqlalchemy import delete, update
+
+from .data import (
+    BATCH_SIZE,
+    Database,
+    Link,
+    Source,
+    Tag,
+    bulk_import,
+    bulk_insert,
+    sync_links,
+)
+from .fetch import HttpCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS = 4
+"""The default number of uris to import concurrently."""
+
+READ_SIZE = 64 * 1024
+"""The number of bytes to read from an inventory at a time."""
+
+_INVENTORY_ENTRY = re.compile(r"(.+?)\s+(\S+?):(\S+)\s+(-?\d+)\s+?(\S*)\s+(.*)")
+
+
+def read_inventory(stream):
+    """Read a version 2 sphinx inventory from the given binary stream.
+
+    Only the header is read up front, the body is decompressed incrementally as the
+    returned entries are consumed, so there is never more than a few kilobytes of the
+    inventory in memory at once.
+
+    :param stream: The stream to read the inventory from
+    :returns: A tuple :code:`(project, version, entries)` where :code:`entries` is a
+              generator of :code:`(name, domain, role, uri, dispname)` tuples.
+    :raises ValueError: If the stream does not contain a version 2 inventory.
+    """
+
+    header = [stream.readline().decode("utf-8").rstrip() for _ in range(4)]
+
+    if header[0] != "# Sphinx inventory version 2":
+        raise ValueError(f"Unsupported inventory: {header[0]!r}")
+
+    if "zlib" not in header[3]:
+        raise ValueError(f"Unsupported inventory compression: {header[3]!r}")
+
+    project = header[1].replace("# Project: ", "", 1)
+    version = header[2].replace("# Version: ", "", 1)
+
+    return project, version, _read_entries(stream)
+
+
+def _read_entries(stream):
+    """Decompress and parse the body of an inventory, one line at a time."""
+
+    decompressor = zlib.decompressobj()
+    buffer = b""
+
+    while True:
+        data = stream.read(READ_SIZE)
+
+        if data:
+            buffer += decompressor.decompress(data)
+        else:
+            buffer += decompressor.flush()
+
+        *lines, buffer = buffer.split(b"\n")
+
+        for line in lines:
+            entry = _parse_entry(line)
+
+            if entry is not None:
+                yield entry
+
+        if not data:
+            break
+
+    entry = _parse_entry(buffer)
+
+    if entry is not None:
+        yield entry
+
+
+def _parse_entry(line):
+
+    match = _INVENTORY_ENTRY.match(line.decode("utf-8").rstrip())
+
+    if match is None:
+        return None
+
+    name, domain, role, _, uri, dispname = match.groups()
+    return name, domain, role, uri, dispname
+
+
+class Unchanged(Exception):
+    """Raised by an importer to indicate that a source hasn't changed since it was
+    last imported."""
 
 
 class Collection:
-    """A class used for bookeeping."""
+    """A class used for bookeeping.
+
+    By default links are collected as :class:`~llyfrau.data.Link` instances. If
+    :code:`bulk` is :code:`True` they are instead collected as plain
+    :code:`(name, url, tags)` tuples, ready to be passed to
+    :func:`~llyfrau.data.bulk_import`.
 
-    def __init__(self, db, imp_name):
+    When collecting tuples, passing an :code:`on_chunk` callback means links are
+    handed over in chunks of :code:`chunk_size` as they are collected, rather than
+    accumulating every link in memory.
+    """
+
+    def __init__(
+        self,
+        db,
+        imp_name,
+        bulk=False,
+        chunk_size=BATCH_SIZE,
+        on_chunk=None,
+        validator=None,
+        http_cache=None,
+    ):
         self.db = db
         self.imp_name = imp_name
+        self.bulk = bulk
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk
+
+        self.validator = validator
+        """The validator of the resource the source was last imported from, see
+        :class:`~llyfrau.fetch.CachedResponse`. Once the resource has been opened,
+        it's the validator of the version being imported."""
+
+        self.http_cache = http_cache
+        """The :class:`~llyfrau.fetch.HttpCache` to fetch resources with, if any."""
+
         self.source = Source()
         self.links = []
         self.tag_cache = {}
@@ -40,9 +175,13 @@ class Collection:
         if name in self.tag_cache:
             return self.tag_cache[name]
 
-        existing = Tag.get(self.db, name=name)
+        resolver = self.db.tag_resolver
+        resolver.preload()
+
+        tag_id = resolver.resolve([name], create=False).get(name)
 
-        if existing is not None:
+        if tag_id is not None:
+            existing = self.db.session.get(Tag, tag_id)
             self.tag_cache[name] = existing
             return existing
 
@@ -53,19 +192,89 @@ class Collection:
     def add_link(self, name=None, url=None, tags=None):
         """Handles the detail of making links."""
 
-        link = Link(name=name, url=url)
-
         if tags is None:
             tags = []
 
         tags.append(self.imp_name)
 
+        if self.bulk:
+            self.links.append((name, url, tags))
+
+            if len(self.links) >= self.chunk_size:
+                self.flush()
+
+            return
+
+        link = Link(name=name, url=url)
+
         for name in tags:
             tag = self._get_or_create_tag(name)
             link.tags.append(tag)
 
         self.links.append(link)
 
+    def open_url(self, url):
+        """Open the given url for reading, using the http cache if available.
+
+        :raises Unchanged: If the server reports that the url hasn't been modified
+                           since this version of it was last imported.
+        """
+
+        if self.http_cache is None:
+            return urlopen(url)
+
+        response = self.http_cache.get(url)
+
+        # The cache is shared with other databases, so its copy isn't necessarily the
+        # version this database last imported.
+        if not response.modified and response.validator == self.validator:
+            raise Unchanged(url)
+
+        self.validator = response.validator
+        return response.open()
+
+    def flush(self):
+        """Hand any links collected so far over to the :code:`on_chunk` callback."""
+
+        if self.on_chunk is None or len(self.links) == 0:
+            return
+
+        self.on_chunk(self, self.links)
+        self.links = []
+
+
+class ImportTask:
+    """Tracks the progress of importing links from a single uri."""
+
+    def __init__(self, uri, source_uri, existing=None):
+        self.uri = uri
+        self.source_uri = source_uri
+        self.existing = existing
+        self.source_id = None if existing is None else existing.id
+        self.validator = None if existing is None else existing.validator
+        self.collection = None
+        self.count = 0
+
+        # The tags of the links written so far, to be counted once they all have.
+        self.tags = set()
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def read_uris(filepath):
+    """Read a list of uris from a file, one per line.
+
+    Blank lines and lines starting with :code:`#` are ignored.
+    """
+
+    with open(filepath) as f:
+        lines = [line.strip() for line in f]
+
+    return [line for line in lines if line and not line.startswith("#")]
+
 
 def define_importer(import_):
     """Function that handles the details of importing a list of links.
@@ -73,32 +282,220 @@ def define_importer(import_):
     The idea is that this function calls :code:`f` with the reference given on the
     command line to get the list of links to import. It then handles the details of
     updating the database with these links.
+
+    If the source has been imported before, its existing links are updated in place
+    (see :func:`~llyfrau.data.sync_links`) rather than being imported a second time.
+
+    When given multiple uris, :code:`f` is called for each of them concurrently from a
+    pool of worker threads, while the calling thread is the only one that writes to
+    the database. A failure to import one uri does not prevent the others from being
+    imported.
+
+    Unless another :code:`db_profile` is given, the database is opened using the
+    :code:`bulk-import` profile.
+
+    If :code:`cache` is :code:`True` (or an :class:`~llyfrau.fetch.HttpCache`),
+    importers fetch resources through the cache. Sources the server reports as not
+    modified since they were last imported into this database are skipped entirely.
     """
 
     # This outer function needs to handle the args given on the command line.
-    def link_importer(filepath, uri):
+    def link_importer(
+        filepath,
+        uri,
+        input_file=None,
+        jobs=None,
+        cache=False,
+        db_profile=None,
+        profile=False,
+    ):
+
+        uris = [uri] if isinstance(uri, str) else list(uri or [])
+
+        if input_file is not None:
+            uris.extend(read_uris(input_file))
+
+        # Importing a uri twice would create two sources for it.
+        uris = list(dict.fromkeys(uris))
+
+        if cache is True:
+            cache = HttpCache()
+
+        http_cache = cache or None
+        jobs = DEFAULT_JOBS if jobs is None else jobs
+
+        db = Database(
+            filepath,
+            create=True,
+            db_profile=db_profile or "bulk-import",
+            profile=profile,
+        )
+        tasks = []
+
+        for ref in uris:
+            source_uri = f"{import_.__name__}://{ref}"
+            existing = db.session.query(Source).filter(Source.uri == source_uri).first()
+            tasks.append(ImportTask(ref, source_uri, existing))
+
+        results = queue.Queue(maxsize=2 * max(jobs, 1))
+        stop = threading.Event()
+
+        def send(message):
+
+            # Don't block forever if the writer has given up.
+            while not stop.is_set():
+                try:
+                    results.put(message, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+            raise RuntimeError("Import cancelled")
+
+        def fetch(task):
+
+            def send_chunk(collection, links):
+                send(("chunk", task, links))
+
+            # Links for existing sources have to be collected in full before they
+            # can be compared against what's in the database.
+            on_chunk = None if task.existing is not None else send_chunk
+            task.collection = Collection(
+                None,
+                import_.__name__,
+                bulk=True,
+                chunk_size=BATCH_SIZE,
+                on_chunk=on_chunk,
+                validator=task.validator,
+                http_cache=http_cache,
+            )
+
+            try:
+                import_(task.uri, task.collection)
+                task.collection.flush()
+                send(("done", task, None))
+            except Unchanged:
+                send(("unchanged", task, None))
+            except Exception as err:
+                if not stop.is_set():
+                    send(("failed", task, err))
+
+        failures = 0
+        remaining = len(tasks)
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+
+            for task in tasks:
+                pool.submit(fetch, task)
+
+            try:
+                while remaining > 0:
+                    status, task, payload = results.get()
+
+                    if status == "chunk":
+                        _write_chunk(db, task, payload)
+                        continue
+
+                    remaining -= 1
+
+                    if status == "failed":
+                        failures += 1
+                        logger.error("[failed] %s: %s", task.uri, payload)
+                        _discard(db, task)
+                        continue
+
+                    if status == "unchanged":
+                        logger.info("[unchanged] %s: skipped", task.uri)
+                        continue
+
+                    _finish(db, task)
+
+            finally:
+                stop.set()
+
+        db.close()
+        return 1 if failures > 0 else 0
+
+    return link_importer
+
+
+def _add_source(db, task):
+    collection = task.collection
+    row = (collection.name, collection.prefix, task.source_uri)
+    columns = ["name", "prefix", "uri"]
+    (task.source_id,) = bulk_insert(db, Source.__table__, [row], columns=columns)
+    db.bump_generation()
 
-        db = Database(filepath, create=True)
-        collection = Collection(db, import_.__name__)
 
-        import_(uri, collection)
+def _write_chunk(db, task, links):
+    """Write a chunk of links for a newly imported source."""
 
-        source = collection.source
-        source.uri = f"{import_.__name__}://{uri}"
+    if task.source_id is None:
+        _add_source(db, task)
 
-        for l in collection.links:
-            source.links.append(l)
+    bulk_import(db, links, source_id=task.source_id, recount=False)
+    task.count += len(links)
+    task.tags.update(tag for (_, _, tags) in links for tag in tags)
 
-        Source.add(db, items=[source], commit=False)
-        Link.add(db, items=collection.links, commit=False)
+    logger.info("[%s] %d links written", task.uri, task.count)
 
-        if len(collection.tags) > 0:
-            Tag.add(db, items=list(collection.tags.values()), commit=False)
 
+def _discard(db, task):
+    """Remove any links written for a newly imported source that failed, so that
+    the next import of it starts again from scratch."""
+
+    if task.existing is not None or task.source_id is None:
+        return
+
+    sync_links(db, task.source_id, [], commit=False)
+    db.session.execute(delete(Source).where(Source.id == task.source_id))
+    db.commit()
+
+    logger.debug("[%s] %d links discarded", task.uri, task.count)
+    task.source_id = None
+    task.count = 0
+
+
+def _finish(db, task):
+    """Write any remaining links for the given task, and report on it."""
+
+    if task.existing is None:
+
+        if task.source_id is None:
+            _add_source(db, task)
+
+        tag_ids = db.tag_resolver.resolve(task.tags, create=False)
+        db.recount(tag_ids=list(tag_ids.values()), source_ids=[task.source_id])
+
+        # Only record the version that was imported once all of its links have been
+        # written, so that an import that fails part way through isn't skipped.
+        db.session.execute(
+            update(Source)
+            .where(Source.id == task.source_id)
+            .values(validator=task.collection.validator)
+        )
         db.commit()
-        db.close()
 
-    return link_importer
+        logger.info(
+            "[done] %s: %d links imported in %.1fs", task.uri, task.count, task.elapsed
+        )
+        return
+
+    existing = task.existing
+    existing.name = task.collection.name
+    existing.prefix = task.collection.prefix
+    existing.validator = task.collection.validator
+
+    result = sync_links(db, existing.id, task.collection.links)
+    logger.info(
+        "[done] %s: %d added, %d removed, %d updated, %d unchanged in %.1fs",
+        task.uri,
+        result.added,
+        result.removed,
+        result.updated,
+        result.unchanged,
+        task.elapsed,
+    )
 
 
 def importer(f=None):
@@ -120,9 +517,47 @@ def sphinx(uri: str, collection: Collection):
     if not uri.endswith("objects.inv"):
         uri = f"{uri}/objects.inv"
 
-    print(f"Trying index url  : {uri}", end="\r")
+    logger.debug("Trying index url: %s", uri)
+
+    with collection.open_url(uri) as response:
+
+        try:
+            project, version, entries = read_inventory(response)
+        except ValueError as err:
+            logger.debug("Falling back to sphobjinv: %s", err)
+            entries = None
+
+        if entries is None:
+            return _sphinx_fallback(uri, collection)
+
+        logger.debug("Found object index: %s", uri)
+
+        collection.name = f"{project} v{version} Documentation"
+        collection.prefix = uri.replace("objects.inv", "")
+        count = 0
+
+        for name, domain, role, location, dispname in entries:
+
+            if location.endswith("$"):
+                location = location[:-1] + name
+
+            if dispname == "-":
+                dispname = name
+
+            collection.add_link(name=dispname, url=location, tags=[domain, role])
+            count += 1
+
+    logger.debug("Read %d entries from: %s", count, uri)
+
+
+def _sphinx_fallback(uri: str, collection: Collection):
+    """Import links from inventories :func:`read_inventory` doesn't understand."""
+
+    # Only needed for the less common inventory formats.
+    import sphobjinv as soi
+
     inv = soi.Inventory(url=uri)
-    print(f"Found object index: {uri} with {inv.count} entries")
+    logger.debug("Found object index: %s with %d entries", uri, inv.count)
 
     collection.name = f"{inv.project} v{inv.version} Documentation"
     collection.prefix = uri.replace("objects.inv", "")
@@ -0,0 +1,453 @@
+"""Versioned schema migrations.
+
+The schema version of a database is tracked using SQLite's :code:`user_version`
+pragma. Each migration registered with the :func:`migration` decorator corresponds
+to a version number (its position in :data:`MIGRATIONS`) and is applied at most
+once, the first time the database is opened by a version of llyfrau that knows about
+it.
+
+Migrations must be safe to run against a database that was created by the current
+models, since newly created databases start at version :code:`0` and have every
+migration applied to them.
+"""
+import logging
+import math
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from . import bitmaps, stats
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+"""The list of known migrations, in the order they should be applied."""
+
+
+def migration(f):
+    """Decorator for defining migrations."""
+
+    MIGRATIONS.append(f)
+    return f
+
+
+def has_table(conn, name):
+    """Determine if a table with the given name exists."""
+
+    query = text("SELECT 1 FROM sqlite_master WHERE name = :name")
+    return conn.execute(query, {"name": name}).first() is not None
+
+
+def get_version(conn):
+    """Return the schema version of the database."""
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def get_generation(conn):
+    """Return the generation of the database.
+
+    The generation is a counter that is incremented by each transaction that adds,
+    changes or removes links, tags or sources, in any process (see
+    :func:`bump_generation`). Changes to the tags of links are counted separately as
+    the :code:`tag_generation` (see :mod:`llyfrau.bitmaps`), the generation includes
+    both.
+    """
+
+    query = text(
+        "SELECT sum(value) FROM meta WHERE key IN ('generation', 'tag_generation')"
+    )
+    return conn.execute(query).scalar()
+
+
+def bump_generation(conn, tags=False):
+    """Increment the generation, see :func:`get_generation`.
+
+    :param conn: The connection making the changes, the generation is only bumped if
+                 its transaction is committed.
+    :param tags: Optional. If :code:`True` the changes include the tags of links, so
+                 the :code:`tag_generation` is incremented instead.
+    """
+
+    key = "tag_generation" if tags else "generation"
+    query = text("UPDATE meta SET value = value + 1 WHERE key = :key")
+    conn.execute(query, {"key": key})
+
+
+def migrate(engine):
+    """Bring the database up to date, returning the resulting schema version.
+
+    Databases that don't have a :code:`links` table yet are left untouched.
+    """
+
+    latest = len(MIGRATIONS)
+
+    with engine.begin() as conn:
+
+        if not has_table(conn, "links"):
+            return get_version(conn)
+
+        if get_version(conn) >= latest and not _full_text_index_missing(conn):
+            return get_version(conn)
+
+        # Take the write lock before checking the version again, in case another
+        # process is migrating the database at the same time.
+        conn.execute(text("BEGIN IMMEDIATE"))
+        version = get_version(conn)
+
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.debug("Applying migration %d: %s", number, migration.__name__)
+
+            migration(conn)
+            conn.execute(text(f"PRAGMA user_version = {number}"))
+
+        if _full_text_index_missing(conn):
+
+            # Retry it, unless the migration above has only just been skipped.
+            if full_text_index not in MIGRATIONS[version:]:
+                full_text_index(conn)
+
+            if not has_table(conn, "links_fts"):
+                _skip_full_text_index(conn)
+
+    return max(version, latest)
+
+
+def _full_text_index_missing(conn):
+    """Determine if the full text index is missing, and hasn't already been found to
+    be unavailable with the version of SQLite in use.
+
+    :func:`full_text_index` is skipped if SQLite wasn't built with fts5 or is too old
+    for the trigram tokenizer, so it's tried again once SQLite is upgraded.
+    """
+
+    query = text(
+        """
+        SELECT NOT EXISTS (SELECT 1 FROM sqlite_master WHERE name = 'links_fts')
+           AND (
+                SELECT value FROM meta WHERE key = 'full_text_index_skipped'
+           ) IS NOT sqlite_version()
+        """
+    )
+    return bool(conn.execute(query).scalar())
+
+
+def _skip_full_text_index(conn):
+    """Record that the full text index is unavailable, see
+    :func:`_full_text_index_missing`."""
+
+    conn.execute(
+        text(
+            "INSERT OR REPLACE INTO meta (key, value) "
+            "VALUES ('full_text_index_skipped', sqlite_version())"
+        )
+    )
+
+
+@migration
+def full_text_index(conn):
+    """Create and backfill the full text index over link names and urls.
+
+    Skipped if SQLite doesn't support it, in which case it's retried by :func:`migrate`
+    once it does.
+    """
+
+    if has_table(conn, "links_fts"):
+        return
+
+    try:
+        conn.execute(
+            text(
+                """
+                CREATE VIRTUAL TABLE links_fts USING fts5(
+                    name, url, content='links', content_rowid='id', tokenize='trigram'
+                )
+                """
+            )
+        )
+    except OperationalError as err:
+        logger.warning("Unable to create full text index: %s", err)
+        return
+
+    conn.execute(
+        text(
+            """
+            CREATE TRIGGER links_fts_insert AFTER INSERT ON links BEGIN
+                INSERT INTO links_fts(rowid, name, url)
+                VALUES (new.id, new.name, new.url);
+            END
+            """
+        )
+    )
+    conn.execute(
+        text(
+            """
+            CREATE TRIGGER links_fts_delete AFTER DELETE ON links BEGIN
+                INSERT INTO links_fts(links_fts, rowid, name, url)
+                VALUES ('delete', old.id, old.name, old.url);
+            END
+            """
+        )
+    )
+    conn.execute(
+        text(
+            """
+            CREATE TRIGGER links_fts_update AFTER UPDATE OF name, url ON links BEGIN
+                INSERT INTO links_fts(links_fts, rowid, name, url)
+                VALUES ('delete', old.id, old.name, old.url);
+                INSERT INTO links_fts(rowid, name, url)
+                VALUES (new.id, new.name, new.url);
+            END
+            """
+        )
+    )
+    conn.execute(text("INSERT INTO links_fts(links_fts) VALUES ('rebuild')"))
+
+
+@migration
+def tag_associations_primary_key(conn):
+    """Rebuild the tag associations as a :code:`WITHOUT ROWID` table keyed on
+    :code:`(link_id, tag_id)`, dropping any duplicate rows."""
+
+    query = text("SELECT sql FROM sqlite_master WHERE name = 'tag_associations'")
+    schema = conn.execute(query).scalar()
+
+    if schema is None or "WITHOUT ROWID" in schema.upper():
+        return
+
+    conn.execute(
+        text(
+            """
+            CREATE TABLE tag_associations_new (
+                link_id INTEGER NOT NULL REFERENCES links (id),
+                tag_id INTEGER NOT NULL REFERENCES tags (id),
+                PRIMARY KEY (link_id, tag_id)
+            ) WITHOUT ROWID
+            """
+        )
+    )
+    conn.execute(
+        text(
+            """
+            INSERT OR IGNORE INTO tag_associations_new (link_id, tag_id)
+            SELECT link_id, tag_id FROM tag_associations
+            WHERE link_id IS NOT NULL AND tag_id IS NOT NULL
+            """
+        )
+    )
+    conn.execute(text("DROP TABLE tag_associations"))
+    conn.execute(text("ALTER TABLE tag_associations_new RENAME TO tag_associations"))
+
+
+@migration
+def search_indexes(conn):
+    """Add the indexes used when sorting and filtering search results."""
+
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_links_visits ON links (visits DESC)")
+    )
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_links_source_id ON links (source_id)")
+    )
+
+    if has_table(conn, "tag_associations"):
+        conn.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_tag_associations_tag_id "
+                "ON tag_associations (tag_id)"
+            )
+        )
+
+
+@migration
+def link_digests(conn):
+    """Add the column used to detect changes to imported links."""
+
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(links)"))}
+
+    if "digest" not in columns:
+        conn.execute(text("ALTER TABLE links ADD COLUMN digest TEXT"))
+
+
+@migration
+def frecency(conn):
+    """Add the visit log and frecency scores.
+
+    Existing visit counts are carried over as if the visits all happened now.
+    """
+
+    # Imported here, since the data module depends on this one.
+    from .data import FRECENCY_DECAY
+
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(links)"))}
+
+    if "frecency" not in columns:
+        conn.execute(
+            text("ALTER TABLE links ADD COLUMN frecency FLOAT NOT NULL DEFAULT 0")
+        )
+
+    conn.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_links_frecency ON links (frecency DESC)")
+    )
+
+    if has_table(conn, "visit_log"):
+        return
+
+    conn.execute(
+        text(
+            """
+            CREATE TABLE visit_log (
+                id INTEGER NOT NULL PRIMARY KEY,
+                link_id INTEGER NOT NULL REFERENCES links (id),
+                visited_at FLOAT NOT NULL
+            )
+            """
+        )
+    )
+    conn.execute(
+        text("CREATE INDEX ix_visit_log_link_id ON visit_log (link_id, visited_at)")
+    )
+
+    now = time.time()
+    visited = conn.execute(
+        text("SELECT id, visits FROM links WHERE visits > 0")
+    ).fetchall()
+
+    if len(visited) == 0:
+        return
+
+    conn.execute(
+        text("INSERT INTO visit_log (link_id, visited_at) VALUES (:link_id, :now)"),
+        [
+            {"link_id": link_id, "now": now}
+            for link_id, visits in visited
+            for _ in range(visits)
+        ],
+    )
+    conn.execute(
+        text("UPDATE links SET frecency = :frecency WHERE id = :id"),
+        [
+            {"id": link_id, "frecency": FRECENCY_DECAY * now + math.log(visits)}
+            for link_id, visits in visited
+        ],
+    )
+
+
+@migration
+def generation(conn):
+    """Add the generation counter, used to tell when cached results are stale."""
+
+    conn.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT NOT NULL PRIMARY KEY,
+                value
+            ) WITHOUT ROWID
+            """
+        )
+    )
+    conn.execute(
+        text("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+    )
+
+    for table in ["links", "tags", "sources", "tag_associations"]:
+        for operation in ["insert", "update", "delete"]:
+            conn.execute(
+                text(
+                    f"""
+                    CREATE TRIGGER IF NOT EXISTS {table}_generation_{operation}
+                    AFTER {operation.upper()} ON {table} BEGIN
+                        UPDATE meta SET value = value + 1 WHERE key = 'generation';
+                    END
+                    """
+                )
+            )
+
+
+@migration
+def tag_bitmaps(conn):
+    """Add the bitmap index over the links with the most common tags, see
+    :mod:`llyfrau.bitmaps`."""
+
+    conn.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS tag_bitmaps (
+                tag_id INTEGER NOT NULL PRIMARY KEY REFERENCES tags (id),
+                links INTEGER NOT NULL,
+                bitmap BLOB NOT NULL
+            )
+            """
+        )
+    )
+    conn.execute(
+        text(
+            "INSERT OR IGNORE INTO meta (key, value) "
+            "VALUES ('tag_generation', 0), ('tag_bitmaps', 0)"
+        )
+    )
+
+    # Count changes to the tags of links separately, so that the index isn't
+    # invalidated each time a link is visited. They still count towards the
+    # generation, see get_generation.
+    for operation in ["insert", "update", "delete"]:
+        trigger = f"tag_associations_generation_{operation}"
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        conn.execute(
+            text(
+                f"""
+                CREATE TRIGGER {trigger}
+                AFTER {operation.upper()} ON tag_associations BEGIN
+                    UPDATE meta SET value = value + 1 WHERE key = 'tag_generation';
+                END
+                """
+            )
+        )
+
+    bitmaps.rebuild(conn)
+
+
+@migration
+def link_counts(conn):
+    """Add the statistics used to plan queries, see :mod:`llyfrau.stats`."""
+
+    conn.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS link_counts (
+                kind TEXT NOT NULL,
+                item_id INTEGER NOT NULL,
+                links INTEGER NOT NULL,
+                PRIMARY KEY (kind, item_id)
+            ) WITHOUT ROWID
+            """
+        )
+    )
+
+    stats.update(conn, "tag")
+    stats.update(conn, "source")
+
+
+@migration
+def source_validators(conn):
+    """Add the column recording the version of each source that was imported, see
+    :mod:`llyfrau.fetch`."""
+
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(sources)"))}
+
+    if "validator" not in columns:
+        conn.execute(text("ALTER TABLE sources ADD COLUMN validator TEXT"))
+
+
+@migration
+def generation_per_transaction(conn):
+    """Drop the triggers counting the generation.
+
+    They bumped it for every row written, which slowed down bulk imports. Writes
+    now bump it once per transaction instead, see :func:`bump_generation`.
+    """
+
+    for table in ["links", "tags", "sources", "tag_associations"]:
+        for operation in ["insert", "update", "delete"]:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {table}_generation_{operation}"))
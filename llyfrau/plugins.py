@@ -0,0 +1,117 @@
+"""Discovering plugins through entry points, without paying for it on every run.
+
+Scanning the installed distributions for entry points means reading the metadata of
+every package in the environment. Instead, the entry points found are stored in an
+index on disk, along with a fingerprint of the directories on :code:`sys.path`.
+Installing or removing a package changes the modification time of the directory it
+was installed into, which invalidates the index.
+
+Entry points are only loaded when they are used, see :meth:`Plugin.load`.
+"""
+import collections
+import json
+import logging
+import os
+import pathlib
+import sys
+
+import appdirs
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+"""Bumped whenever the format of the index changes."""
+
+
+def _metadata():
+    # importlib.metadata takes a noticeable amount of time to import, so it's only
+    # imported when it's needed.
+    try:
+        from importlib import metadata
+    except ImportError:  # pragma: no cover
+        import importlib_metadata as metadata
+
+    return metadata
+
+
+class Plugin(collections.namedtuple("Plugin", "name,value,group")):
+    """An entry point that has been found, but not yet loaded."""
+
+    def load(self):
+        """Import the object the entry point refers to."""
+
+        entry_point = _metadata().EntryPoint(self.name, self.value, self.group)
+        return entry_point.load()
+
+
+def default_index_path():
+    """Return the default location of the entry point index."""
+
+    base = appdirs.user_cache_dir(appname="llyfr", appauthor=False)
+    return pathlib.Path(base, "entry-points.json")
+
+
+def _fingerprint(paths):
+    """Summarise the given import paths, so that changes to them can be detected."""
+
+    fingerprint = []
+
+    for path in paths:
+        try:
+            mtime = os.stat(path or ".").st_mtime_ns
+        except OSError:
+            mtime = None
+
+        fingerprint.append([path, mtime])
+
+    return fingerprint
+
+
+def _scan(group):
+    """Find the entry points in the given group by reading package metadata."""
+
+    eps = _metadata().entry_points()
+
+    if hasattr(eps, "select"):
+        found = eps.select(group=group)
+    else:  # pragma: no cover
+        found = eps.get(group, [])
+
+    return {ep.name: ep.value for ep in found}
+
+
+def entry_points(group, index_path=None):
+    """Return the entry points in the given group, keyed by name.
+
+    :param group: The entry point group to look up
+    :param index_path: Optional. Where to store the index, defaults to
+                       :func:`default_index_path`
+    """
+
+    if index_path is None:
+        index_path = default_index_path()
+
+    index_path = pathlib.Path(index_path)
+    fingerprint = _fingerprint(sys.path)
+
+    try:
+        index = json.loads(index_path.read_text())
+    except (OSError, ValueError):
+        index = {}
+
+    if index.get("version") != INDEX_VERSION or index.get("fingerprint") != fingerprint:
+        index = {"version": INDEX_VERSION, "fingerprint": fingerprint, "groups": {}}
+
+    groups = index["groups"]
+
+    if group not in groups:
+        logger.debug("Scanning for entry points in group: %s", group)
+        groups[group] = _scan(group)
+
+        try:
+            index_path.parent.mkdir(parents=True, exist_ok=True)
+            index_path.write_text(json.dumps(index))
+        except OSError as err:
+            logger.debug("Unable to write entry point index: %s", err)
+
+    return {name: Plugin(name, value, group) for name, value in groups[group].items()}
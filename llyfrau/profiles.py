@@ -0,0 +1,63 @@
+"""Performance profiles for the database.
+
+These live in their own module so that the cli can offer them as choices without
+importing :mod:`sqlalchemy`.
+"""
+import collections
+
+Profile = collections.namedtuple("Profile", "pragmas,params")
+"""A set of :code:`PRAGMA` statements to run on each new connection to the database,
+along with any parameters to add to the URI used to open it."""
+
+MB = 1024 * 1024
+
+PROFILES = {
+    "interactive": Profile(
+        pragmas={
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -16 * 1024,
+            "mmap_size": 256 * MB,
+            "temp_store": "MEMORY",
+        },
+        params={},
+    ),
+    "bulk-import": Profile(
+        pragmas={
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "cache_size": -256 * 1024,
+            "mmap_size": 256 * MB,
+            "temp_store": "MEMORY",
+        },
+        params={},
+    ),
+    "read-only": Profile(
+        pragmas={
+            "query_only": "ON",
+            "cache_size": -16 * 1024,
+            "mmap_size": 256 * MB,
+            "temp_store": "MEMORY",
+        },
+        params={"mode": "ro"},
+    ),
+    "immutable": Profile(
+        pragmas={
+            "query_only": "ON",
+            "cache_size": -16 * 1024,
+            "mmap_size": 256 * MB,
+            "temp_store": "MEMORY",
+        },
+        params={"immutable": "1"},
+    ),
+}
+"""Performance profiles that can be used when opening a database.
+
+- :code:`interactive`: WAL mode with relaxed syncing, for the cli and TUI.
+- :code:`bulk-import`: Doesn't wait for writes to reach the disk and uses a much
+  larger page cache. An OS crash during an import may lose or corrupt data.
+- :code:`read-only`: Opens the database in read only mode.
+- :code:`immutable`: Opens the database in read only mode, assuming that nothing else
+  will modify it while it's open. Only suitable for databases that never change,
+  such as backups.
+"""
@@ -0,0 +1,218 @@
+"""Profiling the queries sent to the database.
+
+A :class:`QueryProfiler` hooks into the events emitted by a sqlalchemy engine to
+record how many times each statement is executed, how long it takes and how many rows
+it returns.
+
+It also looks for statements that are executed over and over again within a single
+operation, i.e. while a connection is checked out of the pool. This is usually the
+sign of an N+1 query, such as lazily loading the tags of each link in a list of
+results one link at a time.
+"""
+import collections
+import json
+import re
+import threading
+import time
+
+REPEAT_THRESHOLD = 5
+"""The number of times a statement can be executed in one operation before it's
+flagged as repeated."""
+
+REPORT_SIZE = 20
+"""The number of statements included in the summary report."""
+
+StatementStats = collections.namedtuple("StatementStats", "statement,calls,time,rows")
+"""The totals recorded for a single statement."""
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(statement):
+    """Collapse the whitespace in the given statement onto a single line."""
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+class _CountingCursor:
+    """Wraps a DBAPI cursor, counting the rows fetched through it."""
+
+    def __init__(self, cursor, on_rows):
+        self._cursor = cursor
+        self._on_rows = on_rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+
+        if row is not None:
+            self._on_rows(1)
+
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._on_rows(len(rows))
+
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._on_rows(len(rows))
+
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class QueryProfiler:
+    """Records statistics on the statements executed against one or more engines.
+
+    :param repeat_threshold: Optional. The number of times a statement can be executed
+                             within one operation before it's flagged as repeated.
+    """
+
+    def __init__(self, repeat_threshold=REPEAT_THRESHOLD):
+        self.repeat_threshold = repeat_threshold
+
+        self.stats = {}
+        """The totals for each statement, keyed by the statement."""
+
+        self.repeated = {}
+        """The most times each repeated statement was executed in one operation."""
+
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        """Start profiling the statements executed by the given engine."""
+
+        from sqlalchemy import event
+
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self._operations[id(dbapi_connection)] = collections.Counter()
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        counts = self._operations.pop(id(dbapi_connection), None)
+
+        if counts is None:
+            return
+
+        with self._lock:
+            for statement, count in counts.items():
+
+                if count < self.repeat_threshold:
+                    continue
+
+                previous = self.repeated.get(statement, 0)
+                self.repeated[statement] = max(previous, count)
+
+    def _before_execute(self, conn, cursor, statement, params, context, executemany):
+        conn.info.setdefault("profiler_start", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, params, context, executemany):
+        elapsed = time.perf_counter() - conn.info["profiler_start"].pop()
+        statement = normalize(statement)
+
+        # Only count the rows of a query as they are fetched.
+        rows = 0
+
+        if cursor.description is None:
+            rows = max(cursor.rowcount, 0)
+        elif context is not None:
+            context.cursor = _CountingCursor(
+                cursor, lambda n: self._record(statement, rows=n)
+            )
+
+        self._record(statement, calls=1, elapsed=elapsed, rows=rows)
+
+        # Executing a statement many times in one go is the alternative to an N+1
+        # query, not an example of one.
+        counts = self._operations.get(id(conn.connection.dbapi_connection))
+
+        if counts is not None and not executemany:
+            counts[statement] += 1
+
+    def _record(self, statement, calls=0, elapsed=0.0, rows=0):
+
+        with self._lock:
+            stats = self.stats.get(statement, StatementStats(statement, 0, 0.0, 0))
+            self.stats[statement] = StatementStats(
+                statement, stats.calls + calls, stats.time + elapsed, stats.rows + rows
+            )
+
+    def reset(self):
+        """Discard everything recorded so far."""
+
+        with self._lock:
+            self.stats.clear()
+            self.repeated.clear()
+
+    def report(self, top=REPORT_SIZE, width=100):
+        """Return a summary of the statements executed, slowest first.
+
+        :param top: Optional. The number of statements to include
+        :param width: Optional. The number of characters to truncate statements to
+        """
+
+        with self._lock:
+            stats = sorted(self.stats.values(), key=lambda s: s.time, reverse=True)
+            repeated = sorted(self.repeated.items(), key=lambda r: r[1], reverse=True)
+
+        calls = sum(s.calls for s in stats)
+        total = sum(s.time for s in stats)
+
+        lines = [
+            f"Executed {calls} statements ({len(stats)} unique) "
+            f"in {total * 1000:.2f}ms",
+            "",
+            f"{'Calls':>7} {'Total (ms)':>11} {'Mean (ms)':>10} {'Rows':>8}  Statement",
+        ]
+
+        for s in stats[:top]:
+            lines.append(
+                f"{s.calls:>7} {s.time * 1000:>11.2f} {s.time * 1000 / s.calls:>10.3f} "
+                f"{s.rows:>8}  {s.statement[:width]}"
+            )
+
+        if len(repeated) > 0:
+            lines.extend(["", "Repeated statements, possible N+1 queries:"])
+
+        for statement, count in repeated:
+            lines.append(f"{count:>7}x in one operation: {statement[:width]}")
+
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """Write everything recorded so far to the given path as JSON."""
+
+        with self._lock:
+            data = {
+                "statements": [s._asdict() for s in self.stats.values()],
+                "repeated": [
+                    {"statement": statement, "count": count}
+                    for statement, count in self.repeated.items()
+                ],
+            }
+
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+
+_default = None
+
+
+def default_profiler():
+    """Return the profiler shared by every database opened with
+    :code:`profile=True`."""
+
+    global _default
+
+    if _default is None:
+        _default = QueryProfiler()
+
+    return _default
@@ -0,0 +1,381 @@
+"""The query language used to search for links.
+
+A query is made up of terms separated by spaces, a link has to match every term to
+be returned.
+
+=================== ===========================================================
+Term                Matches links
+=================== ===========================================================
+:code:`word`        whose name contains :code:`word`
+:code:`"a phrase"`  whose name contains :code:`a phrase`
+:code:`#tag`        tagged with :code:`tag`
+:code:`source:text` from a source whose name contains :code:`text`
+:code:`url:text`    whose url contains :code:`text`
+:code:`visits:>5`   visited more than 5 times, also :code:`>=`, :code:`<`,
+                    :code:`<=` and :code:`=`. Just a number means :code:`=`.
+=================== ===========================================================
+
+Any term can be negated by starting it with a :code:`-`, e.g. :code:`-#deprecated`
+and values can be quoted, e.g. :code:`source:"Python Docs"`. Matching is case
+insensitive.
+
+Compiling queries
+-----------------
+
+:func:`compile_query` turns the terms into the filters of a single statement. How
+quickly that statement runs depends on which filter SQLite uses to find the links,
+and which it checks each link against afterwards. SQLite has no statistics of its
+own to go on, so each filter estimates how many links it matches, using
+
+- the number of links with each tag, exactly from the bitmap index (see
+  :mod:`llyfrau.bitmaps`) or from the counts in :mod:`llyfrau.stats`.
+- the number of links from each source, see :mod:`llyfrau.stats`.
+- for everything else, counting the matches up to the point where it's clear the
+  filter isn't selective enough to be worth using.
+
+If the most selective filter matches few enough links, it's used to find them and
+the rest are only checked. Otherwise none of the filters are used to find links, so
+they're read in the order they're sorted by, stopping as soon as there are enough
+results.
+"""
+import collections
+import json
+import operator
+import re
+
+from sqlalchemy import and_, exists, false, func, literal_column, or_, select
+
+from .bitmaps import SCAN_RATIO, bitmap_size, cardinality, evaluate, register, to_ids
+from .data import FTS_MIN_LENGTH, Link, Source, Tag, links_fts, tag_association_table
+from .stats import counts
+
+Term = collections.namedtuple("Term", "kind,value,negated")
+"""A single term in a query.
+
+:code:`kind` is one of :code:`"name"`, :code:`"tag"`, :code:`"source"`,
+:code:`"url"` or :code:`"visits"`. The :code:`value` of a :code:`"visits"` term is
+an :code:`(operator, count)` pair, for the others it's the text to match.
+"""
+
+Predicate = collections.namedtuple("Predicate", "estimate,driving,checking")
+"""A filter as two equivalent expressions, see :func:`compile_query`.
+
+:code:`driving` can be used to look up the links that match, :code:`checking` can
+only be used to check each link in turn. :code:`estimate` is roughly the number of
+links that match.
+"""
+
+FIELD = re.compile(r"(source|url|visits):")
+
+VISITS = re.compile(r"(>=|<=|>|<|=)?(\d+)$")
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+}
+
+
+def parse(text):
+    """Split the given query into a list of :class:`Term` objects."""
+
+    terms = []
+    pos = 0
+    text = text or ""
+
+    while pos < len(text):
+
+        if text[pos].isspace():
+            pos += 1
+            continue
+
+        negated = text[pos] == "-" and pos + 1 < len(text)
+        negated = negated and not text[pos + 1].isspace()
+        pos += negated
+
+        kind, raw = "name", pos
+
+        if text[pos] == "#":
+            kind, pos = "tag", pos + 1
+
+        elif FIELD.match(text, pos):
+            match = FIELD.match(text, pos)
+            kind, pos = match.group(1), match.end()
+
+        value, pos = _read_value(text, pos)
+
+        if kind == "visits":
+            match = VISITS.match(value)
+
+            if match is None:
+                kind, value = "name", text[raw:pos]
+            else:
+                value = (match.group(1) or "=", int(match.group(2)))
+
+        if value:
+            terms.append(Term(kind, value, negated))
+
+    return terms
+
+
+def _read_value(text, pos):
+    """Read the value starting at :code:`pos`, returning it along with the position
+    just after it.
+
+    Values end at the next space, unless they're quoted in which case they end at
+    the closing quote, or the end of the text if there isn't one.
+    """
+
+    if pos < len(text) and text[pos] == '"':
+        end = text.find('"', pos + 1)
+        end = len(text) if end < 0 else end
+
+        return text[pos + 1 : end], end + 1
+
+    end = pos
+
+    while end < len(text) and not text[end].isspace():
+        end += 1
+
+    return text[pos:end], end
+
+
+def simple_search(terms):
+    """Return the arguments to search for the given terms with, if they could be
+    searched for without the query language.
+
+    That's the case when there's at most one name to match and otherwise the terms
+    only include or exclude tags. Returns :code:`None` if not.
+    """
+
+    names = [t.value for t in terms if t.kind == "name"]
+    tags = [t.value for t in terms if t.kind == "tag" and not t.negated]
+    exclude_tags = [t.value for t in terms if t.kind == "tag" and t.negated]
+
+    if len(names) > 1 or any(t.kind not in {"name", "tag"} for t in terms):
+        return None
+
+    if any(t.kind == "name" and t.negated for t in terms):
+        return None
+
+    return dict(
+        name=names[0] if names else None,
+        tags=tags or None,
+        exclude_tags=exclude_tags or None,
+    )
+
+
+def compile_query(db, terms):
+    """Return the filters selecting the links that match all the given terms.
+
+    The filters are ordered so that the most selective comes first. If it matches
+    fewer than one in :data:`~llyfrau.bitmaps.SCAN_RATIO` links, it's written so
+    that SQLite can use it to look up the matching links. The others are written so
+    that they can't be, see :class:`Predicate`.
+    """
+
+    conn = db.session.connection()
+    size = bitmap_size(conn)
+    predicates, negated = [], []
+
+    for compile_terms in [_text_filters, _tag_filters, _source_filters, _visit_filters]:
+        found, excluded = compile_terms(db, terms, size)
+
+        predicates.extend(found)
+        negated.extend(excluded)
+
+    if any(p.estimate == 0 for p in predicates):
+        return [false()]
+
+    predicates.sort(key=lambda p: p.estimate)
+
+    if len(predicates) > 0 and predicates[0].estimate * SCAN_RATIO < size:
+        first, *rest = predicates
+        return [first.driving] + [p.checking for p in rest] + negated
+
+    return [p.checking for p in predicates] + negated
+
+
+def _probe(db, query, size):
+    """Count the rows returned by the given query, stopping once there are too many
+    for it to be worth using to look up links."""
+
+    limit = size // SCAN_RATIO + 1
+    query = select(func.count()).select_from(query.limit(limit).subquery())
+
+    return db.session.execute(query).scalar()
+
+
+def _text_filters(db, terms, size):
+    """Compile the terms matching link names and urls.
+
+    Terms long enough to use the full text index are combined into a single
+    expression, since the index is able to find the links that match all of them at
+    once.
+    """
+
+    columns = {"name": Link.name, "url": Link.url}
+    terms = [t for t in terms if t.kind in columns]
+    indexed, predicates, negated = [], [], []
+
+    for term in terms:
+        matches = columns[term.kind].ilike(f"%{term.value}%")
+
+        if term.negated:
+            negated.append(~matches)
+
+        elif db.fts and len(term.value) >= FTS_MIN_LENGTH:
+            indexed.append((term, matches))
+
+        else:
+            predicates.append(Predicate(size, matches, matches))
+
+    if len(indexed) > 0:
+        expr = " AND ".join(
+            f'{t.kind} : "' + t.value.replace('"', '""') + '"' for t, _ in indexed
+        )
+        matched = select(links_fts.c.rowid).where(
+            literal_column("links_fts").op("MATCH")(expr)
+        )
+
+        # Checking a link against the index means running the whole search, it's
+        # much cheaper to check each term against the link itself.
+        estimate = _probe(db, matched, size)
+        checking = and_(*[matches for _, matches in indexed])
+
+        predicates.append(Predicate(estimate, Link.id.in_(matched), checking))
+
+    return predicates, negated
+
+
+def _tag_filters(db, terms, size):
+    """Compile the terms matching tags.
+
+    If the bitmap index covers any of the tags, all the tags are combined into a
+    single selection, whose size is known exactly. Otherwise each tag is looked up
+    in the :code:`tag_associations` table, using the statistics in
+    :mod:`llyfrau.stats` to estimate how many links each one has.
+    """
+
+    tags = {t.value for t in terms if t.kind == "tag" and not t.negated}
+    excluded = {t.value for t in terms if t.kind == "tag" and t.negated}
+
+    if len(tags | excluded) == 0:
+        return [], []
+
+    names = tags | excluded
+    ids = dict(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(names)))
+
+    if any(name not in ids for name in tags):
+        return [Predicate(0, false(), false())], []
+
+    tag_ids = [ids[name] for name in tags]
+    exclude_ids = [ids[name] for name in excluded if name in ids]
+
+    conn = db.session.connection()
+    selection = None
+
+    if db.tag_bitmaps:
+        selection = evaluate(conn, tag_ids, exclude_ids=exclude_ids)
+
+    if selection is not None:
+        register(conn, "in_query_tags", selection.links)
+        checking = func.in_query_tags(Link.id) == 1
+
+        if selection.negated:
+            return [], [~checking]
+
+        # Dense selections are never selective enough to drive the search, so don't
+        # bother listing their links.
+        driving = checking
+
+        if selection.sparse:
+            values = func.json_each(json.dumps(to_ids(selection.links)))
+            driving = Link.id.in_(select(values.table_valued("value").c.value))
+
+        return [Predicate(cardinality(selection.links), driving, checking)], []
+
+    link_id = tag_association_table.c.link_id
+    tag_id = tag_association_table.c.tag_id
+    known = counts(conn, "tag", tag_ids) if db.link_counts else None
+    predicates = []
+
+    for id_ in tag_ids:
+        tagged = select(link_id).where(tag_id == id_)
+
+        # The counts can be out of date, so they're not enough to rule a tag out.
+        if known is None:
+            estimate = _probe(db, tagged, size)
+        else:
+            estimate = max(known.get(id_, 0), 1)
+
+        checking = exists().where(link_id == Link.id, tag_id == id_)
+        predicates.append(Predicate(estimate, Link.id.in_(tagged), checking))
+
+    negated = [
+        ~exists().where(link_id == Link.id, tag_id == id_) for id_ in exclude_ids
+    ]
+
+    return predicates, negated
+
+
+def _source_filters(db, terms, size):
+    """Compile the terms matching the names of sources."""
+
+    predicates, negated = [], []
+    conn = db.session.connection()
+
+    for term in terms:
+
+        if term.kind != "source":
+            continue
+
+        matches = Source.name.ilike(f"%{term.value}%")
+        ids = [id_ for (id_,) in db.session.query(Source.id).filter(matches)]
+
+        # Unlike a plain column, an expression can't be looked up in an index.
+        checking = (Link.source_id + 0).in_(ids)
+
+        if term.negated:
+            negated.append(or_(Link.source_id.is_(None), ~checking))
+            continue
+
+        if len(ids) == 0:
+            estimate = 0
+        elif db.link_counts:
+            estimate = max(sum(counts(conn, "source", ids).values()), 1)
+        else:
+            estimate = _probe(db, select(Link.id).where(Link.source_id.in_(ids)), size)
+
+        predicates.append(Predicate(estimate, Link.source_id.in_(ids), checking))
+
+    return predicates, negated
+
+
+def _visit_filters(db, terms, size):
+    """Compile the terms matching the number of times links were visited."""
+
+    predicates, negated = [], []
+
+    for term in terms:
+
+        if term.kind != "visits":
+            continue
+
+        op, count = term.value
+        compare = OPERATORS[op]
+
+        # Unlike a plain column, an expression can't be looked up in an index.
+        checking = compare(Link.visits + 0, count)
+
+        if term.negated:
+            negated.append(~checking)
+            continue
+
+        driving = compare(Link.visits, count)
+        estimate = _probe(db, select(Link.id).where(driving), size)
+        predicates.append(Predicate(estimate, driving, checking))
+
+    return predicates, negated
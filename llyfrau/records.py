@@ -0,0 +1,28 @@
+"""Lightweight, read only representations of the items stored in the database.
+
+Unlike the ORM classes in :mod:`llyfrau.data`, these don't depend on a database
+session, so they can be passed between threads or sent over the wire.
+"""
+import collections
+
+LinkRecord = collections.namedtuple("LinkRecord", "id,name,url,visits,source,tags")
+"""A link, with its expanded url, the name of its source and its tag names."""
+
+SourceRecord = collections.namedtuple("SourceRecord", "id,name,uri,prefix")
+"""A source."""
+
+TagRecord = collections.namedtuple("TagRecord", "id,name")
+"""A tag."""
+
+
+class Page(list):
+    """A page of search results.
+
+    :code:`cursor` identifies the position of the last result in the page, pass it as
+    the :code:`after` argument of the same search to fetch the next page. It is
+    :code:`None` when there are no more results.
+    """
+
+    def __init__(self, items=(), cursor=None):
+        super().__init__(items)
+        self.cursor = cursor
@@ -0,0 +1,72 @@
+"""Statistics on the number of links with each tag and from each source.
+
+The counts are kept in the :code:`link_counts` table and are used to estimate how
+many links each part of a query will match, see :mod:`llyfrau.query`. Adding,
+importing and syncing links recount the tags and sources they touch. Changes made any
+other way aren't counted until the next time those tags or sources are, but since
+the counts are only used as estimates that doesn't matter much.
+"""
+import json
+
+from sqlalchemy import text
+
+COUNTED = {"tag": ("tag_associations", "tag_id"), "source": ("links", "source_id")}
+"""The table and column the links are counted from, for each kind of item."""
+
+
+def update(conn, kind, ids=None):
+    """Recount the links with the given tags or from the given sources.
+
+    :param conn: The connection to use
+    :param kind: Either :code:`"tag"` or :code:`"source"`
+    :param ids: The ids of the items to recount, if :code:`None` everything is
+                recounted.
+    """
+
+    table, column = COUNTED[kind]
+    params = {"kind": kind}
+    items, selected = "", ""
+
+    if ids is not None:
+        params["ids"] = json.dumps(sorted(set(ids)))
+        items = "AND item_id IN (SELECT value FROM json_each(:ids))"
+        selected = f"AND {column} IN (SELECT value FROM json_each(:ids))"
+
+    conn.execute(text(f"DELETE FROM link_counts WHERE kind = :kind {items}"), params)
+    conn.execute(
+        text(
+            f"""
+            INSERT INTO link_counts (kind, item_id, links)
+            SELECT :kind, {column}, count(*) FROM {table}
+            WHERE {column} IS NOT NULL {selected}
+            GROUP BY {column}
+            """
+        ),
+        params,
+    )
+
+
+def counts(conn, kind, ids):
+    """Return the number of links with each of the given tags, or from each of the
+    given sources.
+
+    Items without any links are left out.
+    """
+
+    query = text(
+        "SELECT item_id, links FROM link_counts "
+        "WHERE kind = :kind AND item_id IN (SELECT value FROM json_each(:ids))"
+    )
+    params = {"kind": kind, "ids": json.dumps(sorted(set(ids)))}
+
+    return dict(conn.execute(query, params).all())
+
+
+def recount(conn, tag_ids=(), source_ids=()):
+    """Recount the links with the given tags and from the given sources."""
+
+    if len(tag_ids) > 0:
+        update(conn, "tag", tag_ids)
+
+    if len(source_ids) > 0:
+        update(conn, "source", source_ids)
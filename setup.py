@@ -14,8 +14,17 @@ def readme():
         return f.read()
 
 
-install_requires = ["appdirs", "prompt_toolkit", "sphobjinv", "sqlalchemy"]
-extras = {"dev": ["black", "flake8", "pytest", "pytest-cov", "tox",]}
+install_requires = [
+    "appdirs",
+    "importlib_metadata; python_version < '3.8'",
+    "prompt_toolkit",
+    "sphobjinv",
+    "sqlalchemy>=1.4",
+]
+extras = {
+    "dev": ["black", "flake8", "pytest", "pytest-cov", "tox",],
+    "zstd": ["zstandard"],
+}
 
 setup(
     name="llyfrau",
@@ -0,0 +1,232 @@
+import io
+import json
+import pathlib
+import sqlite3
+import sys
+import unittest.mock as mock
+
+import py.test
+
+from llyfrau.archive import export, load, open_archive
+from llyfrau.bitmaps import is_fresh
+from llyfrau.data import Database, Link, Source, Visit, bulk_import
+from llyfrau.stats import counts
+
+
+def create_database(filepath=":memory:"):
+    """Create a database with a source, some tagged links and a few visits."""
+
+    db = Database(filepath, create=True, cache_size=0)
+    Source.add(db, name="Python", uri="x://", prefix="https://docs.python.org/")
+
+    links = [
+        (f"link {i}", f"page/{i}.html", ["common", f"tag-{i % 3}"]) for i in range(20)
+    ]
+    bulk_import(db, links, source_id=1)
+
+    Link.create(db, "https://github.com", name="Github", tags=["code"])
+    Link.create(db, "https://example.com", name="Example")
+
+    for link_id in [1, 1, 5, 21]:
+        Link.visit(db, link_id, when=1_600_000_000 + link_id)
+
+    return db
+
+
+def schema(db):
+    """Return the sql of every table, index and trigger in the given database."""
+
+    conn = db.session.connection()
+    query = "SELECT name, sql FROM sqlite_master ORDER BY name"
+
+    return conn.exec_driver_sql(query).all()
+
+
+def dump(db):
+    """Return everything stored in the given database."""
+
+    conn = db.session.connection()
+    tables = ["sources", "tags", "links", "tag_associations", "visit_log"]
+
+    return {
+        table: conn.exec_driver_sql(f"SELECT * FROM {table} ORDER BY 1, 2").all()
+        for table in tables
+    }
+
+
+def test_export():
+    """Ensure that the database is written as JSON Lines, one row per line."""
+
+    db = create_database()
+    stream = io.StringIO()
+
+    written = export(db, stream, batch_size=7)
+    assert written == {"source": 1, "tag": 5, "link": 22, "visit": 4}
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert lines[0] == {"type": "llyfr", "version": 1}
+    assert [line["type"] for line in lines[1:3]] == ["source", "tag"]
+
+    github = next(line for line in lines if line.get("name") == "Github")
+    assert github["tags"] == [5]
+    assert github["visits"] == 1
+
+    example = next(line for line in lines if line.get("name") == "Example")
+    assert example["tags"] == []
+
+
+def test_export_snapshot(workdir):
+    """Ensure that changes made while a database is being exported aren't included
+    in the archive."""
+
+    filepath = str(pathlib.Path(workdir.name, "snapshot.db"))
+    sqlite3.connect(filepath).execute("PRAGMA journal_mode = WAL").close()
+    db = create_database(filepath)
+
+    class Stream(io.StringIO):
+        """Adds a source and one of its links once the sources have been written."""
+
+        changed = False
+
+        def write(self, text):
+
+            if '"type":"tag"' in text and not self.changed:
+                self.changed = True
+                other = sqlite3.connect(filepath)
+                other.execute(
+                    "INSERT INTO sources (id, name, uri) VALUES (2, 'Other', 'y://')"
+                )
+                other.execute(
+                    "INSERT INTO links (name, url, visits, source_id, frecency) "
+                    "VALUES ('Other', 'other.html', 0, 2, 0)"
+                )
+                other.commit()
+                other.close()
+
+            return super().write(text)
+
+    stream = Stream()
+    written = export(db, stream)
+
+    assert written == {"source": 1, "tag": 5, "link": 22, "visit": 4}
+    assert "Other" not in stream.getvalue()
+    assert db.session.query(Link).count() == 23
+
+
+@py.test.mark.parametrize("filename", ["links.jsonl", "links.jsonl.gz"])
+def test_export_load(workdir, filename):
+    """Ensure that a database can be exported and loaded into a new one."""
+
+    db = create_database()
+    path = pathlib.Path(workdir.name, filename)
+
+    # Use small batches, so that several are needed.
+    with open_archive(str(path), "w") as stream:
+        export(db, stream, batch_size=7)
+
+    copy = Database(":memory:", create=True, cache_size=0)
+
+    with open_archive(str(path), "r") as stream:
+        loaded = load(copy, stream, batch_size=7)
+
+    assert loaded == {"source": 1, "tag": 5, "link": 22, "visit": 4}
+    assert dump(copy) == dump(db)
+    assert schema(copy) == schema(db)
+
+    # The indexes built from the links are rebuilt.
+    assert [link.name for link in Link.search(copy, name="github")] == ["Github"]
+    assert is_fresh(copy.session.connection())
+    assert counts(copy.session.connection(), "source", [1]) == {1: 20}
+
+    # New links are added after the loaded ones.
+    generation = copy.generation
+    link_id = Link.create(copy, "https://gitlab.com", name="Gitlab", tags=["code"])
+
+    assert link_id == 23
+    assert copy.generation > generation
+    assert copy.session.query(Visit).count() == 4
+
+
+def test_export_load_compressed(workdir):
+    """Ensure that compressed archives are detected when they're loaded."""
+
+    db = create_database()
+    path = pathlib.Path(workdir.name, "compressed.jsonl")
+
+    with open_archive(str(path), "w", compression="gzip") as stream:
+        export(db, stream)
+
+    assert path.read_bytes()[:2] == b"\x1f\x8b"
+
+    copy = Database(":memory:", create=True)
+
+    with open_archive(str(path), "r") as stream:
+        load(copy, stream)
+
+    assert dump(copy) == dump(db)
+
+
+def test_export_load_zstd(workdir):
+    """Ensure that archives can be compressed with zstd, if it's installed."""
+
+    py.test.importorskip("zstandard")
+
+    db = create_database()
+    path = pathlib.Path(workdir.name, "links.jsonl.zst")
+
+    with open_archive(str(path), "w") as stream:
+        export(db, stream)
+
+    copy = Database(":memory:", create=True)
+
+    with open_archive(str(path), "r") as stream:
+        load(copy, stream)
+
+    assert dump(copy) == dump(db)
+
+
+def test_zstd_missing(workdir):
+    """Ensure that there's a helpful error if zstd isn't installed."""
+
+    path = pathlib.Path(workdir.name, "missing.jsonl.zst")
+
+    with mock.patch.dict(sys.modules, {"zstandard": None}):
+        with py.test.raises(ValueError, match="pip install"):
+            with open_archive(str(path), "w"):
+                pass
+
+
+def test_load_errors():
+    """Ensure that archives are only loaded into empty databases, and only if they
+    are archives."""
+
+    db = create_database()
+    stream = io.StringIO()
+    export(db, stream)
+
+    with py.test.raises(ValueError, match="empty"):
+        load(db, io.StringIO(stream.getvalue()))
+
+    with py.test.raises(ValueError, match="archive"):
+        load(Database(":memory:", create=True), io.StringIO('{"name": "link"}\n'))
+
+    with py.test.raises(ValueError, match="version"):
+        header = '{"type": "llyfr", "version": 1000}\n'
+        load(Database(":memory:", create=True), io.StringIO(header))
+
+
+def test_load_rollback():
+    """Ensure that nothing is loaded if the archive can't be loaded in full."""
+
+    db = create_database()
+    stream = io.StringIO()
+    export(db, stream)
+
+    copy = Database(":memory:", create=True)
+    expected = schema(copy)
+
+    with py.test.raises(ValueError, match="line type"):
+        load(copy, io.StringIO(stream.getvalue() + '{"type": "bookmark"}\n'))
+
+    assert schema(copy) == expected
+    assert copy.session.query(Link).count() == 0
@@ -0,0 +1,200 @@
+import unittest.mock as mock
+
+import py.test
+
+from llyfrau.bitmaps import (
+    difference,
+    evaluate,
+    intersection,
+    is_fresh,
+    rebuild,
+    to_bitmap,
+    to_ids,
+    union,
+)
+from llyfrau.data import Database, Link, Tag, bulk_import, sync_links
+
+
+@py.test.fixture
+def small_bitmaps():
+    """Give tags bitmaps even in the small databases used by the tests."""
+
+    with mock.patch("llyfrau.bitmaps.BITMAP_MIN_LINKS", 5):
+        yield
+
+
+def create_database():
+    """Create a database where some tags are much more common than others."""
+
+    db = Database(":memory:", create=True, cache_size=0)
+    links = []
+
+    for i in range(200):
+        tags = ["common"]
+
+        if i % 2 == 0:
+            tags.append("even")
+
+        if i % 3 == 0:
+            tags.append("three")
+
+        if i % 50 == 0:
+            tags.append("rare")
+
+        links.append((f"link {i}", f"https://{i}", tags))
+
+    bulk_import(db, links)
+    return db
+
+
+def stored_bitmaps(db):
+    """Return the bitmaps stored in the index."""
+
+    conn = db.session.connection()
+    rows = conn.exec_driver_sql("SELECT tag_id, bitmap FROM tag_bitmaps").all()
+
+    return {tag_id: int.from_bytes(blob, "little") for tag_id, blob in rows}
+
+
+def test_bitmap_conversions():
+    """Ensure that sets of links can be converted between lists and bitmaps."""
+
+    ids = [0, 3, 63, 64, 100, 1000]
+    bitmap = to_bitmap(ids)
+
+    assert bitmap == sum(1 << i for i in ids)
+    assert to_ids(bitmap) == ids
+    assert to_ids(0) == []
+    assert to_bitmap([]) == 0
+
+
+@py.test.mark.parametrize("sparse", [True, False])
+def test_bitmap_operations(sparse):
+    """Ensure that sets of links can be combined, whether they're lists or bitmaps."""
+
+    a = [1, 2, 3, 4, 70]
+    b = [2, 4, 6, 70]
+    c = [4]
+
+    def convert(links):
+        return links if sparse else to_bitmap(links)
+
+    assert to_ids(intersection([convert(a), b, convert(c)])) == [4]
+    assert to_ids(intersection([convert(a), convert(b)])) == [2, 4, 70]
+    assert to_ids(union([convert(a), b])) == [1, 2, 3, 4, 6, 70]
+    assert to_ids(difference(convert(a), [b, convert(c)])) == [1, 3]
+    assert to_ids(difference(convert(a), [])) == a
+
+
+def test_bitmaps_common_tags(small_bitmaps):
+    """Ensure that only the most common tags are given a bitmap."""
+
+    db = create_database()
+    names = {tag.id: tag.name for tag in db.session.query(Tag)}
+    bitmaps = stored_bitmaps(db)
+
+    assert {names[tag_id] for tag_id in bitmaps} == {"common", "even", "three"}
+
+    even = Tag.get(db, name="even")
+    assert to_ids(bitmaps[even.id]) == list(range(1, 201, 2))
+    assert is_fresh(db.session.connection())
+
+
+@py.test.mark.parametrize(
+    "args",
+    [
+        dict(tags=["common"]),
+        dict(tags=["even", "three"]),
+        dict(tags=["even", "rare"]),
+        dict(tags=["rare", "three"], tag_mode="or"),
+        dict(tags=["even", "missing"]),
+        dict(tags=["even", "missing"], tag_mode="or"),
+        dict(tags=["common"], exclude_tags=["even", "rare"]),
+        dict(exclude_tags=["three"]),
+        dict(exclude_tags=["rare", "missing"]),
+        dict(name="link 1", tags=["three"]),
+        dict(tags=["even"], sort="visits"),
+    ],
+)
+def test_link_search_bitmaps(small_bitmaps, args):
+    """Ensure that searching with the bitmap index gives the same results as
+    searching without it."""
+
+    db = create_database()
+
+    for i in range(1, 200, 7):
+        Link.visit(db, i)
+
+    links = Link.search(db, top=None, **args)
+    page = Link.search_records(db, top=5, **args)
+    pages = list(page)
+
+    while page.cursor is not None:
+        page = Link.search_records(db, top=5, after=page.cursor, **args)
+        pages.extend(page)
+
+    db.tag_bitmaps = False
+    expected = Link.search(db, top=None, **args)
+
+    assert [link.id for link in links] == [link.id for link in expected]
+    assert [link.id for link in pages] == [link.id for link in expected]
+
+
+def test_bitmaps_used(small_bitmaps):
+    """Ensure that common tags are selected using their bitmaps."""
+
+    db = create_database()
+    conn = db.session.connection()
+    even, rare = Tag.get(db, name="even"), Tag.get(db, name="rare")
+
+    selection = evaluate(conn, [even.id])
+    assert not selection.sparse
+    assert to_ids(selection.links) == list(range(1, 201, 2))
+
+    selection = evaluate(conn, [even.id, rare.id])
+    assert selection.sparse
+    assert selection.links == [1, 51, 101, 151]
+
+    assert evaluate(conn, [rare.id]) is None
+
+
+def test_bitmaps_maintained(small_bitmaps):
+    """Ensure that the index is kept up to date as links are added and changed."""
+
+    db = create_database()
+    even = Tag.get(db, name="even")
+
+    link_id = Link.create(db, "https://example.com", name="Example", tags=["even"])
+    assert link_id in to_ids(stored_bitmaps(db)[even.id])
+
+    # Tags can gain a bitmap as links are added
+    bulk_import(db, [(f"new {i}", f"https://new/{i}", ["new"]) for i in range(10)])
+    new = Tag.get(db, name="new")
+    assert len(to_ids(stored_bitmaps(db)[new.id])) == 10
+
+    links = [(f"link {i}", f"https://{i}", ["even"]) for i in range(0, 200, 2)]
+    sync_links(db, None, links)
+    db.commit()
+
+    bitmaps = stored_bitmaps(db)
+    assert is_fresh(db.session.connection())
+
+    rebuild(db.session.connection())
+    assert stored_bitmaps(db) == bitmaps
+
+
+def test_bitmaps_stale(small_bitmaps):
+    """Ensure that the index isn't used when the tags are changed without it, until
+    it's rebuilt."""
+
+    db = create_database()
+    link = Link.get(db, 2)
+    link.tags.append(Tag.get(db, name="even"))
+    db.commit()
+
+    assert not is_fresh(db.session.connection())
+    assert 2 in [link.id for link in Link.search(db, tags=["even"], top=None)]
+
+    Link.create(db, "https://example.com", name="Example", tags=["three"])
+    assert is_fresh(db.session.connection())
+    assert 2 in [link.id for link in Link.search(db, tags=["even"], top=None)]
@@ -0,0 +1,150 @@
+import pathlib
+
+from llyfrau.bitmaps import is_fresh
+from llyfrau.cache import ResultCache, make_key
+from llyfrau.data import Database, Link, Source, Tag, bulk_import, sync_links
+from llyfrau.records import LinkRecord, Page, SourceRecord, TagRecord
+
+
+def test_make_key():
+    """Ensure that equivalent searches share the same key."""
+
+    assert make_key("links", name="a", tags=["x", "y"], sort=None) == make_key(
+        "links", tags=["y", "x"], name="a"
+    )
+    assert make_key("links", after=[1, 2]) == make_key("links", after=(1, 2))
+
+    assert make_key("links", name="a") != make_key("links", name="b")
+    assert make_key("links", name="a") != make_key("tags", name="a")
+
+
+def test_result_cache():
+    """Ensure that results are cached until the generation changes."""
+
+    cache = ResultCache(maxsize=2)
+    calls = []
+
+    def compute(value):
+        def f():
+            calls.append(value)
+            return Page([value], cursor=(value,))
+
+        return f
+
+    assert cache.get(1, "a", compute("a")) == ["a"]
+    assert cache.get(1, "a", compute("a")).cursor == ("a",)
+    assert calls == ["a"]
+    assert cache.info() == (1, 1, 2, 1)
+
+    # The least recently used result is evicted.
+    cache.get(1, "b", compute("b"))
+    cache.get(1, "a", compute("a"))
+    cache.get(1, "c", compute("c"))
+    cache.get(1, "a", compute("a"))
+    cache.get(1, "b", compute("b"))
+    assert calls == ["a", "b", "c", "b"]
+
+    # Everything is discarded when the generation changes.
+    cache.get(2, "a", compute("a"))
+    assert calls == ["a", "b", "c", "b", "a"]
+    assert cache.info().currsize == 1
+
+
+def test_result_cache_returns_copies():
+    """Ensure that modifying the results doesn't modify the cached copy."""
+
+    cache = ResultCache()
+
+    results = cache.get(1, "a", lambda: Page([1, 2]))
+    results.append(3)
+
+    assert cache.get(1, "a", lambda: Page([])) == [1, 2]
+
+
+def test_result_cache_no_generation():
+    """Ensure that nothing is cached if the generation is unknown."""
+
+    cache = ResultCache()
+
+    cache.get(None, "a", lambda: [1])
+    cache.get(None, "a", lambda: [1])
+
+    assert cache.info() == (0, 2, cache.maxsize, 0)
+
+
+def test_search_records_cached(workdir):
+    """Ensure that search results are cached until another process changes them."""
+
+    filepath = str(pathlib.Path(workdir.name, "cache.db"))
+
+    db = Database(filepath, create=True)
+    Source.add(db, name="Python", uri="x://", prefix="https://docs.python.org/")
+    Link.add(db, name="print", url="builtins.html#print", source_id=1)
+    Link.create(db, "https://github.com", name="Github", tags=["code"])
+
+    url = "https://docs.python.org/builtins.html#print"
+    expected = [
+        LinkRecord(1, "print", url, 0, "Python", []),
+        LinkRecord(2, "Github", "https://github.com", 0, None, ["code"]),
+    ]
+
+    assert Link.search_records(db) == expected
+    assert Link.search_records(db) == expected
+    assert Tag.search_records(db) == [TagRecord(1, "code")]
+    assert Source.search_records(db) == [
+        SourceRecord(1, "Python", "x://", "https://docs.python.org/")
+    ]
+    db.session.rollback()
+
+    assert db.cache.info().hits == 1
+    assert db.cache.info().misses == 3
+
+    other = Database(filepath)
+    Link.create(other, "https://gitlab.com", name="Gitlab", tags=["code"])
+    other.close()
+
+    assert [link.name for link in Link.search_records(db)] == [
+        "print",
+        "Github",
+        "Gitlab",
+    ]
+    assert db.cache.info().misses == 4
+    assert db.cache.info().currsize == 1
+
+
+def test_generation():
+    """Ensure that the generation is bumped once for each change, rather than for
+    each row written."""
+
+    db = Database(":memory:", create=True)
+    conn = db.session.connection()
+
+    triggers = "SELECT name FROM sqlite_master WHERE name LIKE '%_generation_%'"
+    assert conn.exec_driver_sql(triggers).all() == []
+
+    generation = db.generation
+    links = [(f"link {i}", f"page/{i}.html", ["a", "b"]) for i in range(50)]
+    bulk_import(db, links, source=dict(name="Docs", uri="x://"))
+
+    assert db.generation == generation + 1
+    assert is_fresh(db.session.connection())
+
+    generation = db.generation
+    sync_links(db, 1, links[:40])
+
+    assert db.generation == generation + 1
+    assert is_fresh(db.session.connection())
+
+    generation = db.generation
+    Link.visit(db, 1)
+
+    assert db.generation == generation + 1
+
+    # Changes made through the ORM are counted too.
+    generation = db.generation
+    link = db.session.get(Link, 2)
+    link.tags = []
+    db.commit()
+
+    assert db.generation == generation + 1
+    assert not is_fresh(db.session.connection())
@@ -0,0 +1,201 @@
+import pathlib
+import unittest.mock as mock
+
+import py.test
+
+from llyfrau.catalog import Catalog, build, catalog_path, is_cursor
+from llyfrau.data import Database, Link, Source
+
+
+def create_database(filepath):
+    """Create a database with a few links, visited different numbers of times."""
+
+    db = Database(filepath, create=True)
+    Source.add(db, name="Python", uri="x://", prefix="https://docs.python.org/")
+
+    Link.add(db, name="print", url="builtins.html#print", source_id=1)
+    Link.create(db, "https://github.com", name="Github", tags=["code", "git"])
+    Link.create(db, "https://gitlab.com", name="GitLab", tags=["code", "git"])
+    Link.create(db, "https://numpy.org", name="NumPy", tags=["code", "python"])
+    Link.create(db, "https://example.com", name="Example", tags=["web"])
+
+    for link_id, visits in [(3, 3), (4, 1), (1, 2)]:
+        for _ in range(visits):
+            Link.visit(db, link_id)
+
+    return db
+
+
+@py.test.fixture(scope="module")
+def catalog(workdir):
+    filepath = str(pathlib.Path(workdir.name, "catalog.db"))
+    create_database(filepath).close()
+
+    catalog = Catalog(build(filepath))
+    yield catalog
+
+    catalog.close()
+
+
+def test_catalog_path():
+    """Ensure that the catalog is stored next to the database."""
+
+    path = catalog_path("/path/to/links.db")
+    assert path == pathlib.Path("/path/to/links.db.catalog")
+
+
+def test_catalog_search(catalog):
+    """Ensure that links are returned most frecent first."""
+
+    assert len(catalog) == 5
+    assert [link.id for link in catalog.search()] == [3, 1, 4, 2, 5]
+
+    gitlab, python = catalog.search(top=2)
+    assert gitlab.name == "GitLab"
+    assert gitlab.visits == 3
+    assert gitlab.source is None
+    assert gitlab.tags == ["code", "git"]
+
+    assert python.url == "https://docs.python.org/builtins.html#print"
+    assert python.source == "Python"
+    assert python.tags == []
+
+
+def test_catalog_search_name(catalog):
+    """Ensure that names are matched as case insensitive substrings."""
+
+    assert [link.name for link in catalog.search(name="git")] == ["GitLab", "Github"]
+    assert [link.name for link in catalog.search(name="PY")] == ["NumPy"]
+    assert catalog.search(name="nothing") == []
+
+
+@py.test.mark.parametrize(
+    "args,expected",
+    [
+        (dict(tags=["git"]), [3, 2]),
+        (dict(tags=["code", "python"]), [4]),
+        (dict(tags=["code", "missing"]), []),
+        (dict(tags=["python", "web", "missing"], tag_mode="or"), [4, 5]),
+        (dict(tags=["code"], exclude_tags=["python"]), [3, 2]),
+        (dict(name="git", tags=["code"], exclude_tags=["missing"]), [3, 2]),
+    ],
+)
+def test_catalog_search_tags(catalog, args, expected):
+    """Ensure that links can be filtered by tag."""
+
+    assert [link.id for link in catalog.search(**args)] == expected
+
+
+def test_catalog_search_pages(catalog):
+    """Ensure that the cursor can be used to fetch the next page of results."""
+
+    page = catalog.search(top=2)
+    assert is_cursor(page.cursor)
+
+    ids = [link.id for link in page]
+
+    while page.cursor is not None:
+        page = catalog.search(top=2, after=page.cursor)
+        ids.extend(link.id for link in page)
+
+    assert ids == [3, 1, 4, 2, 5]
+
+
+def test_catalog_search_errors(catalog):
+    """Ensure that invalid arguments are rejected."""
+
+    with py.test.raises(ValueError):
+        catalog.search(tags=["code"], tag_mode="xor")
+
+    with py.test.raises(ValueError):
+        catalog.search(after=(1, 2))
+
+    with py.test.raises(ValueError):
+        catalog.search(after=("catalog", catalog.generation - 1, 2))
+
+
+def test_catalog_search_rare_tag(workdir):
+    """Ensure that searching by name and a rare tag finds the right links."""
+
+    filepath = str(pathlib.Path(workdir.name, "rare.db"))
+    db = Database(filepath, create=True)
+
+    for i in range(200):
+        tags = ["rare"] if i % 100 == 0 else ["common"]
+        Link.create(db, f"https://{i}.com", name=f"Link {i}", tags=tags)
+
+    db.close()
+
+    catalog = Catalog(build(filepath))
+    links = catalog.search(name="link 1", tags=["rare"])
+    catalog.close()
+
+    assert [link.name for link in links] == ["Link 100"]
+
+
+def test_catalog_load(workdir):
+    """Ensure that the catalog is only rebuilt when the database changes."""
+
+    filepath = str(pathlib.Path(workdir.name, "load.db"))
+    create_database(filepath).close()
+
+    catalog = Catalog.load(filepath)
+    generation = catalog.generation
+    catalog.close()
+
+    mtime = catalog_path(filepath).stat().st_mtime_ns
+
+    catalog = Catalog.load(filepath)
+    assert catalog.generation == generation
+    assert catalog_path(filepath).stat().st_mtime_ns == mtime
+
+    db = Database(filepath)
+    Link.create(db, "https://python.org", name="Python")
+    db.close()
+
+    # The old catalog can still be used while the new one is built.
+    updated = Catalog.load(filepath)
+    assert updated.generation > generation
+    assert len(updated) == 6
+    assert len(catalog) == 5
+
+    catalog.close()
+    updated.close()
+
+
+def test_catalog_current(workdir):
+    """Ensure that the catalog is only opened if it's up to date, and never built."""
+
+    filepath = str(pathlib.Path(workdir.name, "current.db"))
+    create_database(filepath).close()
+
+    assert Catalog.current(filepath) is None
+    assert not catalog_path(filepath).exists()
+
+    Catalog.load(filepath).close()
+    catalog = Catalog.current(filepath)
+
+    assert len(catalog) == 5
+    catalog.close()
+
+    db = Database(filepath)
+    Link.create(db, "https://python.org", name="Python")
+    db.close()
+
+    assert Catalog.current(filepath) is None
+
+
+def test_catalog_load_error(workdir):
+    """Ensure that there's no catalog if it can't be built."""
+
+    filepath = str(pathlib.Path(workdir.name, "load-error.db"))
+    create_database(filepath).close()
+
+    with mock.patch("llyfrau.catalog._build", side_effect=KeyError(1)):
+        assert Catalog.load(filepath) is None
+
+
+def test_catalog_load_no_database(workdir):
+    """Ensure that there's no catalog without a database."""
+
+    assert Catalog.load(str(pathlib.Path(workdir.name, "missing.db"))) is None
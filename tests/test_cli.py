@@ -1,7 +1,17 @@
+import json
 import pathlib
+import subprocess
+import sys
+import unittest.mock as mock
 
-from llyfrau.cli import add_link
+from llyfrau.catalog import catalog_path
+from llyfrau.cli import add_link, export_archive, load_archive, search_links
 from llyfrau.data import Database, Link, Tag
+from llyfrau.importers import sphinx
+from llyfrau.migrations import MIGRATIONS
+from llyfrau.plugins import entry_points
+
+from .test_migrations import create_v0
 
 
 def test_add_link(workdir):
@@ -57,3 +67,207 @@ def test_add_link_with_existing_tags(workdir):
     link1 = Link.search(db, name="Argparse")[0]
     link2 = Link.search(db, name="Optparse")[0]
     assert set(link1.tags) == set(link2.tags)
+
+
+def test_add_link_profile_skips_daemon(workdir):
+    """Ensure that the daemon isn't used when the database options are given."""
+
+    filepath = pathlib.Path(workdir.name, "links-profile.db")
+
+    with mock.patch("llyfrau.cli.Client.connect") as m_connect:
+        add_link(
+            str(filepath),
+            url="https://www.github.com",
+            name="Github",
+            tags=None,
+            db_profile="bulk-import",
+        )
+
+    m_connect.assert_not_called()
+
+    db = Database(str(filepath), create=False)
+    assert Link.get(db, 1).name == "Github"
+
+
+def test_cli_import_is_light():
+    """Ensure that importing the cli doesn't import anything only some commands need."""
+
+    script = "import sys, llyfrau.cli; print(' '.join(sys.modules))"
+    output = subprocess.run(
+        [sys.executable, "-c", script], check=True, capture_output=True, text=True
+    )
+    modules = {name.split(".")[0] for name in output.stdout.split()}
+
+    for heavy in ["sqlalchemy", "prompt_toolkit", "pkg_resources", "sphobjinv"]:
+        assert heavy not in modules
+
+
+def test_entry_points_index(workdir):
+    """Ensure that entry points are found once, then looked up in the index."""
+
+    index = pathlib.Path(workdir.name, "entry-points.json")
+    importers = entry_points("llyfrau.importers", index_path=index)
+
+    assert index.exists()
+    assert importers["sphinx"].value == "llyfrau.importers:sphinx"
+    assert importers["sphinx"].load() is sphinx
+
+    with mock.patch("llyfrau.plugins._scan") as m_scan:
+        assert entry_points("llyfrau.importers", index_path=index) == importers
+
+    m_scan.assert_not_called()
+
+    # Installing a package should cause the index to be rebuilt
+    with mock.patch("llyfrau.plugins._fingerprint", return_value=[]), mock.patch(
+        "llyfrau.plugins._scan", return_value={}
+    ) as m_scan:
+        assert entry_points("llyfrau.importers", index_path=index) == {}
+
+    m_scan.assert_called_with("llyfrau.importers")
+
+
+def test_cli_profile_output(workdir):
+    """Ensure that the query profile can be written to a file."""
+
+    filepath = pathlib.Path(workdir.name, "profile.db")
+    output = pathlib.Path(workdir.name, "profile.json")
+    add_link(str(filepath), url="https://www.github.com", name="Github", tags=None)
+
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "llyfrau",
+            "-f",
+            str(filepath),
+            "--profile-output",
+            str(output),
+            "sources",
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+    profile = json.loads(output.read_text())
+    statements = [s["statement"] for s in profile["statements"]]
+
+    assert any("FROM sources" in s for s in statements)
+
+
+def test_import_requires_uris(workdir):
+    """Ensure that running an importer with nothing to import is an error."""
+
+    filepath = pathlib.Path(workdir.name, "import-nothing.db")
+    result = subprocess.run(
+        [sys.executable, "-m", "llyfrau", "-f", str(filepath), "import", "sphinx"],
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode == 2
+    assert "at least one uri or --input-file is required" in result.stderr
+    assert not filepath.exists()
+
+
+def test_search_links(workdir, capsys):
+    """Ensure that links can be searched for from the command line."""
+
+    filepath = str(pathlib.Path(workdir.name, "search.db"))
+    add_link(filepath, url="https://www.github.com", name="Github", tags=["code"])
+    add_link(filepath, url="https://www.gitlab.com", name="Gitlab", tags=["code"])
+    add_link(filepath, url="https://www.python.org", name="Python", tags=None)
+
+    with mock.patch("llyfrau.catalog.subprocess.Popen") as m_popen:
+        search_links(filepath, name="git", tags=["code"])
+
+    lines = capsys.readouterr().out.splitlines()
+
+    assert len(lines) == 3
+    assert "Github" in lines[1]
+    assert "Gitlab" in lines[2]
+
+    # Without a catalog the database is searched, while one is built in the
+    # background.
+    assert not catalog_path(filepath).exists()
+    assert subprocess.run(m_popen.call_args[0][0]).returncode == 0
+
+    with mock.patch("llyfrau.catalog.subprocess.Popen") as m_popen, mock.patch(
+        "llyfrau.data.Link.search_records"
+    ) as m_search:
+        search_links(filepath, name="git", tags=["code"])
+
+    m_popen.assert_not_called()
+    m_search.assert_not_called()
+    assert capsys.readouterr().out.splitlines() == lines
+
+
+def test_search_links_catalog_error(workdir, capsys):
+    """Ensure that the database is searched if the catalog can't be used."""
+
+    filepath = str(pathlib.Path(workdir.name, "search-catalog-error.db"))
+    add_link(filepath, url="https://www.github.com", name="Github", tags=["code"])
+
+    with mock.patch("llyfrau.catalog.subprocess.Popen"), mock.patch(
+        "llyfrau.catalog.Catalog.current", side_effect=KeyError(1)
+    ):
+        search_links(filepath, name="git")
+
+    lines = capsys.readouterr().out.splitlines()
+    assert "Github" in lines[1]
+
+
+def test_search_links_query(workdir, capsys):
+    """Ensure that links can be searched for using the query language."""
+
+    filepath = str(pathlib.Path(workdir.name, "search-query.db"))
+    add_link(filepath, url="https://www.github.com", name="Github", tags=["code"])
+    add_link(filepath, url="https://www.gitlab.com", name="Gitlab", tags=["code"])
+    add_link(filepath, url="https://www.python.org", name="Python", tags=None)
+
+    search_links(filepath, query="url:www -url:hub #code")
+    lines = capsys.readouterr().out.splitlines()
+
+    assert len(lines) == 2
+    assert "Gitlab" in lines[1]
+
+
+def test_search_links_old_database(workdir, capsys):
+    """Ensure that databases created by older versions are migrated before they're
+    searched."""
+
+    filepath = str(pathlib.Path(workdir.name, "search-v0.db"))
+    create_v0(filepath)
+
+    for query in [None, "#code"]:
+
+        with mock.patch("llyfrau.catalog.subprocess.Popen"):
+            search_links(filepath, name="git", query=query)
+
+        lines = capsys.readouterr().out.splitlines()
+
+        assert len(lines) == 2
+        assert "Github" in lines[1]
+
+    db = Database(filepath, db_profile="read-only")
+    assert db.version == len(MIGRATIONS)
+
+
+def test_export_load_archive(workdir):
+    """Ensure that a database can be copied by exporting and loading it."""
+
+    filepath = str(pathlib.Path(workdir.name, "export.db"))
+    add_link(filepath, url="https://www.github.com", name="Github", tags=["code"])
+    add_link(filepath, url="https://www.python.org", name="Python", tags=None)
+
+    archive = str(pathlib.Path(workdir.name, "export.jsonl.gz"))
+    assert export_archive(filepath, archive) == 0
+
+    copy = str(pathlib.Path(workdir.name, "loaded.db"))
+    assert load_archive(copy, archive) == 0
+
+    db = Database(copy)
+    assert [link.name for link in Link.search(db, tags=["code"])] == ["Github"]
+    db.close()
+
+    # Loading again would duplicate the links.
+    assert load_archive(copy, archive) == -1
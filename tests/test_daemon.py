@@ -0,0 +1,166 @@
+import os
+import pathlib
+import threading
+import unittest.mock as mock
+
+import py.test
+
+from llyfrau.daemon import Client, Daemon, DaemonError, runtime_dir, socket_path
+from llyfrau.data import Database, Link, Source
+from llyfrau.records import LinkRecord, SourceRecord
+
+
+@py.test.fixture(scope="module")
+def daemon(workdir):
+    """A daemon, running in a background thread."""
+
+    filepath = str(pathlib.Path(workdir.name, "daemon.db"))
+
+    db = Database(filepath, create=True)
+    Source.add(db, name="Python", uri="x://", prefix="https://docs.python.org/")
+    Link.add(db, name="print", url="builtins.html#print", source_id=1)
+    Link.add(db, name="Github", url="https://github.com", visits=2)
+    db.close()
+
+    server = Daemon(filepath)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    client = None
+    for _ in range(100):
+        client = Client.connect(filepath)
+
+        if client is not None:
+            break
+
+        threading.Event().wait(0.01)
+
+    yield filepath, client
+
+    server.shutdown()
+    thread.join()
+
+
+def test_socket_path(workdir):
+    """Ensure that the socket is placed next to the database, if it fits."""
+
+    assert socket_path("/tmp/links.db") == pathlib.Path("/tmp/links.db.sock")
+
+    with mock.patch.dict(os.environ, {"TMPDIR": workdir.name}):
+        os.environ.pop("XDG_RUNTIME_DIR", None)
+
+        with mock.patch("tempfile.tempdir", None):
+            path = socket_path("/tmp/" + "a" * 200 + "/links.db")
+
+    assert len(str(path)) < 100
+    assert path.name.startswith("llyfr-")
+    assert path.parent == pathlib.Path(workdir.name, f"llyfr-{os.getuid()}")
+    assert path.parent.stat().st_mode & 0o777 == 0o700
+
+
+def test_runtime_dir(workdir):
+    """Ensure that a runtime directory other users can access is refused."""
+
+    path = pathlib.Path(workdir.name, "runtime")
+    path.mkdir(mode=0o700)
+
+    with mock.patch.dict(os.environ, {"XDG_RUNTIME_DIR": str(path)}):
+        assert runtime_dir() == path
+
+        path.chmod(0o755)
+
+        with py.test.raises(DaemonError):
+            runtime_dir()
+
+
+def test_connect_no_daemon(workdir):
+    """Ensure that no client is returned if there is no daemon running."""
+
+    filepath = pathlib.Path(workdir.name, "nodaemon.db")
+    assert Client.connect(filepath) is None
+
+
+def test_connect_other_user(daemon):
+    """Ensure that a socket belonging to another user isn't trusted."""
+
+    filepath, _ = daemon
+
+    with mock.patch("os.getuid", return_value=os.getuid() + 1):
+        assert Client.connect(filepath) is None
+
+
+def test_daemon_search(daemon):
+    """Ensure that links can be searched through the daemon."""
+
+    _, client = daemon
+    assert client is not None
+
+    links = client.search(name="print")
+    assert links == [
+        LinkRecord(
+            1, "print", "https://docs.python.org/builtins.html#print", 0, "Python", []
+        )
+    ]
+
+    links = client.search(sort="visits", top=1)
+    assert links == [LinkRecord(2, "Github", "https://github.com", 2, None, [])]
+    assert links.cursor == (2, 2)
+
+    links = client.search(sort="visits", top=1, after=links.cursor)
+    assert [link.id for link in links] == [1]
+
+
+def test_daemon_sources(daemon):
+    """Ensure that sources can be listed through the daemon."""
+
+    _, client = daemon
+    assert client.sources() == [
+        SourceRecord(1, "Python", "x://", "https://docs.python.org/")
+    ]
+
+
+def test_daemon_add_and_visit(daemon):
+    """Ensure that changes made through the daemon are written to the database."""
+
+    filepath, client = daemon
+
+    link_id = client.add("https://example.com", name="Example", tags=["web"])
+    assert client.visit(link_id) == "https://example.com"
+
+    db = Database(filepath)
+    link = Link.get(db, link_id)
+
+    assert link.name == "Example"
+    assert link.visits == 1
+    assert [t.name for t in link.tags] == ["web"]
+    db.close()
+
+
+def test_daemon_stats(daemon):
+    """Ensure that repeated searches are served from the daemon's cache."""
+
+    _, client = daemon
+
+    before = client.stats()
+    client.search(name="print")
+    client.search(name="print")
+    after = client.stats()
+
+    assert after["hits"] == before["hits"] + 1
+    assert after["misses"] == before["misses"] + 1
+
+
+def test_daemon_errors(daemon):
+    """Ensure that errors are reported to the client, without stopping the daemon."""
+
+    _, client = daemon
+
+    with py.test.raises(DaemonError) as err:
+        client.request("explode")
+
+    assert "Unknown command" in str(err.value)
+
+    with py.test.raises(DaemonError):
+        client.search(tags=["a"], tag_mode="xor")
+
+    assert client.request("ping")
@@ -1,9 +1,29 @@
+import pathlib
+import sqlite3
+import threading
 import py.test
 import unittest.mock as mock
 
-from llyfrau.data import Database, Link, Source, Tag
-
-from sqlalchemy.exc import IntegrityError
+from llyfrau.data import (
+    FRECENCY_HALF_LIFE,
+    FRECENCY_MAX_AGE,
+    Database,
+    Link,
+    Source,
+    SyncResult,
+    Tag,
+    Visit,
+    bulk_import,
+    bulk_insert,
+    current_frecency,
+    recompute_frecency,
+    sync_links,
+    trigrams,
+)
+from llyfrau.migrations import MIGRATIONS
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError, OperationalError
 
 
 def test_source_add_single():
@@ -263,6 +283,113 @@ def test_link_open_updates_stats():
     assert link.visits == 2
 
 
+def test_link_visit_frecency():
+    """Ensure that recent visits count for more than older ones."""
+
+    db = Database(":memory:", create=True)
+    Link.add(db, items=[Link(name="Old", url="https://1"), Link(name="New", url="2")])
+
+    now = 1_600_000_000
+    old = now - 3 * FRECENCY_HALF_LIFE
+
+    for _ in range(4):
+        Link.visit(db, 1, when=old)
+
+    Link.visit(db, 2, when=now)
+
+    assert current_frecency(db, 1, when=now) == py.test.approx(0.5)
+    assert current_frecency(db, 2, when=now) == py.test.approx(1.0)
+    assert current_frecency(db, 2, when=now + FRECENCY_HALF_LIFE) == py.test.approx(0.5)
+
+    assert [l.id for l in Link.search(db, sort="visits")] == [1, 2]
+    assert [l.id for l in Link.search(db, sort="frecency")] == [2, 1]
+
+    # Never visited links come last
+    Link.add(db, name="Unvisited", url="https://3")
+    assert [l.id for l in Link.search(db, sort="frecency")] == [2, 1, 3]
+    assert current_frecency(db, 3) == 0
+
+
+def test_link_search_sort_by_frecency_uses_index():
+    """Ensure that sorting by frecency doesn't need to look at the visit log."""
+
+    db = Database(":memory:", create=True)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, *args):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    Link.search(db, sort="frecency")
+    event.remove(db.engine, "before_cursor_execute", record)
+
+    conn = db.session.connection()
+    statement, parameters = statements[0]
+
+    plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+    details = " ".join(row[-1] for row in plan)
+
+    assert "visit_log" not in statement
+    assert "ix_links_frecency" in details
+    assert "TEMP B-TREE" not in details
+
+
+def test_recompute_frecency():
+    """Ensure that recomputing the scores in bulk gives the same results as updating
+    them one visit at a time, and removes old visits."""
+
+    db = Database(":memory:", create=True)
+    Link.add(db, items=[Link(name=f"Link {i}", url=f"https://{i}") for i in range(3)])
+
+    now = 1_600_000_000
+    visits = [(1, now - 100), (1, now - 5000), (2, now - 20), (1, now)]
+
+    for link_id, when in visits:
+        Link.visit(db, link_id, when=when)
+
+    Link.visit(db, 3, when=now - 2 * FRECENCY_MAX_AGE)
+
+    expected = {link.id: link.frecency for link in Link.search(db)}
+    assert recompute_frecency(db, now=now) == 2
+
+    for link in Link.search(db):
+        db.session.refresh(link)
+
+        if link.id == 3:
+            assert link.frecency == 0
+            continue
+
+        assert link.frecency == py.test.approx(expected[link.id])
+
+    assert db.session.query(Visit).count() == 4
+
+
+def test_visit_recomputes_frecency():
+    """Ensure that visiting a link recomputes the scores once they're out of date."""
+
+    db = Database(":memory:", create=True)
+    Link.add(db, items=[Link(name=f"Link {i}", url=f"https://{i}") for i in range(2)])
+
+    now = 1_600_000_000
+    Link.visit(db, 1, when=now - 2 * FRECENCY_MAX_AGE)
+
+    with mock.patch("llyfrau.data.recompute_frecency") as m_recompute:
+        Link.visit(db, 2, when=now - 2 * FRECENCY_MAX_AGE + 60)
+
+    m_recompute.assert_not_called()
+    assert db.session.query(Visit).count() == 2
+
+    Link.visit(db, 2, when=now)
+
+    assert [visit.link_id for visit in db.session.query(Visit)] == [2]
+    assert Link.get(db, 1).frecency == 0
+
+    recomputed_at = db.session.execute(
+        text("SELECT value FROM meta WHERE key = 'frecency_recomputed_at'")
+    ).scalar()
+    assert recomputed_at == now
+
+
 def test_link_search_basic():
     """Ensure that the simplest search just returns records in the db."""
 
@@ -507,3 +634,702 @@ def test_link_search_by_tag():
 
     # Ensure multiple tags are ANDed
     assert len(Link.search(db, tags=["function", "c"])) == 0
+
+
+def test_link_search_by_name_ranked():
+    """Ensure that when searching by name, the closest matches are returned first."""
+
+    db = Database(":memory:", create=True, verbose=True)
+    assert db.fts
+
+    links = [
+        Link(name="numpy.ndarray.flatten", url="https://1"),
+        Link(name="numpy.ndarray", url="https://2"),
+        Link(name="numpy", url="https://3"),
+    ]
+
+    Link.add(db, items=links)
+    results = Link.search(db, name="ndarray")
+
+    assert [l.url for l in results] == ["https://2", "https://1"]
+
+
+def test_link_search_by_name_short():
+    """Ensure that search terms too short for the full text index still match."""
+
+    db = Database(":memory:", create=True, verbose=True)
+
+    links = [
+        Link(name="numpy.ndarray", url="https://1"),
+        Link(name="Python", url="https://2"),
+    ]
+
+    Link.add(db, items=links)
+    results = Link.search(db, name="ND")
+
+    assert [l.url for l in results] == ["https://1"]
+
+
+def test_link_search_by_name_index_in_sync():
+    """Ensure that the full text index tracks changes made to links."""
+
+    db = Database(":memory:", create=True, verbose=True)
+    Link.add(db, items=[Link(name="Github", url="https://1")])
+
+    link = Link.get(db, 1)
+    link.name = "Gitlab"
+    db.commit()
+
+    assert Link.search(db, name="github") == []
+    assert Link.search(db, name="gitlab") == [link]
+
+    db.session.delete(link)
+    db.commit()
+
+    assert Link.search(db, name="gitlab") == []
+
+
+def test_database_create_backfills_index(workdir):
+    """Ensure that opening an existing database without a full text index creates and
+    populates it."""
+
+    filepath = str(pathlib.Path(workdir.name, "backfill.db"))
+
+    db = Database(filepath)
+    Link.__table__.create(bind=db.engine)
+    Source.__table__.create(bind=db.engine)
+    Link.add(db, items=[Link(name="Github", url="https://1")])
+    db.close()
+
+    db = Database(filepath, create=True)
+    assert db.fts
+
+    results = Link.search(db, name="git")
+    assert [l.url for l in results] == ["https://1"]
+
+
+def add_tagged_links(db):
+    """Add a few links with overlapping tags to the given database."""
+
+    session = db.session
+
+    function = Tag(name="function")
+    python = Tag(name="python")
+    c = Tag(name="c")
+
+    enumerate_ = Link(name="enumerate", url="https://docs.python.org/3/enumerate.html")
+    enumerate_.tags.extend([python, function])
+
+    malloc = Link(name="malloc", url="https://docs.c.org/c11/malloc.html")
+    malloc.tags.extend([c, function])
+
+    python_org = Link(name="Python", url="https://python.org")
+    python_org.tags.append(python)
+
+    github = Link(name="Github", url="https://github.com")
+
+    for item in [python, function, c, enumerate_, malloc, python_org, github]:
+        session.add(item)
+
+    db.commit()
+
+
+def test_link_search_by_tags_and():
+    """Ensure that by default links must have every given tag."""
+
+    db = Database(":memory:", create=True, verbose=True)
+    add_tagged_links(db)
+
+    links = Link.search(db, tags=["python", "function"])
+    assert [l.name for l in links] == ["enumerate"]
+
+    # Duplicates shouldn't affect the result
+    links = Link.search(db, tags=["python", "function", "python"])
+    assert [l.name for l in links] == ["enumerate"]
+
+    # Unknown tags can't be matched
+    assert Link.search(db, tags=["python", "unknown"]) == []
+
+
+def test_link_search_by_tags_or():
+    """Ensure that links can be required to have any of the given tags."""
+
+    db = Database(":memory:", create=True, verbose=True)
+    add_tagged_links(db)
+
+    links = Link.search(db, tags=["c", "python", "unknown"], tag_mode="or")
+    assert {l.name for l in links} == {"enumerate", "malloc", "Python"}
+
+    assert Link.search(db, tags=["unknown"], tag_mode="or") == []
+
+
+def test_link_search_exclude_tags():
+    """Ensure that links with any of the excluded tags are not returned."""
+
+    db = Database(":memory:", create=True, verbose=True)
+    add_tagged_links(db)
+
+    links = Link.search(db, exclude_tags=["function"])
+    assert {l.name for l in links} == {"Python", "Github"}
+
+    links = Link.search(db, tags=["python"], exclude_tags=["function", "unknown"])
+    assert [l.name for l in links] == ["Python"]
+
+    links = Link.search(db, exclude_tags=["unknown"])
+    assert len(links) == 4
+
+
+def test_link_search_invalid_tag_mode():
+    """Ensure that an invalid tag mode raises an error."""
+
+    db = Database(":memory:", create=True, verbose=True)
+
+    with py.test.raises(ValueError):
+        Link.search(db, tags=["python"], tag_mode="xor")
+
+
+def test_link_search_eager():
+    """Ensure that eagerly loaded search results can be rendered without issuing a
+    query per result."""
+
+    db = Database(":memory:", create=True)
+    Source.add(db, name="Python", prefix="https://docs.python.org/", uri="sphinx://")
+
+    for i in range(20):
+        link = Link(name=f"Link {i}", url=f"{i}.html", source_id=1)
+        link.tags.append(Tag(name=f"tag-{i}"))
+        Link.add(db, items=[link])
+
+    db.session.expunge_all()
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    links = Link.search(db, top=20, eager=True)
+
+    for link in links:
+        assert link.url_expanded.startswith("https://docs.python.org/")
+        assert len(link.tags) == 1
+
+    assert len(statements) == 2
+
+
+def test_link_search_records():
+    """Ensure that searching for records returns the same results as searching for
+    links."""
+
+    db = Database(":memory:", create=True, cache_size=0)
+    Source.add(db, name="Python", prefix="https://docs.python.org/", uri="sphinx://")
+    bulk_import(
+        db,
+        [
+            (f"link {i}", f"{i}.html", [f"tag-{i % 3}", "all"] if i % 4 else [])
+            for i in range(25)
+        ],
+        source_id=1,
+    )
+    Link.create(db, "https://github.com", name="Github", tags=["tag-1"])
+
+    for i in range(0, 25, 5):
+        Link.visit(db, i + 1, when=1000 + i)
+
+    searches = [
+        {},
+        {"sort": "visits"},
+        {"sort": "frecency", "tags": ["tag-1"]},
+        {"name": "link", "sort": "visits"},
+        {"name": "ink 1"},
+        {"name": "k"},
+        {"tags": ["tag-0", "tag-2"], "tag_mode": "or", "exclude_tags": ["tag-0"]},
+    ]
+
+    for args in searches:
+        expected = [link.record for link in Link.search(db, top=None, **args)]
+        assert len(expected) > 0
+
+        page = Link.search_records(db, top=4, **args)
+        results = list(page)
+
+        while page.cursor is not None:
+            page = Link.search_records(db, top=4, after=page.cursor, **args)
+            results.extend(page)
+
+        assert results == expected, args
+
+    # Fuzzy results come in a single page
+    expected = [link.record for link in Link.search(db, name="link 1w", fuzzy=True)]
+    assert len(expected) == 10
+    assert Link.search_records(db, name="link 1w", fuzzy=True) == expected
+
+
+def test_link_search_records_single_statement():
+    """Ensure that a page of records, with their sources and tags, is selected with
+    a single statement."""
+
+    db = Database(":memory:", create=True, cache_size=0)
+    Source.add(db, name="Python", prefix="https://docs.python.org/", uri="sphinx://")
+    links = [(f"link {i}", f"{i}.html", ["a", "b"]) for i in range(20)]
+    bulk_import(db, links, source_id=1)
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    links = Link.search_records(db, top=20)
+
+    assert len(links) == 20
+    assert all(link.url.startswith("https://docs.python.org/") for link in links)
+    assert all(link.source == "Python" for link in links)
+    assert all(sorted(link.tags) == ["a", "b"] for link in links)
+
+    assert len([s for s in statements if "FROM links" in s]) == 1
+
+
+def test_link_search_pages():
+    """Ensure that results can be fetched a page at a time."""
+
+    db = Database(":memory:", create=True)
+    Link.add(
+        db,
+        items=[
+            Link(name=f"link {i}", url=f"https://{i}", visits=i % 3) for i in range(25)
+        ],
+    )
+
+    for args in [{}, {"sort": "visits"}, {"name": "link", "sort": "visits"}]:
+        expected = Link.search(db, top=None, **args)
+        assert len(expected) == 25
+        assert expected.cursor is None
+
+        page = Link.search(db, top=10, **args)
+        results = list(page)
+
+        while page.cursor is not None:
+            page = Link.search(db, top=10, after=page.cursor, **args)
+            assert len(page) <= 10
+
+            results.extend(page)
+
+        assert results == expected
+
+
+def test_link_search_pages_exact():
+    """Ensure that there is no cursor when the last page is exactly full."""
+
+    db = Database(":memory:", create=True)
+    Link.add(db, items=[Link(name=f"link {i}", url=f"https://{i}") for i in range(4)])
+
+    page = Link.search(db, top=2)
+    assert page.cursor == (2,)
+
+    page = Link.search(db, top=2, after=page.cursor)
+    assert [link.id for link in page] == [3, 4]
+    assert page.cursor is None
+
+
+def test_link_search_pages_use_index():
+    """Ensure that fetching a later page seeks straight to it using an index."""
+
+    db = Database(":memory:", create=True)
+    bulk_import(db, [(f"link {i}", f"https://{i}", []) for i in range(100)])
+
+    page = Link.search(db, top=10, sort="visits")
+    statements = []
+
+    def record(conn, cursor, statement, parameters, *args):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    Link.search(db, top=10, sort="visits", after=page.cursor)
+    event.remove(db.engine, "before_cursor_execute", record)
+
+    conn = db.session.connection()
+
+    for statement, parameters in statements:
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+        details = " ".join(row[-1] for row in plan)
+
+        assert "USING INDEX ix_links_visits" in details
+        assert "TEMP B-TREE" not in details
+
+
+def test_link_search_pages_invalid_cursor():
+    """Ensure that a cursor from a different kind of search is rejected."""
+
+    db = Database(":memory:", create=True)
+
+    with py.test.raises(ValueError) as err:
+        Link.search(db, sort="visits", after=(1,))
+
+    assert "Invalid cursor" in str(err.value)
+
+
+def test_trigrams():
+    """Ensure that text is split into the same trigrams as the full text index."""
+
+    assert trigrams("NumPy") == {"num", "ump", "mpy"}
+    assert trigrams("abcab", ordered=True) == ["abc", "bca", "cab"]
+    assert trigrams("ab") == set()
+
+
+def test_link_search_fuzzy():
+    """Ensure that links can be found despite typos in the search term."""
+
+    db = Database(":memory:", create=True)
+    Link.add(
+        db,
+        items=[
+            Link(name="numpy.ndarray", url="https://1"),
+            Link(name="pandas.DataFrame", url="https://2"),
+            Link(name="pandas.DataFrame.to_csv", url="https://3", visits=5),
+            Link(name="numpy.array", url="https://4"),
+        ],
+    )
+
+    assert Link.search(db, name="ndarry") == []
+
+    results = Link.search(db, name="ndarry", fuzzy=True)
+    assert [link.id for link in results] == [1]
+    assert results.cursor is None
+
+    # The more visited link wins when both match equally well
+    results = Link.search(db, name="datafram", fuzzy=True)
+    assert [link.id for link in results] == [3, 2]
+
+    results = Link.search(db, name="DataFrme.to_cvs", fuzzy=True, top=1)
+    assert [link.id for link in results] == [3]
+
+    assert Link.search(db, name="zzzqqq", fuzzy=True) == []
+
+
+def test_link_search_fuzzy_filters():
+    """Ensure that fuzzy searches can be combined with other filters."""
+
+    db = Database(":memory:", create=True)
+    bulk_import(
+        db,
+        [
+            ("numpy.ndarray", "https://1", ["py", "class"]),
+            ("numpy.ndarray.sort", "https://2", ["py", "method"]),
+        ],
+    )
+
+    results = Link.search(db, name="ndarry", fuzzy=True, tags=["method"])
+    assert [link.id for link in results] == [2]
+
+    results = Link.search(db, name="ndarry", fuzzy=True, exclude_tags=["method"])
+    assert [link.id for link in results] == [1]
+
+
+def test_link_search_fuzzy_uses_index():
+    """Ensure that fuzzy searches find candidates through the full text index."""
+
+    db = Database(":memory:", create=True)
+    bulk_import(db, [(f"link {i}", f"https://{i}", []) for i in range(100)])
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, *args):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    Link.search(db, name="lnk 42", fuzzy=True)
+    event.remove(db.engine, "before_cursor_execute", record)
+
+    conn = db.session.connection()
+
+    for statement, parameters in statements:
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+        details = " ".join(row[-1] for row in plan)
+
+        assert "SCAN links " not in details + " "
+
+
+def test_bulk_insert():
+    """Ensure that rows can be inserted in bulk and their ids are returned."""
+
+    db = Database(":memory:", create=True, verbose=True)
+    Tag.add(db, name="existing")
+
+    rows = [(f"Tag #{i}",) for i in range(5)]
+    ids = bulk_insert(db, Tag.__table__, rows, batch_size=2)
+    db.commit()
+
+    assert ids == [2, 3, 4, 5, 6]
+    assert [t.name for t in Tag.search(db)] == ["existing"] + [r[0] for r in rows]
+
+
+def test_bulk_insert_concurrent(workdir):
+    """Ensure that another writer can't take the ids reserved for the rows."""
+
+    filepath = str(pathlib.Path(workdir.name, "bulk-insert.db"))
+    db = Database(filepath, create=True)
+    blocked = []
+
+    def rows():
+
+        # Try to add a tag once the ids have been reserved.
+        other = sqlite3.connect(filepath, timeout=0)
+
+        try:
+            other.execute("INSERT INTO tags (name) VALUES ('other')")
+            other.commit()
+        except sqlite3.OperationalError as err:
+            blocked.append(str(err))
+        finally:
+            other.close()
+
+        yield from [(f"Tag #{i}",) for i in range(5)]
+
+    ids = bulk_insert(db, Tag.__table__, rows())
+    db.commit()
+
+    assert ids == [1, 2, 3, 4, 5]
+    assert blocked == ["database is locked"]
+
+
+def test_bulk_import():
+    """Ensure that links can be imported in bulk along with their source and tags."""
+
+    db = Database(":memory:", create=True, verbose=True)
+    Tag.add(db, name="python")
+
+    links = [
+        ("enumerate", "enumerate.html", ["python", "function"]),
+        ("list", "list.html", ["python", "class"]),
+        ("print", "print.html", ["python", "function", "function"]),
+    ]
+
+    source = {"name": "Python", "prefix": "https://docs.python.org/", "uri": "x://"}
+    ids = bulk_import(db, links, source=source, batch_size=2)
+
+    assert ids == [1, 2, 3]
+
+    source = Source.get(db, 1)
+    assert source.name == "Python"
+    assert [l.name for l in source.links] == ["enumerate", "list", "print"]
+
+    link = Link.get(db, 3)
+    assert link.visits == 0
+    assert link.url_expanded == "https://docs.python.org/print.html"
+    assert {t.name for t in link.tags} == {"python", "function"}
+
+    assert {t.name for t in Tag.search(db)} == {"python", "function", "class"}
+    assert len(Link.search(db, tags=["function"])) == 2
+    assert Link.search(db, name="enumerate") == [Link.get(db, 1)]
+
+
+def test_tag_resolver():
+    """Ensure that the tag resolver looks up and creates tags with a constant number of
+    queries, caching the results."""
+
+    db = Database(":memory:", create=True)
+    Tag.add(db, items=[{"name": "python"}, {"name": "docs"}])
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    resolver = db.tag_resolver
+
+    ids = resolver.resolve(["python", "docs", "function", "class"])
+    db.commit()
+
+    assert ids == {"python": 1, "docs": 2, "class": 3, "function": 4}
+    assert len([s for s in statements if "tags" in s]) == 3
+
+    statements.clear()
+    assert resolver.resolve(["docs", "class"]) == {"docs": 2, "class": 3}
+    assert statements == []
+
+    assert resolver.resolve(["method"], create=False) == {}
+    assert Tag.get(db, name="method") is None
+
+
+def test_tag_resolver_rollback():
+    """Ensure that the tag resolver forgets tags created in a rolled back
+    transaction."""
+
+    db = Database(":memory:", create=True)
+    resolver = db.tag_resolver
+
+    assert resolver.resolve(["python"]) == {"python": 1}
+    db.session.rollback()
+
+    assert resolver.resolve(["python"], create=False) == {}
+
+
+def test_database_interrupt(workdir):
+    """Ensure that a running query can be interrupted from another thread."""
+
+    filepath = str(pathlib.Path(workdir.name, "interrupt.db"))
+    db = Database(filepath, create=True)
+
+    query = """
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)
+    SELECT count(*) FROM n
+    """
+    errors = []
+
+    def run():
+        try:
+            db.session.connection().exec_driver_sql(query).scalar()
+        except OperationalError as err:
+            errors.append(err)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+
+    while thread.is_alive() and not errors:
+        db.interrupt()
+        thread.join(0.05)
+
+    assert len(errors) == 1
+    assert "interrupted" in str(errors[0])
+
+
+def test_link_create():
+    """Ensure that a link can be created along with its tags."""
+
+    db = Database(":memory:", create=True)
+    Tag.add(db, name="code")
+
+    link_id = Link.create(db, "https://github.com", name="Github", tags=["code", "git"])
+    link = Link.get(db, link_id)
+
+    assert link.name == "Github"
+    assert link.tags == [Tag(id=1, name="code"), Tag(id=2, name="git")]
+
+    link_id = Link.create(db, "https://example.com", name="Example")
+    assert Link.get(db, link_id).tags == []
+
+
+def test_sync_links():
+    """Ensure that syncing a source's links only applies the differences."""
+
+    db = Database(":memory:", create=True)
+    source = {"name": "Python", "prefix": "https://docs.python.org/", "uri": "x://"}
+
+    bulk_import(
+        db,
+        [
+            ("print", "builtins.html#print", ["py", "function"]),
+            ("list", "builtins.html#list", ["py", "class"]),
+            ("Tutorial", "tutorial.html", ["std", "doc"]),
+        ],
+        source=source,
+    )
+
+    Link.get(db, 1).visits = 5
+    Link.get(db, 2).visits = 3
+    db.commit()
+
+    result = sync_links(
+        db,
+        1,
+        [
+            ("print", "builtins.html#print", ["py", "function"]),
+            ("List", "builtins.html#list", ["py", "class", "builtin"]),
+            ("enumerate", "builtins.html#enumerate", ["py", "function"]),
+        ],
+    )
+
+    assert result == SyncResult(added=1, removed=1, updated=1, unchanged=1)
+
+    links = Link.search(db, source=Source.get(db, 1))
+    assert [(l.id, l.name, l.visits) for l in links] == [
+        (1, "print", 5),
+        (2, "List", 3),
+        (3, "enumerate", 0),
+    ]
+
+    assert {t.name for t in links[1].tags} == {"py", "class", "builtin"}
+    assert Link.search(db, tags=["doc"]) == []
+    assert Link.search(db, name="tutorial") == []
+
+
+def test_sync_links_removes_visits():
+    """Ensure that the visits to removed links are removed along with them."""
+
+    db = Database(":memory:", create=True)
+    source = {"name": "Python", "prefix": "https://docs.python.org/", "uri": "x://"}
+
+    bulk_import(db, [("print", "print", []), ("list", "list", [])], source=source)
+    Link.visit(db, 2)
+
+    sync_links(db, 1, [("print", "print", []), ("dict", "dict", [])])
+    db.commit()
+
+    assert db.session.query(Visit).count() == 0
+    assert [(l.name, l.frecency) for l in Link.search(db, sort="frecency")] == [
+        ("print", 0),
+        ("dict", 0),
+    ]
+
+
+def test_sync_links_duplicate_urls():
+    """Ensure that links sharing a url are matched up in order."""
+
+    db = Database(":memory:", create=True)
+    links = [
+        ("numpy", "reference/index.html", ["py", "module"]),
+        ("NumPy Reference", "reference/index.html", ["std", "label"]),
+    ]
+
+    bulk_import(db, links, source={"name": "Numpy", "uri": "x://"})
+    result = sync_links(db, 1, links)
+
+    assert result == SyncResult(added=0, removed=0, updated=0, unchanged=2)
+
+    result = sync_links(db, 1, links[:1])
+    assert result == SyncResult(added=0, removed=1, updated=0, unchanged=1)
+
+
+def test_database_profiles(workdir):
+    """Ensure that a profile's pragmas are applied to each connection."""
+
+    filepath = str(pathlib.Path(workdir.name, "profiles.db"))
+
+    def pragma(db, name):
+        with db.engine.connect() as conn:
+            return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+    db = Database(filepath, create=True, db_profile="interactive")
+    Link.add(db, name="Github", url="https://github.com")
+
+    assert pragma(db, "journal_mode") == "wal"
+    assert pragma(db, "synchronous") == 1
+    assert pragma(db, "temp_store") == 2
+    db.close()
+
+    db = Database(filepath, create=True, db_profile="bulk-import")
+
+    assert pragma(db, "synchronous") == 0
+    assert pragma(db, "cache_size") == -256 * 1024
+    db.close()
+
+    db = Database(filepath, db_profile="read-only")
+
+    assert db.version == len(MIGRATIONS)
+    assert [l.name for l in Link.search(db)] == ["Github"]
+
+    with py.test.raises(OperationalError) as err:
+        Link.add(db, name="Google", url="https://google.com")
+
+    assert "readonly" in str(err.value)
+
+
+def test_database_profile_invalid():
+    """Ensure that unknown or unsuitable profiles are rejected."""
+
+    with py.test.raises(ValueError):
+        Database(":memory:", db_profile="fast")
+
+    with py.test.raises(ValueError):
+        Database(":memory:", create=True, db_profile="read-only")
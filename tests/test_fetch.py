@@ -0,0 +1,191 @@
+import http.server
+import pathlib
+import threading
+import unittest.mock as mock
+
+import py.test
+import sphobjinv as soi
+
+from llyfrau.data import Database, Link, Source
+from llyfrau.fetch import HttpCache
+from llyfrau.importers import sphinx
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    """Serves a single resource, supporting conditional requests using its etag."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+
+        if self.path != "/docs/objects.inv":
+            self.send_error(404)
+            return
+
+        if self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(len(server.content)))
+        self.end_headers()
+        self.wfile.write(server.content)
+
+    def log_message(self, *args):
+        pass
+
+
+@py.test.fixture
+def server():
+
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests = []
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield httpd
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def publish(server, version, names):
+    """Publish a new version of the inventory."""
+
+    inv = soi.Inventory()
+    inv.project = "Example"
+    inv.version = version
+
+    for name in names:
+        inv.objects.append(
+            soi.DataObjStr(
+                name=name,
+                domain="py",
+                priority="1",
+                role="function",
+                uri="api.html#$",
+                dispname="-",
+            )
+        )
+
+    server.content = soi.compress(inv.data_file(contract=True))
+    server.etag = f'"{version}"'
+
+
+def test_http_cache(server, workdir):
+    """Ensure that the cache makes conditional requests for cached resources."""
+
+    cache = HttpCache(pathlib.Path(workdir.name, "http-cache-get"))
+    publish(server, "1.0", ["foo"])
+    url = f"{server.url}/docs/objects.inv"
+
+    response = cache.get(url)
+    assert response.modified
+
+    with response.open() as f:
+        assert f.read() == server.content
+
+    response = cache.get(url)
+    assert not response.modified
+    assert server.requests[-1]["If-None-Match"] == '"1.0"'
+
+    with response.open() as f:
+        assert f.read() == server.content
+
+    publish(server, "1.1", ["foo", "bar"])
+    response = cache.get(url)
+
+    assert response.modified
+
+    with response.open() as f:
+        assert f.read() == server.content
+
+
+def test_sphinx_import_unchanged(server, workdir):
+    """Ensure that re-importing a source that hasn't changed is skipped."""
+
+    filepath = str(pathlib.Path(workdir.name, "sphinx-cached.db"))
+    cache = HttpCache(pathlib.Path(workdir.name, "http-cache-import"))
+    uri = f"{server.url}/docs/"
+
+    publish(server, "1.0", ["foo", "bar"])
+    assert sphinx(filepath, uri, cache=cache) == 0
+
+    with mock.patch("llyfrau.importers.sync_links") as m_sync:
+        assert sphinx(filepath, uri, cache=cache) == 0
+
+    m_sync.assert_not_called()
+
+    publish(server, "1.1", ["foo", "baz"])
+    assert sphinx(filepath, uri, cache=cache) == 0
+
+    db = Database(filepath)
+    sources = Source.search(db)
+
+    assert [s.name for s in sources] == ["Example v1.1 Documentation"]
+    assert [l.name for l in Link.search(db)] == ["foo", "baz"]
+
+
+def test_sphinx_import_cached_new_database(server, workdir):
+    """Ensure that a cached copy is used when importing into a new database."""
+
+    cache = HttpCache(pathlib.Path(workdir.name, "http-cache-new"))
+    uri = f"{server.url}/docs/"
+
+    publish(server, "1.0", ["foo"])
+    first = str(pathlib.Path(workdir.name, "sphinx-cached-1.db"))
+    second = str(pathlib.Path(workdir.name, "sphinx-cached-2.db"))
+
+    assert sphinx(first, uri, cache=cache) == 0
+    assert sphinx(second, uri, cache=cache) == 0
+
+    db = Database(second)
+    assert [l.name for l in Link.search(db)] == ["foo"]
+
+
+def test_sphinx_import_cache_shared(server, workdir):
+    """Ensure that a source is only skipped if the database has imported the version
+    in the cache, which may have been fetched for another database."""
+
+    cache = HttpCache(pathlib.Path(workdir.name, "http-cache-shared"))
+    uri = f"{server.url}/docs/"
+
+    first = str(pathlib.Path(workdir.name, "sphinx-shared-1.db"))
+    second = str(pathlib.Path(workdir.name, "sphinx-shared-2.db"))
+
+    publish(server, "1.0", ["foo"])
+    assert sphinx(first, uri, cache=cache) == 0
+
+    publish(server, "1.1", ["foo", "bar"])
+    assert sphinx(second, uri, cache=cache) == 0
+    assert sphinx(first, uri, cache=cache) == 0
+
+    db = Database(first)
+    assert [s.name for s in Source.search(db)] == ["Example v1.1 Documentation"]
+    assert [l.name for l in Link.search(db)] == ["foo", "bar"]
+
+
+def test_sphinx_import_failed_not_skipped(server, workdir):
+    """Ensure that a source isn't skipped if the last attempt to import it failed
+    after it was downloaded."""
+
+    filepath = str(pathlib.Path(workdir.name, "sphinx-failed.db"))
+    cache = HttpCache(pathlib.Path(workdir.name, "http-cache-failed"))
+    uri = f"{server.url}/docs/"
+
+    publish(server, "1.0", ["foo", "bar"])
+    assert sphinx(filepath, uri, cache=cache) == 0
+
+    publish(server, "1.1", ["foo", "baz"])
+
+    with mock.patch("llyfrau.importers._read_entries", side_effect=RuntimeError):
+        assert sphinx(filepath, uri, cache=cache) == 1
+
+    assert sphinx(filepath, uri, cache=cache) == 0
+
+    db = Database(filepath)
+    assert [l.name for l in Link.search(db)] == ["foo", "baz"]
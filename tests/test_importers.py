@@ -1,10 +1,18 @@
+import io
+import py.test
 import pathlib
 import unittest.mock as mock
 
 import sphobjinv as soi
 
-from llyfrau.data import Database, Source, Link
-from llyfrau.importers import sphinx
+from llyfrau.data import Database, Source, Link, Tag, bulk_import
+from llyfrau.importers import Collection, _parse_entry, read_inventory, sphinx
+from llyfrau.stats import counts
+
+
+def as_stream(inv):
+    """Return the given inventory as it would be served by a sphinx site."""
+    return io.BytesIO(soi.compress(inv.data_file(contract=True)))
 
 
 def test_sphinx_import_complete_url(workdir):
@@ -28,10 +36,10 @@ def test_sphinx_import_complete_url(workdir):
         )
     )
 
-    with mock.patch("llyfrau.importers.soi.Inventory", return_value=inv) as m_inv:
+    with mock.patch("llyfrau.importers.urlopen", return_value=as_stream(inv)) as m_open:
         sphinx(filepath, "https://docs.python.org/3/objects.inv")
 
-    m_inv.assert_called_with(url="https://docs.python.org/3/objects.inv")
+    m_open.assert_called_with("https://docs.python.org/3/objects.inv")
 
 
 def test_sphinx_import_folder_url(workdir):
@@ -54,10 +62,10 @@ def test_sphinx_import_folder_url(workdir):
         )
     )
 
-    with mock.patch("llyfrau.importers.soi.Inventory", return_value=inv) as m_inv:
+    with mock.patch("llyfrau.importers.urlopen", return_value=as_stream(inv)) as m_open:
         sphinx(filepath, "https://docs.python.org/2/")
 
-    m_inv.assert_called_with(url="https://docs.python.org/2/objects.inv")
+    m_open.assert_called_with("https://docs.python.org/2/objects.inv")
 
 
 def test_sphinx_import_word_url(workdir):
@@ -80,10 +88,10 @@ def test_sphinx_import_word_url(workdir):
         )
     )
 
-    with mock.patch("llyfrau.importers.soi.Inventory", return_value=inv) as m_inv:
+    with mock.patch("llyfrau.importers.urlopen", return_value=as_stream(inv)) as m_open:
         sphinx(filepath, "https://docs.python.org/1")
 
-    m_inv.assert_called_with(url="https://docs.python.org/1/objects.inv")
+    m_open.assert_called_with("https://docs.python.org/1/objects.inv")
 
 
 def test_sphinx_import(workdir):
@@ -115,10 +123,10 @@ def test_sphinx_import(workdir):
         )
     )
 
-    with mock.patch("llyfrau.importers.soi.Inventory", return_value=inv) as m_inv:
+    with mock.patch("llyfrau.importers.urlopen", return_value=as_stream(inv)) as m_open:
         sphinx(filepath, "https://docs.python.org/")
 
-    m_inv.assert_called_with(url="https://docs.python.org/objects.inv")
+    m_open.assert_called_with("https://docs.python.org/objects.inv")
 
     db = Database(filepath)
 
@@ -135,3 +143,303 @@ def test_sphinx_import(workdir):
     assert links[1].name == "Enumeration"
     assert links[1].url == "concepts.html#enumeration"
     assert {t.name for t in links[1].tags} == {"sphinx", "py", "label"}
+
+
+def test_collection_bulk():
+    """Ensure that a collection can collect links as plain tuples."""
+
+    collection = Collection(None, "sphinx", bulk=True)
+    collection.add_link(name="print", url="builtins.html#print", tags=["py"])
+
+    assert collection.links == [("print", "builtins.html#print", ["py", "sphinx"])]
+
+
+def test_read_inventory():
+    """Ensure that an inventory can be read incrementally."""
+
+    inv = soi.Inventory()
+    inv.project = "Python"
+    inv.version = "3.8"
+
+    for i in range(1000):
+        inv.objects.append(
+            soi.DataObjStr(
+                name=f"func{i}",
+                domain="py",
+                priority="1",
+                role="function",
+                uri="builtins.html#$",
+                dispname="-",
+            )
+        )
+
+    inv.objects.append(
+        soi.DataObjStr(
+            name="an example",
+            domain="std",
+            priority="-1",
+            role="label",
+            uri="example.html#an-example",
+            dispname="An Example",
+        )
+    )
+
+    with mock.patch("llyfrau.importers.READ_SIZE", 16):
+        project, version, entries = read_inventory(as_stream(inv))
+        entries = list(entries)
+
+    assert project == "Python"
+    assert version == "3.8"
+
+    assert len(entries) == 1001
+    assert entries[0] == ("func0", "py", "function", "builtins.html#$", "-")
+    assert entries[-1] == (
+        "an example",
+        "std",
+        "label",
+        "example.html#an-example",
+        "An Example",
+    )
+
+
+def test_read_inventory_unsupported():
+    """Ensure that an error is raised for inventories that aren't version 2."""
+
+    stream = io.BytesIO(b"# Sphinx inventory version 1\n# Project: P\n# Version: 1\n")
+
+    with py.test.raises(ValueError):
+        read_inventory(stream)
+
+
+def test_sphinx_import_fallback(workdir):
+    """Ensure that inventories that can't be streamed are imported with sphobjinv"""
+
+    filepath = str(pathlib.Path(workdir.name, "sphinx-v1.db"))
+
+    inv = soi.Inventory()
+    inv.project = "Old"
+    inv.version = "0.1"
+    inv.objects.append(
+        soi.DataObjStr(
+            name="old",
+            domain="py",
+            priority="1",
+            role="function",
+            uri="old.html#$",
+            dispname="-",
+        )
+    )
+
+    stream = io.BytesIO(b"# Sphinx inventory version 1\n# Project: Old\n")
+
+    with mock.patch("llyfrau.importers.urlopen", return_value=stream), mock.patch(
+        "sphobjinv.Inventory", return_value=inv
+    ) as m_inv:
+        sphinx(filepath, "https://old.org/")
+
+    m_inv.assert_called_with(url="https://old.org/objects.inv")
+
+    db = Database(filepath)
+    source = Source.search(db, name="Old")[0]
+
+    assert [l.url for l in Link.search(db, source=source)] == ["old.html#old"]
+
+
+def test_sphinx_import_chunks(workdir):
+    """Ensure that large inventories are written to the database in chunks."""
+
+    filepath = str(pathlib.Path(workdir.name, "sphinx-chunks.db"))
+
+    inv = soi.Inventory()
+    inv.project = "Big"
+    inv.version = "1.0"
+
+    for i in range(25):
+        inv.objects.append(
+            soi.DataObjStr(
+                name=f"func{i}",
+                domain="py",
+                priority="1",
+                role="function",
+                uri="api.html#$",
+                dispname="-",
+            )
+        )
+
+    recount = mock.patch.object(
+        Database, "recount", autospec=True, side_effect=Database.recount
+    )
+
+    with mock.patch("llyfrau.importers.urlopen", return_value=as_stream(inv)):
+        with mock.patch("llyfrau.importers.BATCH_SIZE", 10), mock.patch(
+            "llyfrau.importers.bulk_import", wraps=bulk_import
+        ) as m_import, recount as m_recount:
+            sphinx(filepath, "https://big.org/")
+
+    assert m_import.call_count == 3
+
+    # The links are only counted once the last chunk has been written.
+    assert m_recount.call_count == 1
+
+    db = Database(filepath)
+    source = Source.search(db, name="Big")[0]
+    links = Link.search(db, source=source, top=30)
+
+    assert [l.name for l in links] == [f"func{i}" for i in range(25)]
+
+    conn = db.session.connection()
+    tag_ids = [t.id for t in Tag.search(db, name="sphinx")]
+
+    assert counts(conn, "source", [source.id]) == {source.id: 25}
+    assert counts(conn, "tag", tag_ids) == {tag_ids[0]: 25}
+
+
+def test_sphinx_import_chunks_failed(workdir):
+    """Ensure that a new source isn't left half imported if it fails part way
+    through."""
+
+    filepath = str(pathlib.Path(workdir.name, "sphinx-chunks-failed.db"))
+
+    inv = soi.Inventory()
+    inv.project = "Big"
+    inv.version = "1.0"
+
+    for i in range(25):
+        inv.objects.append(
+            soi.DataObjStr(
+                name=f"func{i}",
+                domain="py",
+                priority="1",
+                role="function",
+                uri="api.html#$",
+                dispname="-",
+            )
+        )
+
+    entries = []
+
+    def parse_entry(line):
+
+        # Fail part way through, after a few chunks have been written.
+        if len(entries) == 15:
+            raise OSError("Connection reset")
+
+        entries.append(line)
+        return _parse_entry(line)
+
+    with mock.patch("llyfrau.importers.urlopen", return_value=as_stream(inv)):
+        with mock.patch("llyfrau.importers.BATCH_SIZE", 10), mock.patch(
+            "llyfrau.importers._parse_entry", side_effect=parse_entry
+        ), mock.patch("llyfrau.importers.bulk_import", wraps=bulk_import) as m_import:
+            assert sphinx(filepath, "https://big.org/") == 1
+
+    assert m_import.call_count > 0
+
+    db = Database(filepath)
+    assert Source.search(db) == []
+    assert Link.search(db, top=None) == []
+    assert db.session.query(Tag).filter(Tag.links.any()).count() == 0
+
+
+def test_sphinx_reimport(workdir):
+    """Ensure that importing a source a second time updates it in place."""
+
+    filepath = str(pathlib.Path(workdir.name, "sphinx-reimport.db"))
+
+    def make_inventory(version, names):
+        inv = soi.Inventory()
+        inv.project = "Python"
+        inv.version = version
+
+        for name in names:
+            inv.objects.append(
+                soi.DataObjStr(
+                    name=name,
+                    domain="py",
+                    priority="1",
+                    role="function",
+                    uri="builtins.html#$",
+                    dispname="-",
+                )
+            )
+
+        return as_stream(inv)
+
+    inv = make_inventory("3.8", ["print", "len"])
+
+    with mock.patch("llyfrau.importers.urlopen", return_value=inv):
+        sphinx(filepath, "https://docs.python.org/3/")
+
+    db = Database(filepath)
+    Link.search(db, name="print")[0].visits = 4
+    db.commit()
+    db.close()
+
+    inv = make_inventory("3.9", ["print", "enumerate"])
+
+    with mock.patch("llyfrau.importers.urlopen", return_value=inv):
+        sphinx(filepath, "https://docs.python.org/3/")
+
+    db = Database(filepath)
+    sources = Source.search(db, name="Python v3")
+
+    assert [s.name for s in sources] == ["Python v3.9 Documentation"]
+
+    links = Link.search(db, source=sources[0])
+    assert [(l.name, l.visits) for l in links] == [("print", 4), ("enumerate", 0)]
+
+
+def test_sphinx_import_many(workdir):
+    """Ensure that many uris can be imported at once, each only once, and that a
+    failure importing one of them doesn't prevent the others from being imported."""
+
+    filepath = str(pathlib.Path(workdir.name, "sphinx-many.db"))
+    uris = pathlib.Path(workdir.name, "uris.txt")
+    uris.write_text(
+        "# Documentation sites\nhttps://c.org/\n\nhttps://broken.org/\nhttps://a.org/\n"
+    )
+
+    def make_inventory(project):
+        inv = soi.Inventory()
+        inv.project = project
+        inv.version = "1.0"
+        inv.objects.append(
+            soi.DataObjStr(
+                name=f"{project}.func",
+                domain="py",
+                priority="1",
+                role="function",
+                uri="api.html#$",
+                dispname="-",
+            )
+        )
+
+        return as_stream(inv)
+
+    def fetch(url):
+
+        if "broken" in url:
+            raise OSError("Connection refused")
+
+        project = url.split("/")[2].split(".")[0]
+        return make_inventory(project)
+
+    with mock.patch("llyfrau.importers.urlopen", side_effect=fetch):
+        status = sphinx(
+            filepath, ["https://a.org/", "https://b.org/"], input_file=str(uris), jobs=2
+        )
+
+    assert status == 1
+
+    db = Database(filepath)
+    sources = Source.search(db)
+
+    assert len(sources) == 3
+    assert {s.uri for s in sources} == {
+        "sphinx://https://a.org/",
+        "sphinx://https://b.org/",
+        "sphinx://https://c.org/",
+    }
+
+    names = {l.name for l in Link.search(db, tags=["sphinx"])}
+    assert names == {"a.func", "b.func", "c.func"}
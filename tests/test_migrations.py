@@ -0,0 +1,165 @@
+import pathlib
+import sqlite3
+import unittest.mock as mock
+
+from llyfrau import migrations
+from llyfrau.data import Database, Link, Tag
+from llyfrau.migrations import MIGRATIONS
+
+
+def create_v0(filepath):
+    """Create a database using the schema from before migrations were introduced."""
+
+    conn = sqlite3.connect(filepath)
+    conn.executescript(
+        """
+        CREATE TABLE sources (
+            id INTEGER PRIMARY KEY, name TEXT NOT NULL, prefix TEXT, uri TEXT NOT NULL
+        );
+        CREATE TABLE links (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            url TEXT NOT NULL,
+            visits INTEGER,
+            source_id INTEGER REFERENCES sources (id)
+        );
+        CREATE TABLE tags (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+        CREATE TABLE tag_associations (
+            link_id INTEGER REFERENCES links (id), tag_id INTEGER REFERENCES tags (id)
+        );
+
+        INSERT INTO links (name, url, visits) VALUES ('Github', 'https://1', 2);
+        INSERT INTO tags (name) VALUES ('code');
+        INSERT INTO tag_associations VALUES (1, 1);
+        INSERT INTO tag_associations VALUES (1, 1);
+        """
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_migrate_new_database():
+    """Ensure that a newly created database is at the latest version."""
+
+    db = Database(":memory:", create=True)
+    assert db.version == len(MIGRATIONS)
+
+    with db.engine.connect() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+    assert version == len(MIGRATIONS)
+
+
+def test_migrate_existing_database(workdir):
+    """Ensure that an existing database is upgraded when it is opened."""
+
+    filepath = str(pathlib.Path(workdir.name, "v0.db"))
+    create_v0(filepath)
+
+    db = Database(filepath)
+    assert db.version == len(MIGRATIONS)
+    assert db.fts
+    assert db.generation == 0
+    assert db.tag_bitmaps
+    assert db.link_counts
+
+    link = Link.get(db, 1)
+    assert link.tags == [Tag(id=1, name="code")]
+    assert Link.search(db, name="github") == [link]
+    db.close()
+
+    conn = sqlite3.connect(filepath)
+    schema = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'tag_associations'"
+    ).fetchone()[0]
+    indexes = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    }
+
+    assert "WITHOUT ROWID" in schema
+    assert {"ix_links_visits", "ix_links_source_id", "ix_tag_associations_tag_id"} <= (
+        indexes
+    )
+    assert conn.execute("SELECT count(*) FROM tag_associations").fetchone()[0] == 1
+
+    # Existing visits are carried over to the visit log
+    assert conn.execute("SELECT count(*) FROM visit_log").fetchone()[0] == 2
+    assert conn.execute("SELECT frecency FROM links").fetchone()[0] > 0
+
+
+def test_migrate_is_idempotent(workdir):
+    """Ensure that re-opening a migrated database leaves it unchanged."""
+
+    filepath = str(pathlib.Path(workdir.name, "v0-reopen.db"))
+    create_v0(filepath)
+
+    Database(filepath).close()
+    db = Database(filepath, create=True)
+
+    assert db.version == len(MIGRATIONS)
+    assert Link.get(db, 1).visits == 2
+
+
+def test_migrate_full_text_index_retried(workdir):
+    """Ensure that the full text index is created once SQLite supports it, if it was
+    skipped when the database was migrated."""
+
+    filepath = str(pathlib.Path(workdir.name, "no-fts.db"))
+
+    def unavailable(conn):
+        pass
+
+    with mock.patch.object(
+        migrations, "MIGRATIONS", [unavailable, *MIGRATIONS[1:]]
+    ), mock.patch.object(migrations, "full_text_index", unavailable):
+        db = Database(filepath, create=True)
+
+    assert not db.fts
+    db.close()
+
+    # It isn't retried with the same version of SQLite.
+    with mock.patch("llyfrau.migrations.full_text_index") as m_index:
+        db = Database(filepath)
+
+    m_index.assert_not_called()
+    assert not db.fts
+    Link.add(db, name="Github", url="https://github.com")
+    db.close()
+
+    conn = sqlite3.connect(filepath)
+    conn.execute(
+        "UPDATE meta SET value = '3.0.0' WHERE key = 'full_text_index_skipped'"
+    )
+    conn.commit()
+    conn.close()
+
+    db = Database(filepath)
+    assert db.fts
+    assert db.version == len(MIGRATIONS)
+    assert [link.name for link in Link.search(db, name="github")] == ["Github"]
+
+
+def test_migrate_missing_tables(workdir):
+    """Ensure that opening an empty database without creating it does nothing."""
+
+    filepath = str(pathlib.Path(workdir.name, "empty.db"))
+    db = Database(filepath)
+
+    assert db.version == 0
+    assert not db.fts
+
+
+def test_sort_by_visits_uses_index():
+    """Ensure that sorting by visits doesn't need a temporary b-tree."""
+
+    db = Database(":memory:", create=True)
+
+    with db.engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT id FROM links ORDER BY visits DESC LIMIT 10"
+        ).fetchall()
+
+    details = " ".join(row[-1] for row in plan)
+    assert "ix_links_visits" in details
+    assert "TEMP B-TREE" not in details
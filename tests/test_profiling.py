@@ -0,0 +1,112 @@
+import json
+import pathlib
+
+from llyfrau.data import Database, Link
+from llyfrau.profiling import QueryProfiler, default_profiler, normalize
+
+
+def create_database(profile):
+    """Create a database with a few tagged links."""
+
+    db = Database(":memory:", create=True, profile=profile)
+
+    for i in range(10):
+        Link.create(db, f"https://{i}.com", name=f"Link {i}", tags=["a", f"t{i}"])
+
+    return db
+
+
+def test_normalize():
+    """Ensure that statements are collapsed onto a single line."""
+
+    assert normalize("\n  SELECT *\n    FROM links\n") == "SELECT * FROM links"
+
+
+def test_profiler_records_statements():
+    """Ensure that the profiler records calls, times and the rows fetched."""
+
+    profiler = QueryProfiler()
+    db = create_database(profiler)
+    profiler.reset()
+
+    Link.search(db, top=5)
+    Link.search(db, top=5)
+    db.session.rollback()
+
+    (stats,) = [s for s in profiler.stats.values() if "FROM links" in s.statement]
+
+    assert stats.calls == 2
+    assert stats.time > 0
+
+    # One more than the page size is fetched, to tell if there's another page.
+    assert stats.rows == 12
+
+
+def test_profiler_flags_repeated_statements():
+    """Ensure that lazily loading each link's tags is flagged as repeated."""
+
+    profiler = QueryProfiler()
+    db = create_database(profiler)
+    profiler.reset()
+
+    for link in Link.search(db, top=10):
+        link.tags
+
+    db.session.rollback()
+
+    assert len(profiler.repeated) == 1
+
+    (statement,) = profiler.repeated
+    assert "tag_associations" in statement
+    assert profiler.repeated[statement] == 10
+
+    assert "possible N+1" in profiler.report()
+
+
+def test_profiler_eager_search_not_repeated():
+    """Ensure that loading the tags up front is not flagged."""
+
+    profiler = QueryProfiler()
+    db = create_database(profiler)
+    profiler.reset()
+
+    for link in Link.search(db, top=10, eager=True):
+        link.tags
+
+    db.session.rollback()
+
+    assert profiler.repeated == {}
+
+
+def test_profiler_dump(workdir):
+    """Ensure that the profile can be written to disk as JSON."""
+
+    profiler = QueryProfiler()
+    db = create_database(profiler)
+
+    for link in Link.search(db, top=10):
+        link.tags
+
+    db.session.rollback()
+
+    path = pathlib.Path(workdir.name, "profile.json")
+    profiler.dump(path)
+
+    data = json.loads(path.read_text())
+    statements = {s["statement"]: s for s in data["statements"]}
+
+    assert len(data["repeated"]) == 1
+
+    repeated = data["repeated"][0]
+    assert repeated["count"] == 10
+    assert statements[repeated["statement"]]["calls"] >= 10
+
+
+def test_database_profile_default():
+    """Ensure that passing :code:`profile=True` uses the default profiler."""
+
+    db = Database(":memory:", create=True, profile=True)
+    assert db.profiler is default_profiler()
+
+    db = Database(":memory:", create=True)
+    assert db.profiler is None
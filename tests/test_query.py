@@ -0,0 +1,233 @@
+import unittest.mock as mock
+
+import py.test
+from sqlalchemy import select
+
+from llyfrau.data import Database, Link, Source, bulk_import, sync_links
+from llyfrau.query import Term, compile_query, parse, simple_search
+from llyfrau.stats import update
+
+
+@py.test.fixture
+def small_bitmaps():
+    """Give tags bitmaps even in the small databases used by the tests."""
+
+    with mock.patch("llyfrau.bitmaps.BITMAP_MIN_LINKS", 5):
+        yield
+
+
+def create_database():
+    """Create a database with a few sources, where some tags are much more common
+    than others."""
+
+    db = Database(":memory:", create=True, cache_size=0)
+    Source.add(db, name="Python Docs", uri="x://", prefix="https://docs.python.org/")
+    Source.add(db, name="NumPy", uri="y://", prefix="https://numpy.org/doc/")
+
+    for source_id in [1, 2, None]:
+        links = []
+
+        for i in range(100):
+            tags = ["common"]
+
+            if i % 2 == 0:
+                tags.append("even")
+
+            if i % 50 == 0:
+                tags.append("rare")
+
+            name = f"{'array' if i % 3 == 0 else 'list'} {source_id} {i}"
+            links.append((name, f"page/{i}.html", tags))
+
+        bulk_import(db, links, source_id=source_id)
+
+    for i in range(1, 300, 7):
+        for _ in range(i % 4):
+            Link.visit(db, i)
+
+    return db
+
+
+def matches(link, term):
+    """Determine if the given link matches the given term, the slow way."""
+
+    if term.kind == "name":
+        found = term.value.lower() in link.name.lower()
+
+    elif term.kind == "url":
+        found = term.value.lower() in link.url.lower()
+
+    elif term.kind == "tag":
+        found = term.value in {tag.name for tag in link.tags}
+
+    elif term.kind == "source":
+        found = link.source is not None
+        found = found and term.value.lower() in link.source.name.lower()
+
+    else:
+        op, count = term.value
+        found = {
+            ">": link.visits > count,
+            ">=": link.visits >= count,
+            "<": link.visits < count,
+            "<=": link.visits <= count,
+            "=": link.visits == count,
+        }[op]
+
+    return found != term.negated
+
+
+def explain(db, filters):
+    """Return the plan SQLite uses to find the first page of results."""
+
+    query = select(Link.id).where(*filters).order_by(Link.frecency.desc()).limit(10)
+    compiled = query.compile(db.session.connection())
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+
+    rows = db.session.connection().exec_driver_sql(
+        f"EXPLAIN QUERY PLAN {compiled}", params
+    )
+    return " / ".join(row[-1] for row in rows)
+
+
+@py.test.mark.parametrize(
+    "text,expected",
+    [
+        ("", []),
+        ("numpy array", [Term("name", "numpy", False), Term("name", "array", False)]),
+        ('"numpy array"', [Term("name", "numpy array", False)]),
+        ("#py -#function", [Term("tag", "py", False), Term("tag", "function", True)]),
+        ("source:numpy", [Term("source", "numpy", False)]),
+        ('-source:"Python Docs"', [Term("source", "Python Docs", True)]),
+        ("url:docs.python", [Term("url", "docs.python", False)]),
+        ("visits:>5", [Term("visits", (">", 5), False)]),
+        ("visits:<=2", [Term("visits", ("<=", 2), False)]),
+        ("visits:3", [Term("visits", ("=", 3), False)]),
+        ("visits:lots", [Term("name", "visits:lots", False)]),
+        ("a - b", [Term("name", n, False) for n in ["a", "-", "b"]]),
+        ('"unclosed quote', [Term("name", "unclosed quote", False)]),
+        ('# "" -', [Term("name", "-", False)]),
+        ("title:text", [Term("name", "title:text", False)]),
+    ],
+)
+def test_parse(text, expected):
+    """Ensure that queries are split into terms."""
+    assert parse(text) == expected
+
+
+def test_simple_search():
+    """Ensure that queries are only searched without the query language when they
+    mean the same thing."""
+
+    assert simple_search(parse("")) == dict(name=None, tags=None, exclude_tags=None)
+    assert simple_search(parse('"numpy array" #py -#old')) == dict(
+        name="numpy array", tags=["py"], exclude_tags=["old"]
+    )
+
+    assert simple_search(parse("numpy array")) is None
+    assert simple_search(parse("-numpy")) is None
+    assert simple_search(parse("array source:numpy")) is None
+
+
+@py.test.mark.parametrize("bitmaps", [True, False])
+@py.test.mark.parametrize("stats", [True, False])
+@py.test.mark.parametrize(
+    "text",
+    [
+        "array",
+        "array 1",
+        '"array 1"',
+        "array -1",
+        "li",
+        "#rare",
+        "#even #rare",
+        "#common -#even",
+        "-#rare -#missing",
+        "#missing",
+        "source:numpy",
+        "source:o #rare",
+        "-source:python",
+        "source:missing",
+        "url:page/5",
+        "url:page/1 -url:.html",
+        "visits:>1",
+        "visits:0 #rare",
+        "-visits:<3 array",
+        "list #even source:py visits:<2",
+    ],
+)
+def test_compile_query(small_bitmaps, bitmaps, stats, text):
+    """Ensure that compiled queries find the links that match every term, however
+    the statement is planned."""
+
+    db = create_database()
+    db.tag_bitmaps, db.link_counts = bitmaps, stats
+
+    terms = parse(text)
+    expected = [
+        link.id
+        for link in db.session.query(Link).order_by(Link.id)
+        if all(matches(link, term) for term in terms)
+    ]
+
+    links = Link.search(db, query=text, top=None)
+    assert [link.id for link in links] == expected
+
+    page = Link.search_records(db, query=text, top=7, sort="frecency")
+    ids = [link.id for link in page]
+
+    while page.cursor is not None:
+        page = Link.search_records(
+            db, query=text, top=7, sort="frecency", after=page.cursor
+        )
+        ids.extend(link.id for link in page)
+
+    assert sorted(ids) == expected
+
+
+def test_compile_query_plan(small_bitmaps):
+    """Ensure that the most selective term is used to find the links, whatever order
+    the terms are given in."""
+
+    db = create_database()
+
+    # Only the rare tag is selective enough to be worth looking up.
+    for text in ["#rare #common", "#common #rare", "array #rare", "#rare array"]:
+        plan = explain(db, compile_query(db, parse(text)))
+        assert "SCAN links USING INDEX ix_links_frecency" not in plan
+
+    plan = explain(db, compile_query(db, parse("#common array")))
+    assert "SCAN links USING INDEX ix_links_frecency" in plan
+
+    db.tag_bitmaps = False
+
+    for text in ["#common #rare", "#rare #common"]:
+        plan = explain(db, compile_query(db, parse(text)))
+        assert "ix_tag_associations_tag_id" in plan
+        assert "SCAN links USING INDEX ix_links_frecency" not in plan
+
+
+def test_link_counts():
+    """Ensure that the number of links with each tag and from each source are kept
+    up to date."""
+
+    db = create_database()
+
+    def link_counts():
+        query = "SELECT kind, item_id, links FROM link_counts ORDER BY kind, item_id"
+        return db.session.connection().exec_driver_sql(query).all()
+
+    Link.create(db, "https://example.com", name="Example", tags=["rare", "new"])
+
+    links = [(f"list 1 {i}", f"page/{i}.html", ["odd"]) for i in range(1, 100, 2)]
+    sync_links(db, 1, links)
+    db.commit()
+
+    counts = link_counts()
+    assert ("source", 1, 50) in counts
+    assert ("tag", 4, 1) in counts  # new
+    assert ("tag", 1, 200) in counts  # common
+
+    update(db.session.connection(), "tag")
+    update(db.session.connection(), "source")
+    assert link_counts() == counts
@@ -0,0 +1,206 @@
+import pathlib
+import threading
+import time
+
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+
+from llyfrau.catalog import is_cursor
+from llyfrau.cli.tui import BackgroundSearch, LinkTable
+from llyfrau.data import Database, Link
+
+
+class Recorder:
+    """Collects the results of background searches."""
+
+    def __init__(self):
+        self.results = []
+        self.done = threading.Event()
+
+    def __call__(self, results):
+        self.results.append(results)
+        self.done.set()
+
+
+def test_background_search_debounce():
+    """Ensure that searches submitted in quick succession only run the latest."""
+
+    calls = []
+    recorder = Recorder()
+
+    def search(name=None):
+        calls.append(name)
+        return [name]
+
+    searcher = BackgroundSearch(search, recorder, delay=0.2)
+
+    for name in ["n", "nu", "num", "nump", "numpy"]:
+        searcher.submit(name=name)
+
+    assert recorder.done.wait(5)
+    searcher.close()
+
+    assert calls == ["numpy"]
+    assert recorder.results == [["numpy"]]
+
+
+def test_background_search_discards_stale_results():
+    """Ensure that the results of a search superseded while running are dropped."""
+
+    started = threading.Event()
+    release = threading.Event()
+    cancelled = threading.Event()
+    recorder = Recorder()
+
+    def search(name=None):
+
+        if name == "slow":
+            started.set()
+            release.wait(5)
+
+        return [name]
+
+    def cancel():
+        cancelled.set()
+        release.set()
+
+    searcher = BackgroundSearch(search, recorder, on_cancel=cancel, delay=0)
+    searcher.submit(name="slow")
+
+    assert started.wait(5)
+    searcher.submit(name="fast")
+
+    assert cancelled.is_set()
+    assert recorder.done.wait(5)
+    searcher.close()
+
+    assert recorder.results == [["fast"]]
+
+
+def test_background_search_cancel_race():
+    """Ensure that cancelling a superseded search can't abort the search that
+    replaced it."""
+
+    started = threading.Event()
+    release = threading.Event()
+    finish = threading.Event()
+    running = []
+    cancelled = []
+    recorder = Recorder()
+
+    def search(name=None):
+        running.append(name)
+
+        if name == "slow":
+            started.set()
+            release.wait(5)
+        else:
+            finish.wait(5)
+
+        running.remove(name)
+        return [name]
+
+    def cancel():
+
+        # Let the slow search finish, giving the next search a chance to start
+        # before the cancellation takes effect.
+        release.set()
+        time.sleep(0.2)
+        cancelled.extend(running)
+
+    searcher = BackgroundSearch(search, recorder, on_cancel=cancel, delay=0)
+    searcher.submit(name="slow")
+
+    assert started.wait(5)
+    searcher.submit(name="fast")
+    finish.set()
+
+    assert recorder.done.wait(5)
+    searcher.close()
+
+    assert cancelled == []
+    assert recorder.results == [["fast"]]
+
+
+def test_background_search_errors():
+    """Ensure that a failing search doesn't stop later searches from running."""
+
+    recorder = Recorder()
+
+    def search(name=None):
+
+        if name == "bad":
+            raise ValueError(name)
+
+        return [name]
+
+    searcher = BackgroundSearch(search, recorder, delay=0)
+    searcher.submit(name="bad")
+    searcher.submit(name="good", delay=0.1)
+
+    assert recorder.done.wait(5)
+    searcher.close()
+
+    assert recorder.results == [["good"]]
+
+
+def test_background_search_no_replace():
+    """Ensure that a search can be submitted without replacing a pending search."""
+
+    recorder = Recorder()
+    searcher = BackgroundSearch(lambda name=None: [name], recorder, delay=0.2)
+
+    assert searcher.submit(name="typed")
+    assert not searcher.submit(name="prefetch", replace=False)
+
+    assert recorder.done.wait(5)
+    searcher.close()
+
+    assert recorder.results == [["typed"]]
+
+
+def test_link_table_catalog(workdir):
+    """Ensure that searches use the catalog once it has been built."""
+
+    filepath = str(pathlib.Path(workdir.name, "tui.db"))
+    db = Database(filepath, create=True)
+
+    for i in range(15):
+        Link.create(db, f"https://{i}.com", name=f"Link {i}", tags=["a"])
+
+    db.close()
+
+    with create_pipe_input() as pipe:
+        with create_app_session(input=pipe, output=DummyOutput()):
+            table = LinkTable(filepath)
+            table.searcher.close()
+
+            # The catalog is built in the background, in the meantime the database
+            # is searched instead.
+            page = table._search(table.db, query="link #a")
+            assert len(page) == 10
+            assert not is_cursor(page.cursor)
+
+            table._catalog_thread.join()
+
+            page = table._search(table.db, query="link #a")
+            assert len(page) == 10
+            assert is_cursor(page.cursor)
+
+            page = table._search(table.db, query="link #a", after=page.cursor)
+            assert len(page) == 5
+
+            # Nothing matches exactly, so fall back to a fuzzy search.
+            page = table._search(table.db, query="linkk")
+            assert len(page) > 0
+
+            # The catalog can't answer every query, those go to the database.
+            page = table._search(table.db, query="link visits:0")
+            assert len(page) == 10
+            assert not is_cursor(page.cursor)
+
+            page = table._search(table.db, query="link visits:0", after=page.cursor)
+            assert len(page) == 5
+
+            table.catalog.close()